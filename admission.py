@@ -0,0 +1,283 @@
+"""
+Rate-limit-aware admission control for model calls.
+
+Every session shares one API key, so model calls are admitted through a pair
+of token buckets sized to the key's quota: requests per minute (RPM) and
+tokens per minute (TPM). Calls that do not fit wait in per-session queues
+instead of failing with 429s. When capacity frees up, the next call is
+picked among the sessions' queue heads by priority: the size of the
+document it belongs to, so short documents go first, minus an aging bonus
+so large ones are never starved. Ties go to the session served least
+recently.
+
+Buckets live in a store. MemoryBucketStore coordinates one process;
+SqliteBucketStore shares the quota between all replicas on a host.
+"""
+import asyncio
+import collections
+import contextlib
+import contextvars
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# --- CONSTANTS ---
+DEFAULT_RPM = 1000
+DEFAULT_TPM = 1_000_000
+# Output tokens assumed per call when reserving TPM capacity
+DEFAULT_OUTPUT_TOKENS = 1024
+# Priority points (document tokens) a waiting call gains per second
+AGING_TOKENS_PER_SECOND = 2000
+DEFAULT_SESSION = "default"
+
+logger = logging.getLogger(__name__)
+
+# (session, priority) of the generation run the current task belongs to
+_scope = contextvars.ContextVar("admission_scope", default=(DEFAULT_SESSION, 0))
+
+
+async def run_scoped(coro, session=None, priority=0):
+    """
+    Runs `coro` with its model calls attributed to `session` at `priority`
+    (lower goes first). Tasks spawned by `coro` inherit the scope.
+    """
+    _scope.set((session or DEFAULT_SESSION, priority))
+    return await coro
+
+
+def _take(levels, requests, now):
+    # Refills the buckets in `levels` ({name: (level, updated_at)}) and takes
+    # every request's amount, or none of them. Returns (wait, new_levels)
+    # where wait is 0 on success, else seconds until all amounts fit.
+    wait = 0.0
+    updated = {}
+    for name, amount, rate, capacity in requests:
+        level, updated_at = levels.get(name, (capacity, now))
+        level = min(capacity, level + max(0.0, now - updated_at) * rate)
+        amount = min(amount, capacity)
+        if level < amount:
+            wait = max(wait, (amount - level) / rate)
+        updated[name] = (level, amount)
+    if wait:
+        return wait, {name: (level, now) for name, (level, _) in updated.items()}
+    return 0.0, {name: (level - amount, now) for name, (level, amount) in updated.items()}
+
+
+class MemoryBucketStore:
+    """
+    Token buckets shared within one process.
+    """
+
+    def __init__(self):
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def take(self, requests):
+        """
+        Takes `(name, amount, rate_per_second, capacity)` from every bucket
+        atomically. Returns 0 on success, else the seconds to wait.
+        """
+        with self._lock:
+            wait, levels = _take(self._levels, requests, time.time())
+            self._levels.update(levels)
+            return wait
+
+    def drain(self, name):
+        """
+        Empties a bucket, e.g. after the provider answered 429.
+        """
+        with self._lock:
+            self._levels[name] = (0.0, time.time())
+
+
+class SqliteBucketStore:
+    """
+    Token buckets in a SQLite file, shared by every process and replica that
+    opens the same path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        store_dir = os.path.dirname(path)
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " name TEXT PRIMARY KEY,"
+                " level REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def take(self, requests):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                names = [name for name, _, _, _ in requests]
+                marks = ",".join("?" * len(names))
+                rows = conn.execute(f"SELECT name, level, updated_at FROM buckets WHERE name IN ({marks})", names)
+                wait, levels = _take({name: (level, at) for name, level, at in rows}, requests, time.time())
+                conn.executemany(
+                    "INSERT OR REPLACE INTO buckets (name, level, updated_at) VALUES (?, ?, ?)",
+                    [(name, level, at) for name, (level, at) in levels.items()],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def drain(self, name):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, level, updated_at) VALUES (?, 0, ?)",
+                (name, time.time()),
+            )
+
+
+class _Waiter:
+    def __init__(self, tokens, priority, future):
+        self.tokens = tokens
+        self.priority = priority
+        self.future = future
+        self.since = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Admits model calls within `rpm` requests and `tpm` tokens per minute.
+    acquire() must be awaited on the GeminiClient's event loop.
+    """
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, store=None, output_tokens=DEFAULT_OUTPUT_TOKENS):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.store = store or MemoryBucketStore()
+        self.output_tokens = output_tokens
+        self._queues = collections.OrderedDict()
+        self._served = {}
+        self._ticks = itertools.count()
+        self._queued_requests = 0
+        self._queued_tokens = 0
+        self._wakeup = None
+        self._dispatcher = None
+
+    def _buckets(self, tokens):
+        return [
+            ("rpm", 1, self.rpm / 60, self.rpm),
+            ("tpm", tokens, self.tpm / 60, self.tpm),
+        ]
+
+    async def acquire(self, prompt_tokens):
+        """
+        Waits until a call with `prompt_tokens` input tokens fits the quota
+        and it is this call's turn.
+        """
+        session, priority = _scope.get()
+        tokens = prompt_tokens + self.output_tokens
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+        waiter = _Waiter(tokens, priority, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(session, collections.deque()).append(waiter)
+        self._queued_requests += 1
+        self._queued_tokens += tokens
+        self._wakeup.set()
+        start = time.perf_counter()
+        try:
+            await waiter.future
+        finally:
+            if not waiter.future.done():
+                # Cancelled while queued: the dispatcher skips it
+                waiter.future.cancel()
+            metrics.observe("admission_wait_seconds", time.perf_counter() - start)
+
+    async def aclose(self):
+        """
+        Stops the dispatcher; calls still queued are never admitted.
+        """
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._dispatcher
+            self._dispatcher = None
+            self._wakeup = None
+
+    def throttle(self):
+        """
+        Pauses admissions until the request bucket refills; called when the
+        provider rejects a call with 429 despite the local accounting.
+        """
+        self.store.drain("rpm")
+
+    def expected_wait(self):
+        """
+        Rough seconds until the calls queued now have all been admitted.
+        """
+        return max(self._queued_requests * 60 / self.rpm, self._queued_tokens * 60 / self.tpm)
+
+    def _release(self, waiter):
+        self._queued_requests -= 1
+        self._queued_tokens -= waiter.tokens
+
+    def _next(self):
+        # Queue head with the lowest aged priority; ties go to the session
+        # served least recently
+        now = time.monotonic()
+        best = None
+        for session, queue in list(self._queues.items()):
+            while queue and queue[0].future.done():
+                self._release(queue.popleft())
+            if not queue:
+                del self._queues[session]
+                continue
+            head = queue[0]
+            score = (head.priority - AGING_TOKENS_PER_SECOND * (now - head.since), self._served.get(session, -1))
+            if best is None or score < best[0]:
+                best = (score, session)
+        return None if best is None else best[1]
+
+    async def _dispatch(self):
+        while True:
+            session = self._next()
+            if session is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            head = self._queues[session][0]
+            try:
+                wait = self.store.take(self._buckets(head.tokens))
+            except Exception:
+                # A broken shared store must not stall every session
+                logger.exception("Admission store error, admitting without a quota check")
+                wait = 0
+            if wait:
+                # Sleep until capacity frees up, or re-pick on new arrivals
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._queues[session].popleft()
+            self._release(head)
+            self._served[session] = next(self._ticks)
+            if not head.future.done():
+                head.future.set_result(None)
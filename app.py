@@ -1,236 +1,49 @@
 import streamlit as st
-import google.generativeai as genai
-import PyPDF2
-import json
+import logging
 import os
-import gspread
+import time
+import uuid
 from datetime import datetime
 from dotenv import load_dotenv
+from admission import DEFAULT_RPM, DEFAULT_TPM, AdmissionController, SqliteBucketStore
+from doc_context import DEFAULT_TTL as DEFAULT_CONTEXT_TTL, DocumentContexts
+from extraction import DEFAULT_PAGE_TIMEOUT
+from fake_gemini import FakeGeminiTransport
+from feedback import DEFAULT_SHEET_NAME, FeedbackSink, GspreadBackend, InMemorySheetsBackend
+from gemini_client import GeminiClient, GeminiTransport
+import metrics
+from generation import DEFAULT_MAX_CONCURRENCY, MAX_PROMPT_TOKENS, MODEL_NAME, PROMPT_VERSION
+from jobs import DONE, EXTRACTING, FAILED, GENERATING, MERGING, PARTIAL, JobManager
+from kit_store import DEFAULT_MAX_KITS, KitStore
+from ocr import DEFAULT_LANGUAGE, DEFAULT_PAGE_BUDGET
+from parsing import SECTIONS
+from pipeline import build_study_kit, generate_more, kit_cache_key, text_store_key
+from study_cache import PageTextCache, StudyKitCache, TextStore
+from uploads import spool_upload
+
+script_start = time.perf_counter()
 
 # --- LOAD ENVIRONMENT VARIABLES ---
 load_dotenv()
 
 # --- CONSTANTS ---
 LOCAL_GSPREAD_KEY_FILE = "lfpdf-479215-51af785aa8fa.json"
+STYLESHEET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "style.css")
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(page_title="AutoStudy AI", page_icon="🧠", layout="wide")
 
-# --- HIDE STREAMLIT STYLE ---
-hide_st_style = """
-            <style>
-            #MainMenu {visibility: hidden;}
-            header {visibility: hidden;}
-            footer {visibility: hidden;}
-            </style>
-            """
-st.markdown(hide_st_style, unsafe_allow_html=True)
-
 # --- CSS STYLING ---
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;600;700&display=swap');
-
-    /* Global Theme */
-    .stApp {
-        background-color: #f4f6f8;
-        font-family: 'Inter', sans-serif;
-    }
-    
-    h1, h2, h3 {
-        color: #1e293b;
-        font-weight: 700;
-    }
-    
-    /* Hero Section Styling */
-    .hero-title {
-        font-size: 3.5rem;
-        font-weight: 800;
-        text-align: center;
-        background: linear-gradient(90deg, #4F46E5, #9333EA);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        margin-bottom: 0.5rem;
-    }
-    
-    .hero-subtitle {
-        font-size: 1.2rem;
-        text-align: center;
-        color: #64748b;
-        margin-bottom: 2rem;
-        font-weight: 400;
-    }
-
-    /* Floating Card Container Styling */
-    div[data-testid="stVerticalBlockBorderWrapper"] {
-        background-color: white;
-        border-radius: 20px;
-        border: 1px solid #e0e0e0;
-        box-shadow: 0 10px 25px -5px rgba(0, 0, 0, 0.05), 0 8px 10px -6px rgba(0, 0, 0, 0.01);
-        padding: 20px;
-    }
-
-    /* Index Card Styling for Summary */
-    .summary-card {
-        background-color: white;
-        padding: 20px;
-        border-radius: 12px;
-        box-shadow: 0 4px 6px rgba(0,0,0,0.05);
-        margin-bottom: 15px;
-        transition: transform 0.2s ease, box-shadow 0.2s ease;
-        height: 100%;
-        border: 1px solid #e2e8f0;
-    }
-    .summary-card:hover {
-        transform: translateY(-3px);
-        box-shadow: 0 8px 15px rgba(0,0,0,0.1);
-    }
-    .summary-number {
-        color: #4F46E5;
-        font-weight: 700;
-        font-size: 1.1em;
-        margin-bottom: 8px;
-        display: block;
-    }
-
-    /* Quiz Card Styling */
-    .quiz-container {
-        background-color: white;
-        padding: 20px;
-        border-radius: 12px;
-        border-left: 5px solid #6C63FF;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-        margin-bottom: 20px;
-    }
-    
-    /* Spinner Text */
-    .stSpinner > div > div {
-        color: #4F46E5;
-        font-weight: 600;
-    }
-
-    /* --- DARK MODE SUPPORT --- */
-    @media (prefers-color-scheme: dark) {
-        .stApp {
-            background-color: #0E1117;
-            color: #FAFAFA;
-        }
-        h1, h2, h3 {
-            color: #F0F2F6;
-        }
-        .hero-subtitle {
-            color: #BFC5D3;
-        }
-        div[data-testid="stVerticalBlockBorderWrapper"] {
-            background-color: #1F242C;
-            border: 1px solid #384455;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.3);
-        }
-        .summary-card {
-            background-color: #1F242C;
-            border: 1px solid #384455;
-            color: #E0E0E0;
-            box-shadow: none;
-        }
-        .summary-card:hover {
-            background-color: #262B33;
-            box-shadow: 0 4px 12px rgba(0,0,0,0.4);
-        }
-        .summary-number {
-            color: #818CF8;
-        }
-        .quiz-container {
-            background-color: #1F242C;
-            border-left: 5px solid #818CF8;
-            color: #E0E0E0;
-            box-shadow: none;
-        }
-        p, li, span {
-            color: #E0E0E0;
-        }
-    }
-
-    /* --- MAGIC WAND BUTTON STYLING (SPECIFIC TARGETING) --- */
-    /* Target buttons that contain the specific icon-only logic via aria-label */
-    div.stButton > button[aria-label="Generate"] {
-        display: inline-flex;
-        align-items: center;
-        justify-content: center;
-        width: 100%; 
-        height: 100%;
-        min-height: 45px; /* Match input height roughly */
-        padding: 0;
-        color: transparent !important; /* Hide text */
-    }
-
-    /* Inject SVG icon using mask-image for currentColor support */
-    div.stButton > button[aria-label="Generate"]::before {
-        content: "";
-        width: 24px;
-        height: 24px;
-        background-color: currentColor;
-        mask-image: url("data:image/svg+xml;utf8,<svg xmlns='http://www.w3.org/2000/svg' width='24' height='24' viewBox='0 0 24 24' fill='none' stroke='currentColor' stroke-width='2' stroke-linecap='round' stroke-linejoin='round'><path d='M15 4V2'/><path d='M15 16v-2'/><path d='M8 9h2'/><path d='M20 9h2'/><path d='M17.8 11.8L19 13'/><path d='M15 9l-1 1'/><path d='M17.8 6.2L19 5'/><path d='M3 21l9-9'/><path d='M12.2 6.2L11 5'/></svg>");
-        -webkit-mask-image: url("data:image/svg+xml;utf8,<svg xmlns='http://www.w3.org/2000/svg' width='24' height='24' viewBox='0 0 24 24' fill='none' stroke='currentColor' stroke-width='2' stroke-linecap='round' stroke-linejoin='round'><path d='M15 4V2'/><path d='M15 16v-2'/><path d='M8 9h2'/><path d='M20 9h2'/><path d='M17.8 11.8L19 13'/><path d='M15 9l-1 1'/><path d='M17.8 6.2L19 5'/><path d='M3 21l9-9'/><path d='M12.2 6.2L11 5'/></svg>");
-        mask-size: contain;
-        -webkit-mask-size: contain;
-        mask-repeat: no-repeat;
-        -webkit-mask-repeat: no-repeat;
-    }
-
-    /* --- CUSTOM FEEDBACK SUCCESS BOX --- */
-    .success-box {
-        background-color: #dcfce7; /* Green-100 */
-        border: 1px solid #86efac; /* Green-300 */
-        color: #166534; /* Green-800 */
-        padding: 16px;
-        border-radius: 8px;
-        margin-bottom: 20px;
-        position: relative;
-        font-weight: 500;
-    }
-
-    /* --- POSITIONING THE DISMISS BUTTON (SUCCESS) --- */
-    /* Target the button with label '✖' (Heavy Multiplication X) */
-    button[aria-label="✖"] {
-        position: absolute !important;
-        top: -55px !important; /* Pull it up into the box (adjust based on box height) */
-        right: 10px !important;
-        background: transparent !important;
-        border: none !important;
-        color: #166534 !important;
-        font-size: 1.2rem !important;
-        z-index: 100;
-    }
-    button[aria-label="✖"]:hover {
-        color: #b91c1c !important;
-        background-color: rgba(255,255,255,0.5) !important;
-    }
-
-    /* --- POSITIONING THE CARD CLOSE BUTTON --- */
-    /* Target the button with label '✕' (Multiplication X) */
-    button[aria-label="✕"] {
-        border: none !important;
-        background: transparent !important;
-        color: #64748b !important;
-        font-size: 1.2rem !important;
-        padding: 0 !important;
-        margin: 0 !important;
-        display: flex;
-        justify-content: flex-end;
-    }
-    button[aria-label="✕"]:hover {
-        color: #ef4444 !important;
-        background: transparent !important;
-    }
-    
-    /* Force right alignment for the card close button container */
-    div[data-testid="stHorizontalBlock"] > div:nth-child(2) {
-        display: flex;
-        justify-content: flex-end;
-    }
+@st.cache_resource
+def load_stylesheet():
+    """
+    Reads the app's stylesheet once per process; every rerun injects the
+    cached markup with a single call.
+    """
+    with open(STYLESHEET_PATH, "r", encoding="utf-8") as f:
+        return f"<style>\n{f.read()}</style>"
 
-</style>
-""", unsafe_allow_html=True)
+st.markdown(load_stylesheet(), unsafe_allow_html=True)
 
 # --- API KEY LOGIC ---
 api_key = None
@@ -251,12 +64,198 @@ if not api_key:
 
 # --- HELPER FUNCTIONS ---
 
+def get_setting(name, default=None):
+    """
+    Reads a configuration value from Streamlit secrets, then the environment,
+    falling back to `default`.
+    """
+    try:
+        if name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        pass
+    return os.getenv(name, default)
+
+@st.cache_resource
+def get_model_client(api_key):
+    """
+    Creates the shared async model client once per process (and API key).
+    Set GEMINI_TRANSPORT=fake to run against the local fake backend.
+    Calls are admitted within the key's GEMINI_RPM / GEMINI_TPM quota; set
+    ADMISSION_STORE to a SQLite path to share that quota between replicas.
+    """
+    if get_setting("GEMINI_TRANSPORT", "gemini") == "fake":
+        transport = FakeGeminiTransport(
+            latency=float(get_setting("FAKE_GEMINI_LATENCY", 0.5)),
+            error_rate=float(get_setting("FAKE_GEMINI_ERROR_RATE", 0.0)),
+        )
+    else:
+        transport = GeminiTransport(api_key, MODEL_NAME)
+    store_path = get_setting("ADMISSION_STORE")
+    admission = AdmissionController(
+        rpm=int(get_setting("GEMINI_RPM", DEFAULT_RPM)),
+        tpm=int(get_setting("GEMINI_TPM", DEFAULT_TPM)),
+        store=SqliteBucketStore(store_path) if store_path else None,
+    )
+    return GeminiClient(transport, max_concurrency=int(get_setting("MAX_CONCURRENT_REQUESTS", 8)),
+                        admission=admission)
+
+@st.cache_resource
+def get_document_contexts(api_key):
+    """
+    Creates the document context registry for the model client, or None when
+    DOCUMENT_CONTEXTS is off. Repeat requests for a document then refer to
+    its uploaded text instead of re-sending it.
+    """
+    if str(get_setting("DOCUMENT_CONTEXTS", "true")).lower() != "true":
+        return None
+    ttl = int(get_setting("DOCUMENT_CONTEXT_TTL", DEFAULT_CONTEXT_TTL))
+    return DocumentContexts(get_model_client(api_key), ttl=ttl)
+
+@st.cache_resource
+def get_study_cache():
+    """
+    Creates the on-disk study kit cache once per process.
+    The directory is shared by all sessions and worker processes on the node.
+    """
+    cache_dir = get_setting("STUDY_CACHE_DIR", os.path.join(".cache", "study_kits"))
+    max_mb = int(get_setting("STUDY_CACHE_MAX_MB", 256))
+    return StudyKitCache(cache_dir, max_bytes=max_mb * 1024 * 1024)
+
+@st.cache_resource
+def get_text_store():
+    """
+    Creates the on-disk store of extracted document text once per process.
+    Sessions keep only the PDF's content hash, not the text itself.
+    """
+    text_dir = get_setting("TEXT_STORE_DIR", os.path.join(".cache", "texts"))
+    max_mb = int(get_setting("TEXT_STORE_MAX_MB", 512))
+    return TextStore(text_dir, max_bytes=max_mb * 1024 * 1024)
+
+@st.cache_resource
+def get_page_cache():
+    """
+    Creates the per-page text cache once per process, so re-uploaded decks
+    only parse the pages that changed.
+    """
+    path = get_setting("PAGE_CACHE_PATH", os.path.join(".cache", "pages.sqlite3"))
+    max_mb = int(get_setting("PAGE_CACHE_MAX_MB", 256))
+    return PageTextCache(path, max_bytes=max_mb * 1024 * 1024)
+
+@st.cache_resource
+def get_ocr_cache():
+    """
+    Creates the OCR text cache once per process, keyed by page image hash.
+    """
+    path = get_setting("OCR_CACHE_PATH", os.path.join(".cache", "ocr.sqlite3"))
+    max_mb = int(get_setting("OCR_CACHE_MAX_MB", 256))
+    return PageTextCache(path, max_bytes=max_mb * 1024 * 1024)
+
+@st.cache_resource
+def get_chunk_cache():
+    """
+    Creates the per-chunk kit cache once per process, so only changed parts
+    of a re-uploaded document are sent to the model.
+    """
+    cache_dir = get_setting("CHUNK_CACHE_DIR", os.path.join(".cache", "chunk_kits"))
+    max_mb = int(get_setting("CHUNK_CACHE_MAX_MB", 256))
+    return StudyKitCache(cache_dir, max_bytes=max_mb * 1024 * 1024)
+
+@st.cache_resource
+def get_embedder():
+    """
+    Creates the text embedder once per process, or None when EMBEDDER is
+    off. It drops reworded duplicate flashcards and quiz questions and picks
+    representative passages of documents over DOCUMENT_TOKEN_BUDGET.
+    """
+    # Imported on first use: the vector index pulls in NumPy
+    from vector_index import make_embedder
+
+    return make_embedder(get_setting("EMBEDDER", "hashing"))
+
+@st.cache_resource
+def get_vector_index_store():
+    """
+    Creates the on-disk store of passage embeddings once per process.
+    """
+    from vector_index import VectorIndexStore
+
+    index_dir = get_setting("VECTOR_INDEX_DIR", os.path.join(".cache", "vectors"))
+    max_mb = int(get_setting("VECTOR_INDEX_MAX_MB", 256))
+    return VectorIndexStore(index_dir, max_bytes=max_mb * 1024 * 1024)
+
+@st.cache_resource
+def setup_metrics():
+    """
+    Starts the metrics exporters once per process: a Prometheus endpoint on
+    METRICS_HOST:METRICS_PORT and/or JSON span logs when METRICS_LOG is true.
+    """
+    port = get_setting("METRICS_PORT")
+    if port:
+        metrics.start_http_server(int(port), get_setting("METRICS_HOST", metrics.DEFAULT_HTTP_HOST))
+    if str(get_setting("METRICS_LOG", "false")).lower() == "true":
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        metrics.logger.addHandler(handler)
+        metrics.logger.setLevel(logging.INFO)
+        metrics.REGISTRY.log_spans = True
+    return metrics.REGISTRY
+
+def render_debug_panel():
+    """
+    Sidebar summary of hot-path timings (enable with DEBUG_PANEL=true or ?debug=1).
+    """
+    with st.sidebar.expander("⏱️ Performance", expanded=False):
+        rows = metrics.REGISTRY.summary()
+        if not rows:
+            st.caption("No measurements yet.")
+            return
+        st.dataframe(rows, hide_index=True)
+        st.caption("Most recent spans")
+        st.dataframe(list(metrics.REGISTRY.spans)[-20:][::-1], hide_index=True)
+
+@st.cache_resource
+def get_job_manager():
+    """
+    Creates the background job manager once per process.
+    """
+    store_dir = get_setting("JOB_STORE_DIR", os.path.join(".cache", "jobs"))
+    max_mb = int(get_setting("JOB_STORE_MAX_MB", 64))
+    return JobManager(store_dir, workers=int(get_setting("JOB_WORKERS", 4)), max_bytes=max_mb * 1024 * 1024)
+
+@st.cache_resource
+def get_kit_store():
+    """
+    Creates the persistent store of users' study kits once per process.
+    """
+    path = get_setting("KIT_STORE_PATH", os.path.join(".cache", "kits.sqlite3"))
+    return KitStore(path, max_kits=int(get_setting("KIT_STORE_MAX_KITS", DEFAULT_MAX_KITS)))
+
+def get_pipeline_options():
+    """
+    Extraction and generation settings passed along with each job.
+    """
+    return {
+        "workers": int(get_setting("EXTRACT_WORKERS", 0)) or None,
+        "page_timeout": float(get_setting("EXTRACT_PAGE_TIMEOUT", DEFAULT_PAGE_TIMEOUT)),
+        "max_concurrency": int(get_setting("MAX_CONCURRENT_CHUNKS", DEFAULT_MAX_CONCURRENCY)),
+        "max_prompt_tokens": int(get_setting("MAX_PROMPT_TOKENS", MAX_PROMPT_TOKENS)),
+        "split_sections": str(get_setting("SECTION_REQUESTS", "true")).lower() == "true",
+        "ocr_budget": int(get_setting("OCR_PAGE_BUDGET", DEFAULT_PAGE_BUDGET)),
+        "ocr_language": get_setting("OCR_LANGUAGE", DEFAULT_LANGUAGE),
+        "document_token_budget": int(get_setting("DOCUMENT_TOKEN_BUDGET", 0)) or None,
+        "layout": str(get_setting("LAYOUT_EXTRACTION", "true")).lower() == "true",
+    }
+
 @st.cache_resource
 def get_gspread_client():
     """
     Initializes the Gspread client with conditional authentication.
     Checks Streamlit secrets first, then local file.
     """
+    # Imported on first use: gspread is the slowest import in the app
+    import gspread
+
     try:
         # 1. Check Cloud/Secrets First
         try:
@@ -279,109 +278,58 @@ def get_gspread_client():
         st.error(f"Authentication Error: {e}")
         return None
 
+@st.cache_resource
+def get_feedback_sink():
+    """
+    Creates the buffered feedback sink once per process.
+    Rows are spooled locally and flushed to Google Sheets in batches.
+    Set FEEDBACK_BACKEND=memory to keep feedback in a local stand-in instead.
+    """
+    if get_setting("FEEDBACK_BACKEND", "sheets") == "memory":
+        backend = InMemorySheetsBackend()
+    else:
+        client = get_gspread_client()
+        if not client:
+            return None
+        backend = GspreadBackend(client, get_setting("SHEET_NAME", DEFAULT_SHEET_NAME))
+
+    return FeedbackSink(
+        backend,
+        spool_path=get_setting("FEEDBACK_SPOOL_PATH", os.path.join(".cache", "feedback_spool.sqlite3")),
+        batch_size=int(get_setting("FEEDBACK_BATCH_SIZE", 20)),
+        flush_interval=float(get_setting("FEEDBACK_FLUSH_INTERVAL", 5.0)),
+    )
+
 def submit_feedback(rating, comment):
     """
-    Submits feedback to Google Sheets.
+    Queues feedback for Google Sheets. Returns as soon as the row is
+    spooled; a background flusher sends it.
     """
-    client = get_gspread_client()
-    if not client:
+    sink = get_feedback_sink()
+    if not sink:
         return
 
     try:
-        # Open the spreadsheet
-        sheet_name = None
-        
-        # 1. Try Secrets
-        try:
-            sheet_name = st.secrets.get("SHEET_NAME")
-        except Exception:
-            pass
-        
-        # 2. Try Environment Variable if not in secrets
-        if not sheet_name:
-            sheet_name = os.getenv("SHEET_NAME")
-            
-        # 3. Fallback default
-        if not sheet_name:
-            sheet_name = "LearnFromPDF_Feedback"
-        
-        # Open the sheet - handle potential errors if sheet doesn't exist
-        try:
-            sh = client.open(sheet_name)
-        except gspread.SpreadsheetNotFound:
-             # Create if it doesn't exist (optional, but good for first run)
-             try:
-                sh = client.create(sheet_name)
-                sh.share(client.auth.service_account_email, perm_type='user', role='owner')
-             except:
-                 st.error(f"Spreadsheet '{sheet_name}' not found and could not be created.")
-                 return
-
-        worksheet = sh.get_worksheet(0)
-
-        # Append row
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         # Use a simple session ID or generate one if not present
         if 'session_id' not in st.session_state:
-            import uuid
             st.session_state['session_id'] = str(uuid.uuid4())
         
         session_id = st.session_state['session_id']
         
-        worksheet.append_row([timestamp, rating, comment, session_id])
+        with metrics.span("submit_feedback"):
+            sink.submit([timestamp, rating, comment, session_id])
         return True
         
     except Exception as e:
         st.error(f"Error saving feedback: {e}")
         return False
 
-def extract_text_from_pdf(pdf_file):
-    """
-    Extracts text from an uploaded PDF file.
-    """
-    try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() or ""
-        return text
-    except Exception as e:
-        st.error(f"Error reading PDF: {e}")
-        return None
-
-def generate_study_material(text_content, api_key):
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-
-        prompt = f"""
-        You are an expert educational AI. Analyze the text and produce structured study content.
-        
-        TEXT TO ANALYZE:
-        {text_content[:30000]}
-        
-        OUTPUT FORMAT (JSON ONLY):
-        {{
-            "summary_points": ["Point 1", "Point 2", "Point 3", "Point 4"],
-            "flashcards": [
-                {{"question": "Question?", "answer": "Answer"}}
-            ],
-            "quiz": [
-                {{"question": "Question?", "options": ["A", "B", "C", "D"], "correct_answer": "A"}}
-            ]
-        }}
-        """
-        
-        response = model.generate_content(prompt)
-        clean_text = response.text.replace("```json", "").replace("```", "")
-        return json.loads(clean_text)
-    except Exception as e:
-        st.error(f"AI Error: {e}")
-        return None
-
 def process_generation(uploaded_file, status_container=None):
     """
     Handles the generation logic for PDF files.
+    Cached kits are shown right away; anything else is queued as a
+    background job that the UI polls by job ID.
     """
     msg_container = status_container if status_container else st
 
@@ -393,25 +341,365 @@ def process_generation(uploaded_file, status_container=None):
         msg_container.warning("Please upload a PDF file first.")
         return
 
-    # Execute spinner and messages within the container context
-    with msg_container:
-        with st.spinner("✨ Reading PDF & Generating content..."):
-            # 1. Extract Text
-            text_to_process = extract_text_from_pdf(uploaded_file)
-            
-            if not text_to_process:
-                st.error("Could not extract text from the PDF. It might be empty or scanned.")
-                return
-
-            st.session_state['study_material'] = text_to_process
-
-            # 2. Generate Study Material
-            data = generate_study_material(text_to_process, api_key)
-            if data:
-                st.session_state['generated_data'] = data
-                st.session_state['show_feedback'] = True # Enable feedback on success
-                st.session_state['feedback_submitted'] = False # Reset submission state
-                st.rerun() # Rerun to display results
+    # Uploads above the per-session memory cap are spooled to disk
+    memory_cap = int(float(get_setting("SESSION_MEMORY_CAP_MB", 16)) * 1024 * 1024)
+    spool_dir = get_setting("UPLOAD_SPOOL_DIR", os.path.join(".cache", "uploads"))
+    source = spool_upload(uploaded_file, spool_dir, memory_cap)
+    st.session_state['document_id'] = source.digest
+    st.session_state['document_name'] = uploaded_file.name
+    cache = get_study_cache()
+    options = get_pipeline_options()
+
+    # 1. Serve previously generated kits for the same PDF and options from the cache
+    data = cache.get(kit_cache_key(source.digest, options))
+    if data:
+        source.discard()
+        # An earlier job must not replace this kit when it finishes
+        st.session_state['job_id'] = None
+        st.query_params.pop("job", None)
+        show_kit(data)
+        st.rerun()
+
+    # 2. Queue extraction + generation as a background job
+    client = get_model_client(api_key)
+    text_store = get_text_store()
+    page_cache = get_page_cache()
+    chunk_cache = get_chunk_cache()
+    ocr_cache = get_ocr_cache()
+    contexts = get_document_contexts(api_key)
+    embedder = get_embedder()
+    index_store = get_vector_index_store()
+    session_id = st.session_state['session_id']
+
+    def run_job(source, options, job):
+        try:
+            return build_study_kit(source, client, cache, options, report=job.report,
+                                   on_item=job.add_item, text_store=text_store,
+                                   page_cache=page_cache, chunk_cache=chunk_cache, ocr_cache=ocr_cache,
+                                   contexts=contexts, session=session_id,
+                                   embedder=embedder, index_store=index_store)
+        finally:
+            source.discard()
+
+    job_id = get_job_manager().submit(source, options, run_job)
+    st.session_state['job_id'] = job_id
+    st.query_params["job"] = job_id # Lets a page reload re-attach to the job
+    st.session_state['generated_data'] = None
+    st.session_state['kit_id'] = None
+    st.query_params.pop("kit", None)
+    st.session_state['show_feedback'] = False
+
+def request_more(section):
+    """
+    Adds more items to one section of the current kit, leaving the rest of
+    it untouched. Each click draws on another part of the document.
+    """
+    document_id = st.session_state.get('document_id')
+    options = get_pipeline_options()
+    text = get_text_store().get(text_store_key(document_id, options)) if document_id else None
+    if not text:
+        st.warning("The original document is no longer available. Please upload it again.")
+        return
+
+    data = st.session_state['generated_data']
+    rounds = st.session_state.setdefault('more_rounds', {})
+    round_key = (document_id, section)
+    with st.spinner("Generating more..."):
+        try:
+            items = generate_more(text, get_model_client(api_key), section, data.get(section, []),
+                                  rounds.get(round_key, 0), options,
+                                  contexts=get_document_contexts(api_key),
+                                  session=st.session_state['session_id'],
+                                  embedder=get_embedder(), index_store=get_vector_index_store())
+        except Exception as e:
+            st.error(f"Error generating content: {e}")
+            return
+    rounds[round_key] = rounds.get(round_key, 0) + 1
+
+    if not items:
+        st.info("No new items found this time. Try again to draw on another part of the document.")
+        return
+    data[section] = data.get(section, []) + items
+    save_current_kit()
+    st.rerun()
+
+def save_current_kit():
+    """
+    Saves the session's current kit to the kit store under the session's
+    ID and puts its kit ID in the URL, so a reload reopens it locally.
+    """
+    document_id = st.session_state.get('document_id')
+    data = st.session_state.get('generated_data')
+    if not document_id or not data:
+        return
+    try:
+        kit_id = get_kit_store().save(st.session_state['session_id'], document_id, data,
+                                      st.session_state.get('document_name'))
+    except Exception:
+        # The kit is still shown; it just cannot be reopened later
+        logging.getLogger(__name__).exception("Could not save the study kit")
+        return
+    st.session_state['kit_id'] = kit_id
+    st.query_params["kit"] = kit_id
+
+def show_kit(data, warning=None):
+    """
+    Makes `data` the session's current kit and saves it. A `warning` (e.g.
+    for an incomplete kit) is shown above it.
+    """
+    st.session_state['generated_data'] = data
+    st.session_state['kit_warning'] = warning
+    st.session_state['show_feedback'] = True # Enable feedback on success
+    st.session_state['feedback_submitted'] = False # Reset submission state
+    save_current_kit()
+
+def open_stored_kit(kit_id):
+    """
+    Loads one of the session's saved kits from the kit store; returns False
+    if it no longer exists or belongs to another session. A job still
+    running for this session is detached, so its result does not replace
+    the opened kit.
+    """
+    record = get_kit_store().get(kit_id, st.session_state['session_id'])
+    if record is None:
+        return False
+    st.session_state['job_id'] = None
+    st.query_params.pop("job", None)
+    st.session_state['generated_data'] = record.data
+    st.session_state['kit_warning'] = None
+    st.session_state['document_id'] = record.document
+    st.session_state['document_name'] = record.name
+    st.session_state['kit_id'] = record.id
+    st.query_params["kit"] = record.id
+    return True
+
+def render_saved_kits():
+    """
+    Sidebar list of the session's saved kits; opening one is a local read.
+    """
+    records = get_kit_store().list_for_owner(st.session_state['session_id'],
+                                             limit=int(get_setting("SAVED_KITS_SHOWN", 10)))
+    if not records:
+        return
+    with st.sidebar:
+        st.markdown("### 📚 Your Study Kits")
+        for record in records:
+            st.button(f"📄 {record.name or 'Untitled PDF'}", key=f"open_kit_{record.id}",
+                      on_click=open_stored_kit, args=(record.id,), use_container_width=True,
+                      disabled=record.id == st.session_state.get('kit_id'))
+            updated = datetime.fromtimestamp(record.updated_at).strftime("%Y-%m-%d %H:%M")
+            st.caption(f"{updated} · {record.describe()}")
+
+# --- RENDERING ---
+
+SECTION_TITLES = {
+    "summary_points": "### 📌 Key Concepts",
+    "flashcards": "### 🗂️ Flashcards",
+    "quiz": "### 📝 Self-Test",
+}
+
+def summary_card_html(number, point):
+    return f"""
+    <div class="summary-card">
+        <span class="summary-number">#{number}</span>
+        {point}
+    </div>
+    """
+
+def render_summary_card(number, point):
+    st.markdown(summary_card_html(number, point), unsafe_allow_html=True)
+
+def render_flashcard(card):
+    with st.container(border=True):
+        st.markdown(f"**Q: {card['question']}**")
+        with st.expander("Reveal Answer"):
+            st.write(card['answer'])
+
+def correct_option(q):
+    """
+    Full text of a question's correct option, e.g. "B) Mitochondria".
+    """
+    return next((opt for opt in q['options'] if opt.startswith(q['correct_answer'])), q['correct_answer'])
+
+def prepare_kit(data):
+    """
+    Pre-renders the parts of a kit that do not change between reruns: the
+    summary card HTML and each question's correct option. Memoized in the
+    session until the kit is replaced or grows.
+    """
+    signature = tuple(len(data.get(section, [])) for section in SECTIONS)
+    prepared = st.session_state.get('prepared_kit')
+    if prepared and prepared['data'] is data and prepared['signature'] == signature:
+        return prepared
+
+    answers = prepared['answers'] if prepared and prepared['data'] is data else {}
+    prepared = {
+        'data': data,
+        'signature': signature,
+        'summary_html': [summary_card_html(i + 1, point) for i, point in enumerate(data.get("summary_points", []))],
+        'correct': [correct_option(q) for q in data.get("quiz", [])],
+        'answers': answers,  # question index -> chosen option, kept across pages
+    }
+    st.session_state['prepared_kit'] = prepared
+    return prepared
+
+def render_pager(section, total, page_size):
+    """
+    Previous/next controls for a paginated section; returns the slice of
+    item indices on the current page.
+    """
+    pages = max(1, -(-total // page_size))
+    key = f"{section}_page"
+    page = min(st.session_state.get(key, 0), pages - 1)
+    st.session_state[key] = page
+    if pages > 1:
+        def turn(step):
+            st.session_state[key] = page + step
+
+        cols = st.columns([1, 2, 1])
+        cols[0].button("← Previous", key=f"{section}_prev", disabled=page == 0,
+                       on_click=turn, args=(-1,), use_container_width=True)
+        cols[1].markdown(f"<div style='text-align: center'>Page {page + 1} of {pages}</div>",
+                         unsafe_allow_html=True)
+        cols[2].button("Next →", key=f"{section}_next", disabled=page == pages - 1,
+                       on_click=turn, args=(1,), use_container_width=True)
+    return range(page * page_size, min(total, (page + 1) * page_size))
+
+@st.fragment
+def render_flashcard_page(flashcards, page_size):
+    """
+    One page of flashcards; paging reruns only this fragment.
+    """
+    shown = render_pager("flashcards", len(flashcards), page_size)
+    for i in shown[::2]:
+        cols = st.columns(2)
+        with cols[0]:
+            render_flashcard(flashcards[i])
+        if i + 1 in shown:
+            with cols[1]:
+                render_flashcard(flashcards[i + 1])
+
+@st.fragment
+def render_quiz_page(quiz_data, prepared, page_size):
+    """
+    One page of quiz questions. Answering or paging reruns only this
+    fragment, so interaction cost does not grow with the size of the kit.
+    """
+    answers = prepared['answers']
+    for i in render_pager("quiz", len(quiz_data), page_size):
+        q = quiz_data[i]
+        # Card-based layout for each question
+        with st.container(border=True):
+            st.markdown(f"#### {i+1}. {q['question']}")
+            st.markdown("<br>", unsafe_allow_html=True) # Vertical spacing
+
+            saved = answers.get(i)
+            # Unique key for each radio button to track state
+            user_answer = st.radio(
+                "Choose one:",
+                q['options'],
+                key=f"quiz_q_{i}",
+                index=q['options'].index(saved) if saved in q['options'] else None,
+                label_visibility="collapsed"
+            )
+
+            # Immediate feedback
+            if user_answer:
+                answers[i] = user_answer
+                correct = prepared['correct'][i]
+                if user_answer == correct:
+                    st.success(f"✅ Correct! The answer is **{user_answer}**.")
+                else:
+                    st.error(f"❌ Incorrect. The correct answer is **{correct}**.")
+
+        # Margin between cards
+        st.markdown("<br>", unsafe_allow_html=True)
+
+def render_quiz_preview(number, q):
+    """
+    Read-only quiz card shown while streaming; answering is enabled once
+    generation has finished, so a click cannot interrupt it.
+    """
+    with st.container(border=True):
+        st.markdown(f"#### {number}. {q['question']}")
+        st.radio("Choose one:", q['options'], key=f"stream_quiz_q_{number}", index=None,
+                 disabled=True, label_visibility="collapsed")
+    st.markdown("<br>", unsafe_allow_html=True)
+
+def stream_results_into(area):
+    """
+    Returns an `on_item(section, item)` callback that renders streamed items
+    into `area` using the same grid layout as the final results.
+    """
+    area.markdown("<br>", unsafe_allow_html=True) # Spacer
+    boxes = {section: area.container() for section in SECTIONS}
+    counts = {section: 0 for section in SECTIONS}
+    rows = {}
+
+    def on_item(section, item):
+        box = boxes[section]
+        number = counts[section] + 1
+        if number == 1:
+            if section != "summary_points":
+                box.markdown("---")
+            box.markdown(SECTION_TITLES[section])
+
+        if section == "quiz":
+            with box:
+                render_quiz_preview(number, item)
+        else:
+            if number % 2 == 1:
+                rows[section] = box.columns(2)
+            with rows[section][(number - 1) % 2]:
+                if section == "summary_points":
+                    render_summary_card(number, item)
+                else:
+                    render_flashcard(item)
+        counts[section] = number
+
+    return on_item
+
+JOB_PROGRESS = {EXTRACTING: 0.05, MERGING: 0.95}
+
+@st.fragment(run_every=1.0)
+def render_job_progress(job_id):
+    """
+    Polls a background job, showing its progress and the items generated so
+    far. Finished jobs hand their result to the session and rerun the app.
+    """
+    job = get_job_manager().get(job_id)
+    if job is None:
+        # Unknown, or evicted from the job store
+        st.session_state['job_id'] = None
+        st.query_params.pop("job", None)
+        st.rerun()
+
+    if job.state in (DONE, PARTIAL):
+        st.session_state['job_id'] = None
+        st.query_params.pop("job", None) # The saved kit reopens the result from now on
+        st.session_state['document_id'] = job.document
+        show_kit(job.result, job.error if job.state == PARTIAL else None)
+        st.rerun() # Rerun to display results
+
+    if job.state == FAILED:
+        st.session_state['job_id'] = None
+        st.session_state['job_error'] = job.error
+        st.query_params.pop("job", None)
+        st.rerun()
+
+    progress = JOB_PROGRESS.get(job.state, 0.0)
+    if job.state == GENERATING and job.total:
+        progress = 0.1 + 0.8 * job.done / job.total
+    st.progress(progress, text=f"✨ {job.describe()}...")
+    if job.state == GENERATING and api_key:
+        wait = get_model_client(api_key).admission.expected_wait()
+        if wait >= 5:
+            st.caption(f"⏳ High demand right now: expected wait about {wait:.0f}s.")
+
+    if str(get_setting("STREAM_RESULTS", "true")).lower() == "true":
+        on_item = stream_results_into(st.container())
+        for section, item in list(job.items):
+            on_item(section, item)
 
 # --- MAIN APP UI ---
 
@@ -419,15 +707,35 @@ def process_generation(uploaded_file, status_container=None):
 st.markdown('<div class="hero-title">Learn From PDF</div>', unsafe_allow_html=True)
 st.markdown('<div class="hero-subtitle">AI Study Kit: Instantly convert your PDF lecture slides and papers into summaries, flashcards, and quizzes.</div>', unsafe_allow_html=True)
 
+setup_metrics()
+if str(get_setting("DEBUG_PANEL", "false")).lower() == "true" or st.query_params.get("debug") == "1":
+    render_debug_panel()
+
 # --- SESSION STATE INITIALIZATION ---
-if 'study_material' not in st.session_state:
-    st.session_state['study_material'] = ""
+if 'session_id' not in st.session_state:
+    # Identifies this browser session to the model call scheduler and owns
+    # its saved kits; kept in the URL so a page reload keeps the history
+    st.session_state['session_id'] = st.query_params.get("session") or str(uuid.uuid4())
+    st.query_params["session"] = st.session_state['session_id']
+if 'document_id' not in st.session_state:
+    # Content hash of the current PDF; its text lives in the on-disk text store
+    st.session_state['document_id'] = None
 if 'generated_data' not in st.session_state:
     st.session_state['generated_data'] = None
 if 'show_feedback' not in st.session_state:
     st.session_state['show_feedback'] = False
 if 'feedback_submitted' not in st.session_state:
     st.session_state['feedback_submitted'] = False
+if 'job_id' not in st.session_state:
+    # Re-attach to a running or finished job after a page reload
+    st.session_state['job_id'] = st.query_params.get("job")
+if 'kit_id' not in st.session_state:
+    # Reopen the kit shown before a page reload from the local kit store
+    st.session_state['kit_id'] = None
+    if st.query_params.get("kit") and not open_stored_kit(st.query_params["kit"]):
+        st.query_params.pop("kit", None)
+
+render_saved_kits()
 
 # --- WIDGETS ---
 # Centered Card Container for Inputs
@@ -458,93 +766,51 @@ with col2:
         if generate_clicked:
             process_generation(uploaded_file, status_container=status_container)
 
+        if st.session_state.get('job_error'):
+            status_container.error(st.session_state.pop('job_error'))
+
+# --- JOB PROGRESS ---
+if st.session_state.get('job_id'):
+    render_job_progress(st.session_state['job_id'])
+
 # --- DISPLAY RESULTS ---
+render_start = time.perf_counter()
 data = st.session_state.get('generated_data')
 if data:
     st.markdown("<br>", unsafe_allow_html=True) # Spacer
+    if st.session_state.get('kit_warning'):
+        st.warning(st.session_state['kit_warning'])
     
+    prepared = prepare_kit(data)
+
     # 1. Summary Cards
-    st.markdown("### 📌 Key Concepts")
-    summary_points = data.get("summary_points", [])
+    st.markdown(SECTION_TITLES["summary_points"])
+    summary_html = prepared['summary_html']
     
-    # Display in a grid of cards
-    for i in range(0, len(summary_points), 2):
-        cols = st.columns(2)
-        # Card 1
-        with cols[0]:
-            st.markdown(f"""
-            <div class="summary-card">
-                <span class="summary-number">#{i+1}</span>
-                {summary_points[i]}
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Card 2 (if exists)
-        if i + 1 < len(summary_points):
-            with cols[1]:
-                st.markdown(f"""
-                <div class="summary-card">
-                    <span class="summary-number">#{i+2}</span>
-                    {summary_points[i+1]}
-                </div>
-                """, unsafe_allow_html=True)
+    # Display in a grid of cards, one markdown element per column
+    cols = st.columns(2)
+    for column, start in zip(cols, (0, 1)):
+        with column:
+            st.markdown("".join(summary_html[start::2]), unsafe_allow_html=True)
     
     # 2. Flashcards
     st.markdown("---")
-    st.markdown("### 🗂️ Flashcards")
-    flashcards = data.get("flashcards", [])
-    
-    # Display in a grid of cards (2 columns)
-    for i in range(0, len(flashcards), 2):
-        cols = st.columns(2)
-        
-        # Card 1
-        with cols[0]:
-            with st.container(border=True):
-                st.markdown(f"**Q: {flashcards[i]['question']}**")
-                with st.expander("Reveal Answer"):
-                    st.write(flashcards[i]['answer'])
-        
-        # Card 2 (if exists)
-        if i + 1 < len(flashcards):
-            with cols[1]:
-                with st.container(border=True):
-                    st.markdown(f"**Q: {flashcards[i+1]['question']}**")
-                    with st.expander("Reveal Answer"):
-                        st.write(flashcards[i+1]['answer'])
+    st.markdown(SECTION_TITLES["flashcards"])
+    render_flashcard_page(data.get("flashcards", []), int(get_setting("FLASHCARDS_PER_PAGE", 10)))
+
+    if st.button("➕ More flashcards", key="more_flashcards"):
+        request_more("flashcards")
     
     # 3. Quiz
     st.markdown("---")
-    st.markdown("### 📝 Self-Test")
-    
-    quiz_data = data.get("quiz", [])
-    for i, q in enumerate(quiz_data):
-        # Card-based layout for each question
-        with st.container(border=True):
-            st.markdown(f"#### {i+1}. {q['question']}")
-            st.markdown("<br>", unsafe_allow_html=True) # Vertical spacing
-            
-            # Unique key for each radio button to track state
-            user_answer = st.radio(
-                "Choose one:", 
-                q['options'], 
-                key=f"quiz_q_{i}", 
-                index=None, 
-                label_visibility="collapsed"
-            )
-            
-            # Immediate feedback
-            if user_answer:
-                # Check if the selected option starts with the correct letter (e.g., "A")
-                if user_answer.startswith(q['correct_answer']):
-                    st.success(f"✅ Correct! The answer is **{user_answer}**.")
-                else:
-                    # Find the full text of the correct answer
-                    correct_option_text = next((opt for opt in q['options'] if opt.startswith(q['correct_answer'])), q['correct_answer'])
-                    st.error(f"❌ Incorrect. The correct answer is **{correct_option_text}**.")
-        
-        # Margin between cards
-        st.markdown("<br>", unsafe_allow_html=True)
+    st.markdown(SECTION_TITLES["quiz"])
+    render_quiz_page(data.get("quiz", []), prepared, int(get_setting("QUIZ_PER_PAGE", 5)))
+
+    if st.button("➕ More questions", key="more_quiz"):
+        request_more("quiz")
+
+if data:
+    metrics.observe("render_results_seconds", time.perf_counter() - render_start)
 
 # --- FEEDBACK SECTION ---
 # Only render if feedback is active
@@ -608,4 +874,8 @@ if st.session_state.get('show_feedback'):
                         
                         if success:
                             st.session_state['feedback_submitted'] = True
-                            st.rerun()
\ No newline at end of file
+                            st.rerun()
+
+# --- SCRIPT TIMING ---
+# Time to rerun the whole script; runs cut short by st.rerun() are not counted
+metrics.observe("script_run_seconds", time.perf_counter() - script_start)
@@ -0,0 +1,345 @@
+"""
+Headless batch generation of study kits.
+
+Runs the app's pipeline (pipeline.build_study_kit) over a directory or glob
+of PDFs without Streamlit, writing each kit as JSON next to its source
+(`lecture.pdf` -> `lecture.kit.json`). Documents are processed on a thread
+pool (`--jobs`), each extracting its pages on the process pool
+(`--extract-workers`) and sharing one async model client whose request
+concurrency and RPM/TPM quota apply across the whole batch.
+
+Progress is recorded in a manifest after every document, so an interrupted
+run picks up where it stopped: sources whose size and mtime match a finished
+entry, and whose kit is still on disk, are skipped without being re-read.
+The study kit, text, page and chunk caches are the app's own, so documents
+already generated through the UI cost nothing.
+
+Settings are read from the environment (and .env) under the same names as
+in the app, e.g. GOOGLE_API_KEY, GEMINI_RPM or STUDY_CACHE_DIR.
+
+Usage:
+    python -m batch courses/biology "courses/**/*.pdf" --jobs 4 --recursive
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from admission import DEFAULT_RPM, DEFAULT_TPM, AdmissionController, SqliteBucketStore
+from doc_context import DEFAULT_TTL as DEFAULT_CONTEXT_TTL, DocumentContexts
+from extraction import DEFAULT_PAGE_TIMEOUT
+from fake_gemini import FakeGeminiTransport
+from gemini_client import DEFAULT_MAX_CONCURRENCY as DEFAULT_MAX_REQUESTS, GeminiClient, GeminiTransport
+from generation import DEFAULT_MAX_CONCURRENCY, MAX_PROMPT_TOKENS, MODEL_NAME, PROMPT_VERSION
+from ocr import DEFAULT_LANGUAGE, DEFAULT_PAGE_BUDGET
+from pipeline import build_study_kit, kit_cache_key
+from study_cache import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_CHUNK_DIR,
+    DEFAULT_OCR_CACHE_PATH,
+    DEFAULT_PAGE_CACHE_PATH,
+    DEFAULT_TEXT_DIR,
+    PageTextCache,
+    StudyKitCache,
+    TextStore,
+)
+from uploads import PdfSource
+from vector_index import DEFAULT_INDEX_DIR, VectorIndexStore, make_embedder
+
+# --- CONSTANTS ---
+DEFAULT_MANIFEST = os.path.join(".cache", "batch_manifest.json")
+DEFAULT_SUFFIX = ".kit.json"
+DEFAULT_JOBS = 2
+MB = 1024 * 1024
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default=None):
+    return os.environ.get(name, default)
+
+
+def find_pdfs(patterns, recursive=False):
+    """
+    Expands directories and glob patterns into a sorted list of PDF paths,
+    each listed once.
+    """
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*") if recursive else os.path.join(pattern, "*")
+        for path in glob.glob(pattern, recursive=True):
+            if path.lower().endswith(".pdf") and os.path.isfile(path):
+                found.setdefault(os.path.realpath(path), path)
+    return sorted(found.values())
+
+
+def output_path(pdf_path, suffix=DEFAULT_SUFFIX):
+    return os.path.splitext(pdf_path)[0] + suffix
+
+
+def _write_json(path, data):
+    # Atomic, so an interrupted run never leaves a truncated file behind
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class BatchManifest:
+    """
+    Per-source record of a batch run, saved after every document. Entries
+    are keyed by the source's absolute path.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except ValueError:
+            logger.warning("Manifest %s is unreadable, starting a fresh one", path)
+            self.entries = {}
+
+    def is_done(self, pdf_path, output, options=None):
+        """
+        True if `pdf_path` was generated with the current model and prompt
+        and the kit-shaping `options`, is unchanged since (size and mtime)
+        and its kit still exists.
+        """
+        entry = self.entries.get(os.path.abspath(pdf_path))
+        if not entry or entry.get("status") != DONE or not os.path.exists(output):
+            return False
+        stat = os.stat(pdf_path)
+        return (
+            entry.get("size") == stat.st_size
+            and entry.get("mtime_ns") == stat.st_mtime_ns
+            and entry.get("model") == MODEL_NAME
+            and entry.get("prompt_version") == PROMPT_VERSION
+            and entry.get("key") == kit_cache_key(entry.get("digest"), options)
+        )
+
+    def record(self, pdf_path, **entry):
+        stat = os.stat(pdf_path)
+        entry.update(
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            model=MODEL_NAME,
+            prompt_version=PROMPT_VERSION,
+            updated_at=time.time(),
+        )
+        with self._lock:
+            self.entries[os.path.abspath(pdf_path)] = entry
+            manifest_dir = os.path.dirname(self.path)
+            if manifest_dir:
+                os.makedirs(manifest_dir, exist_ok=True)
+            _write_json(self.path, self.entries)
+
+
+def make_client(transport_name, api_key=None, max_requests=DEFAULT_MAX_REQUESTS):
+    """
+    Creates the model client the way the app does, for the "gemini" or the
+    "fake" transport.
+    """
+    if transport_name == "fake":
+        transport = FakeGeminiTransport(latency=float(_setting("FAKE_GEMINI_LATENCY", 0.5)))
+    else:
+        if not api_key:
+            raise SystemExit("GOOGLE_API_KEY is not set (or use --transport fake)")
+        transport = GeminiTransport(api_key, MODEL_NAME)
+    store_path = _setting("ADMISSION_STORE")
+    admission = AdmissionController(
+        rpm=int(_setting("GEMINI_RPM", DEFAULT_RPM)),
+        tpm=int(_setting("GEMINI_TPM", DEFAULT_TPM)),
+        store=SqliteBucketStore(store_path) if store_path else None,
+    )
+    return GeminiClient(transport, max_concurrency=max_requests, admission=admission)
+
+
+def make_caches(enabled=True):
+    """
+    Opens the app's on-disk caches as keyword arguments for build_study_kit(),
+    or none of them.
+    """
+    if not enabled:
+        return {}
+
+    def max_bytes(name, default_mb):
+        return int(_setting(name, default_mb)) * MB
+
+    return {
+        "cache": StudyKitCache(
+            _setting("STUDY_CACHE_DIR", DEFAULT_CACHE_DIR), max_bytes("STUDY_CACHE_MAX_MB", 256)),
+        "text_store": TextStore(
+            _setting("TEXT_STORE_DIR", DEFAULT_TEXT_DIR), max_bytes("TEXT_STORE_MAX_MB", 512)),
+        "page_cache": PageTextCache(
+            _setting("PAGE_CACHE_PATH", DEFAULT_PAGE_CACHE_PATH), max_bytes("PAGE_CACHE_MAX_MB", 256)),
+        "ocr_cache": PageTextCache(
+            _setting("OCR_CACHE_PATH", DEFAULT_OCR_CACHE_PATH), max_bytes("OCR_CACHE_MAX_MB", 256)),
+        "chunk_cache": StudyKitCache(
+            _setting("CHUNK_CACHE_DIR", DEFAULT_CHUNK_DIR), max_bytes("CHUNK_CACHE_MAX_MB", 256)),
+        "index_store": VectorIndexStore(
+            _setting("VECTOR_INDEX_DIR", DEFAULT_INDEX_DIR), max_bytes("VECTOR_INDEX_MAX_MB", 256)),
+    }
+
+
+def process_pdf(pdf_path, client, options, manifest, suffix=DEFAULT_SUFFIX, contexts=None, caches=None,
+                embedder=None):
+    """
+    Generates the kit for one PDF, writes it next to the source and records
+    the outcome in the manifest. Returns the manifest entry.
+    """
+    start = time.perf_counter()
+    output = output_path(pdf_path, suffix)
+    digest = None
+    try:
+        source = PdfSource.from_path(pdf_path)
+        digest = source.digest
+        data = build_study_kit(
+            source,
+            client,
+            options=options,
+            contexts=contexts,
+            embedder=embedder,
+            # Fair share per document when several run at once
+            session=os.path.abspath(pdf_path),
+            **(caches or {}),
+        )
+        if not data:
+            raise ValueError("The model returned no study material.")
+        _write_json(output, data)
+        entry = {"status": DONE, "output": output, "digest": digest,
+                 "key": kit_cache_key(digest, options)}
+    except Exception as e:
+        logger.debug("Generation failed for %s", pdf_path, exc_info=True)
+        entry = {"status": FAILED, "digest": digest, "error": str(e) or type(e).__name__}
+    entry["seconds"] = time.perf_counter() - start
+    manifest.record(pdf_path, **entry)
+    return entry
+
+
+def run_batch(pdf_paths, client, options, manifest, jobs=DEFAULT_JOBS, suffix=DEFAULT_SUFFIX, force=False,
+              contexts=None, caches=None, embedder=None, on_result=None):
+    """
+    Processes `pdf_paths` with up to `jobs` documents in flight, skipping
+    those the manifest marks as done unless `force`. Calls
+    `on_result(pdf_path, entry)` as documents finish and returns the counts
+    per status.
+    """
+    on_result = on_result or (lambda pdf_path, entry: None)
+    counts = {DONE: 0, FAILED: 0, SKIPPED: 0}
+    pending = []
+    for pdf_path in pdf_paths:
+        if not force and manifest.is_done(pdf_path, output_path(pdf_path, suffix), options):
+            counts[SKIPPED] += 1
+            on_result(pdf_path, {"status": SKIPPED})
+        else:
+            pending.append(pdf_path)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="batch")
+    try:
+        futures = {
+            executor.submit(process_pdf, pdf_path, client, options, manifest, suffix, contexts, caches,
+                            embedder): pdf_path
+            for pdf_path in pending
+        }
+        for future in as_completed(futures):
+            entry = future.result()
+            counts[entry["status"]] += 1
+            on_result(futures[future], entry)
+    finally:
+        # On Ctrl+C, drop the queue; finished documents are already recorded
+        executor.shutdown(wait=True, cancel_futures=True)
+    return counts
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Generate study kits for a directory or glob of PDFs.")
+    parser.add_argument("paths", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument("--recursive", action="store_true", help="also search subdirectories of directories")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="documents processed at once")
+    parser.add_argument("--extract-workers", type=int, default=int(_setting("EXTRACT_WORKERS", 0)) or None,
+                        help="extraction processes per document")
+    parser.add_argument("--max-requests", type=int, default=int(_setting("MAX_CONCURRENT_REQUESTS", DEFAULT_MAX_REQUESTS)),
+                        help="concurrent model requests across the batch")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST, help="resume manifest path")
+    parser.add_argument("--suffix", default=DEFAULT_SUFFIX, help="kit file name suffix")
+    parser.add_argument("--force", action="store_true", help="regenerate documents the manifest marks as done")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the on-disk caches")
+    parser.add_argument("--transport", choices=("gemini", "fake"), default=_setting("GEMINI_TRANSPORT", "gemini"))
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    pdf_paths = find_pdfs(args.paths, args.recursive)
+    if not pdf_paths:
+        print("No PDFs found.", file=sys.stderr)
+        return 1
+
+    options = {
+        "workers": args.extract_workers,
+        "page_timeout": float(_setting("EXTRACT_PAGE_TIMEOUT", DEFAULT_PAGE_TIMEOUT)),
+        "max_concurrency": int(_setting("MAX_CONCURRENT_CHUNKS", DEFAULT_MAX_CONCURRENCY)),
+        "max_prompt_tokens": int(_setting("MAX_PROMPT_TOKENS", MAX_PROMPT_TOKENS)),
+        "split_sections": str(_setting("SECTION_REQUESTS", "true")).lower() == "true",
+        "ocr_budget": int(_setting("OCR_PAGE_BUDGET", DEFAULT_PAGE_BUDGET)),
+        "ocr_language": _setting("OCR_LANGUAGE", DEFAULT_LANGUAGE),
+        "document_token_budget": int(_setting("DOCUMENT_TOKEN_BUDGET", 0)) or None,
+        "layout": str(_setting("LAYOUT_EXTRACTION", "true")).lower() == "true",
+    }
+    client = make_client(args.transport, _setting("GOOGLE_API_KEY"), args.max_requests)
+    contexts = None
+    if str(_setting("DOCUMENT_CONTEXTS", "true")).lower() == "true":
+        contexts = DocumentContexts(client, ttl=int(_setting("DOCUMENT_CONTEXT_TTL", DEFAULT_CONTEXT_TTL)))
+
+    finished = 0
+
+    def on_result(pdf_path, entry):
+        nonlocal finished
+        finished += 1
+        detail = entry.get("error") or entry.get("output") or ""
+        seconds = f" {entry['seconds']:.1f}s" if "seconds" in entry else ""
+        print(f"[{finished}/{len(pdf_paths)}] {entry['status']:>7} {pdf_path}{seconds} {detail}", file=sys.stderr)
+
+    try:
+        counts = run_batch(
+            pdf_paths,
+            client,
+            options,
+            BatchManifest(args.manifest),
+            jobs=args.jobs,
+            suffix=args.suffix,
+            force=args.force,
+            contexts=contexts,
+            caches=make_caches(not args.no_cache),
+            embedder=make_embedder(_setting("EMBEDDER", "hashing")),
+            on_result=on_result,
+        )
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume.", file=sys.stderr)
+        return 130
+    finally:
+        client.close()
+
+    print(json.dumps(counts))
+    return 1 if counts[FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3 @@
+"""
+Offline benchmarks for extraction and generation throughput.
+"""
@@ -0,0 +1,609 @@
+"""
+Load test for a running app.
+
+Starts `streamlit run app.py` on a free local port (or targets an app that
+is already running, with --url) and drives it with N concurrent simulated
+users. Each user talks to the server over Streamlit's websocket protocol,
+as a browser tab would: it opens the page, uploads its own synthetic PDF,
+clicks Generate, waits for the kit, answers quiz questions and submits
+feedback. Every step is one or more script runs on the server, timed from
+the user's side.
+
+The started app uses the fake model backend (with --latency and
+--error-rate setting its response time and share of 429s) and the
+in-memory feedback sheet, and keeps every cache and store in a temporary
+directory, so runs need no credentials and always start cold.
+
+The JSON report contains throughput, latency percentiles per phase, error
+counts and rates per phase, the server's resident memory per session and
+the app's own counters from its metrics endpoint.
+
+Usage:
+    python -m benchmarks.loadtest --users 20 --ramp-up 10 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+import requests
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from websockets.asyncio.client import connect
+
+from benchmarks.run import _percentiles
+from benchmarks.synthetic_pdfs import make_pdf
+
+# --- CONSTANTS ---
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+PHASES = ("load", "upload", "generate", "answer", "feedback")
+SERVER_ENV = {
+    "GEMINI_TRANSPORT": "fake",
+    "FEEDBACK_BACKEND": "memory",
+    "GOOGLE_API_KEY": "load-test",
+}
+# Settings that point at on-disk caches and stores, relative to the run's temporary directory
+STORE_SETTINGS = {
+    "STUDY_CACHE_DIR": "study_kits",
+    "TEXT_STORE_DIR": "texts",
+    "PAGE_CACHE_PATH": "pages.sqlite3",
+    "OCR_CACHE_PATH": "ocr.sqlite3",
+    "CHUNK_CACHE_DIR": "chunk_kits",
+    "VECTOR_INDEX_DIR": "vectors",
+    "JOB_STORE_DIR": "jobs",
+    "KIT_STORE_PATH": "kits.sqlite3",
+    "UPLOAD_SPOOL_DIR": "uploads",
+    "FEEDBACK_SPOOL_PATH": "feedback_spool.sqlite3",
+}
+FEEDBACK_THANKS = "Thank you for your feedback"
+# Wrong quiz answers are shown with st.error; they are not failures
+INCORRECT_ANSWER = "Incorrect. The correct answer is"
+XSRF_COOKIE = "_streamlit_xsrf"
+MEMORY_SAMPLE_INTERVAL = 0.5
+
+FINISHED_EARLY_FOR_RERUN = ForwardMsg.ScriptFinishedStatus.Value("FINISHED_EARLY_FOR_RERUN")
+FINISHED_WITH_COMPILE_ERROR = ForwardMsg.ScriptFinishedStatus.Value("FINISHED_WITH_COMPILE_ERROR")
+ALERT_ERROR = 1
+
+
+class PhaseError(Exception):
+    """
+    A simulated user could not complete a phase.
+    """
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_mb(pid):
+    """
+    Resident memory of `pid` and its child processes (extraction workers),
+    or None where /proc is not available.
+    """
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status", encoding="ascii") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children", encoding="ascii") as f:
+                    pending.extend(int(child) for child in f.read().split())
+    except (OSError, ValueError):
+        if not total:
+            return None
+    return total / 1024
+
+
+def _scrape_metrics(port):
+    """
+    The app's counters and histogram counts/sums from its Prometheus
+    endpoint, keyed by series.
+    """
+    try:
+        text = requests.get(f"http://127.0.0.1:{port}/", timeout=5).text
+    except requests.RequestException:
+        return {}
+    samples = {}
+    for line in text.splitlines():
+        series, _, value = line.rpartition(" ")
+        if series and "_bucket" not in series:
+            samples[series] = float(value)
+    return samples
+
+
+class AppServer:
+    """
+    `streamlit run app.py` in a subprocess, configured for load testing.
+    """
+
+    def __init__(self, workdir, latency, error_rate, extra_env=None):
+        self.port = _free_port()
+        self.metrics_port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = os.path.join(workdir, "server.log")
+        self.env = dict(os.environ, **SERVER_ENV,
+                        FAKE_GEMINI_LATENCY=str(latency),
+                        FAKE_GEMINI_ERROR_RATE=str(error_rate),
+                        METRICS_PORT=str(self.metrics_port))
+        for name, path in STORE_SETTINGS.items():
+            self.env[name] = os.path.join(workdir, path)
+        self.env.update(extra_env or {})
+        self.process = None
+
+    def start(self, timeout=60):
+        command = [
+            sys.executable, "-m", "streamlit", "run", APP_PATH,
+            "--server.headless", "true",
+            "--server.address", "127.0.0.1",
+            "--server.port", str(self.port),
+            "--server.fileWatcherType", "none",
+            "--browser.gatherUsageStats", "false",
+        ]
+        self._log = open(self.log_path, "wb")
+        self.process = subprocess.Popen(command, cwd=os.path.dirname(APP_PATH), env=self.env,
+                                        stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"The app exited with code {self.process.returncode}, see {self.log_path}")
+            try:
+                if requests.get(f"{self.url}/_stcore/health", timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"The app did not come up within {timeout}s, see {self.log_path}")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self._log.close()
+
+
+class SimulatedUser:
+    """
+    One browser session, driven over the app's websocket.
+
+    Keeps what a browser tab keeps: the widget states it sends with every
+    rerun request, the elements of the page (by delta path) and the
+    fragments the server asked it to rerun periodically.
+    """
+
+    def __init__(self, base_url, number, pdf, timeout, rng):
+        self.base_url = base_url.rstrip("/")
+        self.number = number
+        self.pdf = pdf
+        self.timeout = timeout
+        self.rng = rng
+        self.http = requests.Session()
+        self.ws = None
+        self.session_id = None
+        self.page_script_hash = ""
+        self.query_string = ""
+        self.widget_states = {}
+        self.elements = {}
+        self.auto_reruns = {}
+        self.file_urls = {}
+        self.script_runs = 0
+        self.app_errors = set()
+
+    # --- protocol ---
+
+    async def connect(self):
+        # The health check sets the XSRF cookie (when enabled), whose token
+        # goes back as the second websocket subprotocol and on uploads
+        response = await asyncio.to_thread(self.http.get, self.base_url + "/_stcore/health", timeout=self.timeout)
+        response.raise_for_status()
+        token = self.http.cookies.get(XSRF_COOKIE)
+        split = urlsplit(self.base_url)
+        scheme = "wss" if split.scheme == "https" else "ws"
+        self.ws = await connect(
+            f"{scheme}://{split.netloc}{split.path}/_stcore/stream",
+            subprotocols=["streamlit", token] if token else ["streamlit"],
+            additional_headers={"Cookie": f"{XSRF_COOKIE}={token}"} if token else None,
+            max_size=None,
+            open_timeout=self.timeout,
+        )
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        self.http.close()
+
+    async def _send(self, message):
+        await self.ws.send(message.SerializeToString())
+
+    async def _receive(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise PhaseError("timed out")
+        try:
+            data = await asyncio.wait_for(self.ws.recv(), remaining)
+        except asyncio.TimeoutError:
+            raise PhaseError("timed out") from None
+        message = ForwardMsg.FromString(data)
+        self._handle(message)
+        return message
+
+    def _handle(self, message):
+        kind = message.WhichOneof("type")
+        if kind == "new_session":
+            new_session = message.new_session
+            if new_session.HasField("initialize"):
+                self.session_id = new_session.initialize.session_id
+            self.page_script_hash = new_session.page_script_hash
+            if not new_session.fragment_ids_this_run:
+                # A full run redraws the page and re-registers its polling fragments
+                self.elements = {}
+                self.auto_reruns = {}
+        elif kind == "delta":
+            path = tuple(message.metadata.delta_path)
+            delta_kind = message.delta.WhichOneof("type")
+            if delta_kind in ("new_element", "add_block"):
+                # Whatever was drawn at this position (and inside it) is replaced
+                self.elements = {p: e for p, e in self.elements.items() if p[:len(path)] != path}
+            if delta_kind == "new_element":
+                self.elements[path] = (message.delta.new_element, message.delta.fragment_id)
+        elif kind == "page_info_changed":
+            self.query_string = message.page_info_changed.query_string
+        elif kind == "auto_rerun":
+            self.auto_reruns[message.auto_rerun.fragment_id] = message.auto_rerun.interval
+        elif kind == "file_urls_response":
+            self.file_urls[message.file_urls_response.response_id] = message.file_urls_response
+
+    async def rerun(self, fragment_id="", is_auto_rerun=False):
+        """
+        Requests a script run with the current widget states and waits for
+        it (and any st.rerun() it triggers) to finish.
+        """
+        message = BackMsg()
+        client_state = message.rerun_script
+        client_state.query_string = self.query_string
+        client_state.page_script_hash = self.page_script_hash
+        client_state.widget_states.widgets.extend(self.widget_states.values())
+        if fragment_id:
+            client_state.fragment_id = fragment_id
+            client_state.is_auto_rerun = is_auto_rerun
+        await self._send(message)
+        # Button clicks fire once
+        self.widget_states = {id_: state for id_, state in self.widget_states.items()
+                              if not state.HasField("trigger_value")}
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            message = await self._receive(deadline)
+            if message.WhichOneof("type") == "script_finished":
+                status = message.script_finished
+                if status == FINISHED_EARLY_FOR_RERUN:
+                    continue
+                self.script_runs += 1
+                if status == FINISHED_WITH_COMPILE_ERROR:
+                    raise PhaseError("app.py failed to compile")
+                self.app_errors.update(self._errors_shown())
+                return
+
+    def _errors_shown(self):
+        for element, _ in self.elements.values():
+            kind = element.WhichOneof("type")
+            if kind == "exception":
+                yield f"{element.exception.type}: {element.exception.message}"
+            elif kind == "alert" and element.alert.format == ALERT_ERROR and INCORRECT_ANSWER not in element.alert.body:
+                yield element.alert.body
+
+    # --- page queries ---
+
+    def find(self, kind, key=None, enabled=False):
+        """
+        Widgets of one type on the page, in page order, as (proto, fragment ID)
+        pairs. `key` matches the widget key given in app.py.
+        """
+        found = []
+        for path in sorted(self.elements):
+            element, fragment_id = self.elements[path]
+            if element.WhichOneof("type") != kind:
+                continue
+            widget = getattr(element, kind)
+            if key is not None and not widget.id.endswith(f"-{key}"):
+                continue
+            if enabled and widget.disabled:
+                continue
+            found.append((widget, fragment_id))
+        return found
+
+    def quiz_questions(self):
+        return [(radio, fragment_id) for radio, fragment_id in self.find("radio", enabled=True)
+                if "-quiz_q_" in radio.id]
+
+    def text(self):
+        return "\n".join(element.markdown.body for element, _ in self.elements.values()
+                         if element.WhichOneof("type") == "markdown")
+
+    # --- phases ---
+
+    async def load(self):
+        await self.connect()
+        await self.rerun()
+        if not self.find("file_uploader"):
+            raise PhaseError("no file uploader on the page")
+
+    async def upload(self):
+        uploader = self.find("file_uploader")[0][0]
+        name = f"loadtest-{self.number}.pdf"
+
+        request = BackMsg()
+        request.file_urls_request.request_id = name
+        request.file_urls_request.file_names.append(name)
+        request.file_urls_request.session_id = self.session_id
+        await self._send(request)
+        deadline = time.monotonic() + self.timeout
+        while name not in self.file_urls:
+            await self._receive(deadline)
+        response = self.file_urls.pop(name)
+        if response.error_msg:
+            raise PhaseError(f"upload refused: {response.error_msg}")
+        urls = response.file_urls[0]
+
+        upload_url = urls.upload_url if "://" in urls.upload_url else self.base_url + urls.upload_url
+        token = self.http.cookies.get(XSRF_COOKIE)
+        result = await asyncio.to_thread(
+            self.http.put, upload_url, files={"file": (name, self.pdf, "application/pdf")},
+            headers={"X-Xsrftoken": token} if token else None, timeout=self.timeout,
+        )
+        if not result.ok:
+            raise PhaseError(f"upload failed with HTTP {result.status_code}")
+
+        state = WidgetState(id=uploader.id)
+        state.file_uploader_state_value.uploaded_file_info.add(
+            name=name, size=len(self.pdf), file_id=urls.file_id, file_urls=urls)
+        self.widget_states[uploader.id] = state
+        await self.rerun()
+
+    async def generate(self):
+        buttons = self.find("button", key="btn_pdf_gen")
+        if not buttons:
+            raise PhaseError("no Generate button on the page")
+        self.widget_states[buttons[0][0].id] = WidgetState(id=buttons[0][0].id, trigger_value=True)
+        await self.rerun()
+
+        # The job's progress fragment polls until the kit is ready, as the
+        # browser would on the server's auto-rerun schedule
+        deadline = time.monotonic() + self.timeout
+        while not self.quiz_questions():
+            if any(self._errors_shown()):
+                raise PhaseError("generation failed")
+            if not self.auto_reruns:
+                raise PhaseError("no quiz and no job in progress")
+            if time.monotonic() > deadline:
+                raise PhaseError("timed out")
+            await asyncio.sleep(min(self.auto_reruns.values()))
+            for fragment_id in list(self.auto_reruns):
+                await self.rerun(fragment_id, is_auto_rerun=True)
+
+    async def answer(self, index):
+        radio, fragment_id = self.quiz_questions()[index]
+        choice = self.rng.choice(list(radio.options))
+        self.widget_states[radio.id] = WidgetState(id=radio.id, string_value=choice)
+        await self.rerun(fragment_id)
+
+    async def feedback(self):
+        submit = [button for button, _ in self.find("button") if button.is_form_submitter]
+        ratings = self.find("selectbox")
+        comments = self.find("text_area")
+        if not submit or not ratings:
+            raise PhaseError("no feedback form on the page")
+        rating = ratings[0][0]
+        self.widget_states[rating.id] = WidgetState(id=rating.id, string_value=self.rng.choice(list(rating.options)))
+        if comments:
+            comment = comments[0][0]
+            self.widget_states[comment.id] = WidgetState(id=comment.id, string_value=f"Load test user {self.number}")
+        self.widget_states[submit[0].id] = WidgetState(id=submit[0].id, trigger_value=True)
+        await self.rerun()
+        if FEEDBACK_THANKS not in self.text():
+            raise PhaseError("feedback was not accepted")
+
+
+async def run_user(user, answers, results, done):
+    """
+    Runs one user's journey, recording each phase's latency or failure in
+    `results`; later phases are skipped once one fails.
+    """
+    async def timed(phase, step):
+        start = time.perf_counter()
+        try:
+            await step
+        except PhaseError as e:
+            results[phase]["errors"][str(e)] += 1
+            raise
+        except Exception as e:
+            results[phase]["errors"][type(e).__name__] += 1
+            raise PhaseError(str(e)) from e
+        results[phase]["latencies"].append(time.perf_counter() - start)
+
+    try:
+        await timed("load", user.load())
+        await timed("upload", user.upload())
+        await timed("generate", user.generate())
+        for i in range(min(answers, len(user.quiz_questions()))):
+            await timed("answer", user.answer(i))
+        await timed("feedback", user.feedback())
+        done.append(user.number)
+    except PhaseError:
+        pass
+
+
+async def run_load(base_url, args, pdfs, on_sample=None):
+    """
+    Runs `args.users` users, started evenly over `args.ramp_up` seconds, and
+    returns (results per phase, users, elapsed seconds). Sessions stay
+    connected until every user is finished, so the server holds all of
+    them at once when memory is sampled.
+    """
+    results = {phase: {"latencies": [], "errors": Counter()} for phase in PHASES}
+    done = []
+    users = [SimulatedUser(base_url, i, pdfs[i], args.timeout, random.Random(i)) for i in range(len(pdfs))]
+
+    async def start(user):
+        await asyncio.sleep(args.ramp_up * user.number / max(len(users), 1))
+        await run_user(user, args.answers, results, done)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(start(user) for user in users))
+    elapsed = time.perf_counter() - start_time
+    if on_sample is not None:
+        on_sample()
+    for user in users:
+        await user.close()
+    return results, users, done, elapsed
+
+
+async def sample_memory(pid, samples, stop):
+    while not stop.is_set():
+        rss = _rss_mb(pid)
+        if rss is not None:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), MEMORY_SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_test(args, server):
+    base_url = args.url or server.url
+    pid = server.process.pid if server else None
+
+    if args.warmup:
+        # Imports, cache_resource factories and the process pool are paid
+        # for once, outside the measurement and the memory baseline
+        print("warming up...", file=sys.stderr)
+        await run_load(base_url, argparse.Namespace(**{**vars(args), "ramp_up": 0}),
+                       [make_pdf(args.pages, seed=-1 - i) for i in range(args.warmup)])
+
+    pdfs = [make_pdf(args.pages, seed=i) for i in range(args.users)]
+    baseline = _rss_mb(pid) if pid else None
+    samples = []
+    loaded = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_memory(pid, samples, stop)) if pid else None
+
+    print(f"running {args.users} users...", file=sys.stderr)
+    results, users, done, elapsed = await run_load(
+        base_url, args, pdfs, on_sample=lambda: loaded.append(_rss_mb(pid) if pid else None))
+    stop.set()
+    if sampler is not None:
+        await sampler
+
+    memory = {"baseline_mb": baseline, "peak_mb": max(samples) if samples else None,
+              "all_sessions_mb": loaded[0] if loaded else None}
+    if baseline is not None and memory["all_sessions_mb"] is not None:
+        # Memory the server holds per connected session once its kit is shown
+        memory["per_session_mb"] = (memory["all_sessions_mb"] - baseline) / args.users
+        memory["peak_per_session_mb"] = (memory["peak_mb"] - baseline) / args.users
+
+    phases = {}
+    for phase in PHASES:
+        latencies = results[phase]["latencies"]
+        errors = results[phase]["errors"]
+        attempts = len(latencies) + sum(errors.values())
+        phases[phase] = {
+            "latency_seconds": _percentiles(latencies),
+            "attempts": attempts,
+            "errors": sum(errors.values()),
+            "error_rate": sum(errors.values()) / attempts if attempts else 0.0,
+            "error_kinds": dict(errors),
+        }
+
+    # Error messages the app showed, by the number of users who saw them
+    app_errors = Counter()
+    for user in users:
+        app_errors.update(user.app_errors)
+    script_runs = sum(user.script_runs for user in users)
+    return {
+        "throughput": {
+            "elapsed_seconds": elapsed,
+            "sessions_completed": len(done),
+            "sessions_failed": args.users - len(done),
+            "sessions_per_minute": len(done) / elapsed * 60,
+            "kits_per_minute": len(results["generate"]["latencies"]) / elapsed * 60,
+            "script_runs": script_runs,
+            "script_runs_per_second": script_runs / elapsed,
+        },
+        "phases": phases,
+        "error_rate": (args.users - len(done)) / args.users if args.users else 0.0,
+        "app_errors": dict(app_errors.most_common(10)),
+        "memory": memory,
+        "server_metrics": _scrape_metrics(server.metrics_port) if server else {},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test app.py with concurrent simulated users.")
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="seconds over which users start")
+    parser.add_argument("--pages", type=int, default=20, help="pages in each user's synthetic PDF")
+    parser.add_argument("--answers", type=int, default=3, help="quiz questions each user answers")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake model latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake model calls answered with 429")
+    parser.add_argument("--warmup", type=int, default=1, help="users run before measuring")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds allowed per phase")
+    parser.add_argument("--url", help="test an app already running here instead of starting one")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra setting for the started app, e.g. JOB_WORKERS=8")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    server = None
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as workdir:
+        if not args.url:
+            extra_env = dict(item.split("=", 1) for item in args.env)
+            server = AppServer(workdir, args.latency, args.error_rate, extra_env)
+            server.start()
+        try:
+            results = asyncio.run(run_test(args, server))
+        finally:
+            if server is not None:
+                server.stop()
+
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        **results,
+    }
+    throughput = results["throughput"]
+    print(f"{throughput['sessions_completed']}/{args.users} sessions completed in "
+          f"{throughput['elapsed_seconds']:.1f}s", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Offline benchmark harness.
+
+Measures extraction throughput (pages/sec, inline and on the process pool)
+over the synthetic corpus, then end-to-end latency of the upload-to-kit
+pipeline under N concurrent simulated sessions against the deterministic fake
+model backend. Results, including peak RSS and the per-stage timings from the
+metrics registry, are written as JSON so runs can be compared over time.
+
+Usage:
+    python -m benchmarks.run --sizes 10 100 500 2000 --sessions 8 --output bench.json
+"""
+import argparse
+import json
+import platform
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from benchmarks.synthetic_pdfs import DEFAULT_SIZES, KINDS, corpus
+from extraction import default_workers, extract_text
+from fake_gemini import FakeGeminiTransport
+from gemini_client import GeminiClient
+from pipeline import build_study_kit
+from uploads import PdfSource
+
+
+def _peak_rss_mb(who):
+    rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": values[-1],
+    }
+
+
+def bench_extraction(documents, workers_options):
+    """
+    Times extract_text() for every document and worker setting.
+    """
+    results = []
+    for name, pdf_bytes in documents:
+        for workers in workers_options:
+            start = time.perf_counter()
+            text = extract_text(pdf_bytes, workers=workers)
+            seconds = time.perf_counter() - start
+            pages = text.count("\f") + 1
+            results.append({
+                "document": name,
+                "pages": pages,
+                "bytes": len(pdf_bytes),
+                "workers": workers,
+                "seconds": seconds,
+                "pages_per_sec": pages / seconds if seconds else None,
+            })
+            print(f"extract {name:>12} workers={workers}: {pages / seconds:8.1f} pages/s", file=sys.stderr)
+    return results
+
+
+def bench_sessions(documents, sessions, requests_per_session, latency, workers):
+    """
+    Runs the full pipeline from N concurrent sessions against the fake model
+    and reports end-to-end latency percentiles and throughput.
+    """
+    client = GeminiClient(FakeGeminiTransport(latency=latency, latency_per_kchar=latency / 30))
+    options = {"workers": workers}
+    latencies = []
+    errors = 0
+
+    def session(index):
+        nonlocal errors
+        for n in range(requests_per_session):
+            _, pdf_bytes = documents[(index + n) % len(documents)]
+            start = time.perf_counter()
+            try:
+                # No cache: every request pays for extraction and generation
+                build_study_kit(PdfSource.from_bytes(pdf_bytes), client, cache=None, options=options)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(session, range(sessions)))
+    wall = time.perf_counter() - start
+    client.close()
+
+    return {
+        "sessions": sessions,
+        "requests": len(latencies),
+        "errors": errors,
+        "wall_seconds": wall,
+        "throughput_rps": len(latencies) / wall if wall else None,
+        "latency_seconds": _percentiles(latencies),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline extraction and generation benchmarks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="page counts of the synthetic PDFs")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent simulated sessions")
+    parser.add_argument("--requests-per-session", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake model seconds per call")
+    parser.add_argument("--workers", type=int, default=default_workers(), help="extraction processes")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    documents = list(corpus(args.sizes, args.kinds))
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "extraction": bench_extraction(documents, sorted({1, args.workers})),
+        "end_to_end": bench_sessions(documents, args.sessions, args.requests_per_session, args.latency, args.workers),
+        "stages": metrics.REGISTRY.summary(),
+        "peak_rss_mb": {
+            "self": _peak_rss_mb(resource.RUSAGE_SELF),
+            "children": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        },
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Cold-start benchmark.
+
+Each run starts a fresh interpreter (nothing cached in sys.modules or
+st.cache_resource) and measures how long importing the app's dependencies
+takes, how long the first script run of app.py takes under Streamlit's
+AppTest harness, and how long a warm rerun takes. It also reports which
+heavy SDKs the first run imported: they are meant to load only when a
+request actually needs them, so anything listed there is a startup
+regression.
+
+Runs against the fake model backend and the in-memory feedback sheet, so no
+credentials or network are needed.
+
+Usage:
+    python -m benchmarks.startup --runs 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks.run import _percentiles
+
+# --- CONSTANTS ---
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+# Modules that should stay unimported until a request needs them
+HEAVY_MODULES = ("gspread", "google.generativeai", "PyPDF2", "pytesseract", "numpy", "http.server")
+PROBE_ENV = {
+    "GEMINI_TRANSPORT": "fake",
+    "FEEDBACK_BACKEND": "memory",
+    "GOOGLE_API_KEY": "startup-benchmark",
+}
+
+
+def probe(timeout):
+    """
+    Measures one cold start inside the current (fresh) interpreter and
+    returns the timings as a dict.
+    """
+    start = time.perf_counter()
+    import streamlit  # noqa: F401
+    from streamlit.testing.v1 import AppTest
+    streamlit_seconds = time.perf_counter() - start
+
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    start = time.perf_counter()
+    app.run()
+    first_run_seconds = time.perf_counter() - start
+    if app.exception:
+        raise RuntimeError(f"app.py raised on its first run: {app.exception[0].value}")
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    start = time.perf_counter()
+    app.run()
+    rerun_seconds = time.perf_counter() - start
+
+    return {
+        "import_streamlit_seconds": streamlit_seconds,
+        "first_run_seconds": first_run_seconds,
+        "rerun_seconds": rerun_seconds,
+        "heavy_modules_loaded": loaded,
+    }
+
+
+def _run_probe(timeout):
+    # A new interpreter per run, so every measurement is a true cold start
+    env = dict(os.environ, **PROBE_ENV)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--probe", "--timeout", str(timeout)],
+        cwd=os.path.dirname(APP_PATH),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall_seconds = time.perf_counter() - start
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample["process_seconds"] = wall_seconds
+    return sample
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for app.py.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds allowed per script run")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.probe:
+        print(json.dumps(probe(args.timeout)))
+        return
+
+    samples = []
+    for i in range(args.runs):
+        sample = _run_probe(args.timeout)
+        samples.append(sample)
+        print(f"run {i + 1}: first run {sample['first_run_seconds']:.3f}s, rerun {sample['rerun_seconds']:.3f}s",
+              file=sys.stderr)
+
+    timings = ("process_seconds", "import_streamlit_seconds", "first_run_seconds", "rerun_seconds")
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "timings": {name: _percentiles([s[name] for s in samples]) for name in timings},
+        "heavy_modules_loaded": sorted({name for s in samples for name in s["heavy_modules_loaded"]}),
+        "samples": samples,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
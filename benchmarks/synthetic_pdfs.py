@@ -0,0 +1,101 @@
+"""
+Deterministic synthetic PDF corpus for benchmarks.
+
+PDFs are written directly in PDF syntax (one content stream per page using the
+built-in Helvetica font), so no PDF-writing dependency is needed. Two layouts
+are available: "text" pages are dense paragraphs, "table" pages are grids of
+short cells with ruling lines.
+"""
+import random
+
+# --- CONSTANTS ---
+KINDS = ("text", "table")
+DEFAULT_SIZES = (10, 100, 500, 2000)
+WORDS = (
+    "energy system model analysis function process structure theory method "
+    "result value data cell network signal force rate equation protein market "
+    "policy memory learning algorithm matrix vector proof lemma pressure "
+    "temperature reaction theorem sample variance gradient boundary"
+).split()
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 16))]
+    return " ".join(words).capitalize() + "."
+
+
+def _text_page(rng, number):
+    lines = [f"BT /F1 16 Tf 72 740 Td ({_escape(f'Section {number}: ' + rng.choice(WORDS).title())}) Tj ET"]
+    lines.append("BT /F1 10 Tf 72 715 Td 13 TL")
+    for _ in range(48):
+        lines.append(f"({_escape(_sentence(rng)[:95])}) Tj T*")
+    lines.append("ET")
+    lines.append(f"BT /F1 8 Tf 300 30 Td ({number}) Tj ET")
+    return "\n".join(lines)
+
+
+def _table_page(rng, number, rows=30, cols=6):
+    parts = [f"BT /F1 14 Tf 72 740 Td (Table {number}) Tj ET", "0.5 w"]
+    top, left, width, height = 720, 60, 80, 20
+    for r in range(rows + 1):
+        y = top - r * height
+        parts.append(f"{left} {y} m {left + cols * width} {y} l S")
+    for c in range(cols + 1):
+        x = left + c * width
+        parts.append(f"{x} {top} m {x} {top - rows * height} l S")
+    for r in range(rows):
+        for c in range(cols):
+            cell = rng.choice(WORDS) if c == 0 or r == 0 else f"{rng.uniform(0, 1000):.2f}"
+            x = left + c * width + 4
+            y = top - (r + 1) * height + 6
+            parts.append(f"BT /F1 8 Tf {x} {y} Td ({_escape(cell)}) Tj ET")
+    return "\n".join(parts)
+
+
+def make_pdf(pages, kind="text", seed=0):
+    """
+    Returns the bytes of a `pages`-page PDF of the given kind.
+    The same arguments always produce the same bytes.
+    """
+    rng = random.Random(f"{kind}-{pages}-{seed}")
+    render = _text_page if kind == "text" else _table_page
+
+    font_id = 3 + 2 * pages
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{3 + 2 * i} 0 R" for i in range(pages)), pages
+        ),
+    ]
+    for i in range(pages):
+        stream = render(rng, i + 1)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R"
+            f" /Resources << /Font << /F1 {font_id} 0 R >> >> >>"
+        )
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return bytes(out)
+
+
+def corpus(sizes=DEFAULT_SIZES, kinds=KINDS, seed=0):
+    """
+    Yields (name, pdf_bytes) for every size/kind combination.
+    """
+    for kind in kinds:
+        for pages in sizes:
+            yield f"{kind}-{pages}p", make_pdf(pages, kind, seed)
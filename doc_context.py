@@ -0,0 +1,113 @@
+"""
+Reusable document context for model calls.
+
+Instead of pasting a chunk's text into every prompt, the text is handed to
+the model provider once (Gemini context caching, or the fake transport's
+in-memory store) and later requests only refer to it. With one request per
+section and follow-ups such as "more flashcards", the same chunk is sent
+many times, so this cuts request size, input-token cost and latency.
+
+Contexts are keyed by a hash of the text they hold. Chunking is
+deterministic, so every request for a given PDF maps onto the same
+contexts; a document that fits one prompt has exactly one context per PDF.
+Transports opt in by implementing `create_context(text, ttl)` and accepting
+a `context` argument in generate() and stream().
+"""
+import asyncio
+import hashlib
+import logging
+import time
+
+import metrics
+from prompt_budget import estimate_tokens
+
+# --- CONSTANTS ---
+DEFAULT_TTL = 3600  # seconds a context stays available at the provider
+# Gemini only caches contexts of at least 1024 tokens; the margin covers
+# the error of the local token estimate
+MIN_CONTEXT_TOKENS = 2048
+# Contexts this close to expiry are recreated rather than reused
+REFRESH_MARGIN = 60  # seconds
+# After a failed creation, the text is sent inline for this long
+FAILURE_BACKOFF = 300  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentContext:
+    """
+    Handle to text stored at the model provider: the provider's `name` for
+    it, when it `expires_at` (epoch seconds) and its size in `tokens`.
+    """
+
+    def __init__(self, name, expires_at, tokens=0):
+        self.name = name
+        self.expires_at = expires_at
+        self.tokens = tokens
+
+    def usable(self, now=None):
+        return self.expires_at - REFRESH_MARGIN > (now or time.time())
+
+
+def context_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DocumentContexts:
+    """
+    Creates and reuses document contexts through a GeminiClient.
+    All methods run on the client's event loop.
+    """
+
+    def __init__(self, client, ttl=DEFAULT_TTL, min_tokens=MIN_CONTEXT_TOKENS):
+        self.client = client
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self._contexts = {}
+        self._locks = {}
+        self._failed_until = {}
+
+    async def aget(self, text):
+        """
+        Returns a DocumentContext holding `text`, creating it on first use,
+        or None when the text should be sent inline: it is too small to be
+        cached, the transport has no context support or creation failed.
+        """
+        if estimate_tokens(text) < self.min_tokens:
+            return None
+
+        key = context_key(text)
+        # Concurrent section requests for one chunk share a single upload
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if self._failed_until.get(key, 0) > time.time():
+                return None
+            context = self._contexts.get(key)
+            if context is not None and context.usable():
+                metrics.inc("document_contexts_total", result="reused")
+                return context
+
+            try:
+                context = await self.client.acreate_context(text, self.ttl)
+            except Exception as e:
+                logger.warning("Could not create a document context, sending text inline: %s", e)
+                metrics.inc("document_contexts_total", result="error")
+                self._failed_until[key] = time.time() + FAILURE_BACKOFF
+                return None
+            if context is None:
+                return None
+
+            metrics.inc("document_contexts_total", result="created")
+            self._prune()
+            self._contexts[key] = context
+            return context
+
+    def _prune(self):
+        now = time.time()
+        for key, context in list(self._contexts.items()):
+            if not context.usable(now):
+                del self._contexts[key]
+                self._locks.pop(key, None)
+        for key, until in list(self._failed_until.items()):
+            if until <= now:
+                del self._failed_until[key]
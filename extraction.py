@@ -0,0 +1,300 @@
+"""
+Page extraction engine.
+
+Splits the pages of a PDF into batches and extracts them on a process pool,
+yielding per-page text in page order as results arrive. Each page gets a
+time budget so a single malformed page cannot stall the whole upload.
+Small documents are extracted inline, where process start-up would cost
+more than it saves; a watchdog enforces the same time budget there, and
+once a page overruns it the rest of the document moves to a process pool,
+where stuck pages can be terminated.
+
+The PDF is given either as bytes or as a path to a file on disk. Files are
+read through a memory map, so large uploads are never copied into each
+worker's memory. An optional page cache keyed by each page's content hash
+skips pages that were already extracted from an earlier upload.
+
+What is extracted from each page is pluggable: plain text by default, or
+e.g. the line records of the layout module.
+"""
+import hashlib
+import io
+import mmap
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import metrics
+
+# --- CONSTANTS ---
+DEFAULT_PAGE_TIMEOUT = 10.0  # seconds per page
+MIN_PAGES_FOR_POOL = 64
+TASKS_PER_WORKER = 4
+# Form feed is the conventional page break in extracted text
+PAGE_SEPARATOR = "\f"
+
+# Per-worker reader, opened once by the pool initializer
+_worker_reader = None
+
+
+def default_workers():
+    """
+    Number of extraction processes to use when none is configured.
+    """
+    return max(1, min(8, (os.cpu_count() or 1) - 1))
+
+
+def page_text(page):
+    """
+    Plain text of a page, the default extractor.
+    """
+    return page.extract_text() or ""
+
+
+def _extract_page(page, extractor=page_text):
+    # Returns (text, seconds) so workers can report per-page timings
+    start = time.perf_counter()
+    try:
+        text = extractor(page)
+    except Exception:
+        # Treat undecodable pages as empty rather than failing the document
+        text = ""
+    return text, time.perf_counter() - start
+
+
+def _collect(results):
+    for text, seconds in results:
+        metrics.observe("extract_page_seconds", seconds)
+        yield text
+
+
+def open_reader(pdf):
+    """
+    Opens a PdfReader over PDF bytes or a memory-mapped PDF file path.
+    """
+    # Imported on first use to keep app startup light
+    import PyPDF2
+
+    if isinstance(pdf, (bytes, bytearray)):
+        return PyPDF2.PdfReader(io.BytesIO(pdf))
+    with open(pdf, "rb") as f:
+        # The mapping stays valid after the file object is closed
+        return PyPDF2.PdfReader(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _init_worker(pdf):
+    global _worker_reader
+    _worker_reader = open_reader(pdf)
+
+
+def _extract_pages(indices, extractor):
+    return [_extract_page(_worker_reader.pages[i], extractor) for i in indices]
+
+
+def pool_context():
+    """
+    Multiprocessing context for worker pools. Forking a multi-threaded
+    Streamlit server is unsafe; forkserver keeps worker start-up cheap where
+    it is available.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _page_batches(indices, workers):
+    size = max(1, -(-len(indices) // (workers * TASKS_PER_WORKER)))
+    return [indices[start:start + size] for start in range(0, len(indices), size)]
+
+
+def _font_digest(font_ref, memo):
+    # Text decoding depends on the font encoding, so it is part of the key.
+    # Fonts are shared between pages; hash each one once per document.
+    idnum = getattr(font_ref, "idnum", None)
+    if idnum is not None and idnum in memo:
+        return memo[idnum]
+
+    font = font_ref.get_object()
+    digest = hashlib.sha256()
+    for name in ("/Subtype", "/BaseFont"):
+        digest.update(str(font.get(name)).encode("utf-8"))
+    encoding = font.get("/Encoding")
+    if encoding is not None:
+        encoding = encoding.get_object()
+        differences = encoding.get("/Differences") if hasattr(encoding, "get") else encoding
+        digest.update(str(differences).encode("utf-8"))
+    to_unicode = font.get("/ToUnicode")
+    if to_unicode is not None:
+        digest.update(to_unicode.get_object().get_data())
+
+    value = digest.digest()
+    if idnum is not None:
+        memo[idnum] = value
+    return value
+
+
+def page_key(page, memo=None):
+    """
+    Content hash of a page: its content stream plus the fonts and form
+    XObjects it uses. Identical pages in different uploads (or versions of
+    the same deck) get the same key. Returns None if the page cannot be
+    hashed.
+    """
+    memo = {} if memo is None else memo
+    try:
+        digest = hashlib.sha256()
+        contents = page.get_contents()
+        if contents is not None:
+            digest.update(contents.get_data())
+
+        resources = page.get("/Resources")
+        resources = resources.get_object() if resources is not None else {}
+        fonts = resources.get("/Font")
+        if fonts is not None:
+            fonts = fonts.get_object()
+            for name in sorted(fonts):
+                digest.update(name.encode("utf-8"))
+                digest.update(_font_digest(fonts.raw_get(name), memo))
+        xobjects = resources.get("/XObject")
+        if xobjects is not None:
+            xobjects = xobjects.get_object()
+            for name in sorted(xobjects):
+                xobject = xobjects[name].get_object()
+                if xobject.get("/Subtype") == "/Form":
+                    digest.update(name.encode("utf-8"))
+                    digest.update(xobject.get_data())
+        return digest.hexdigest()
+    except Exception:
+        return None
+
+
+def _extract_inline(reader, indices, page_timeout, extractor):
+    # Yields (text, seconds) for each page in `indices`, extracted on a
+    # background thread. A page that takes longer than `page_timeout` yields
+    # None and ends the iteration: a thread cannot be interrupted, so it is
+    # told to stop after that page and left to finish it on its own.
+    results = queue.SimpleQueue()
+    stop = threading.Event()
+
+    def run():
+        for i in indices:
+            if stop.is_set():
+                return
+            results.put(_extract_page(reader.pages[i], extractor))
+
+    threading.Thread(target=run, name="extract-inline", daemon=True).start()
+    for _ in indices:
+        try:
+            yield results.get(timeout=page_timeout)
+        except queue.Empty:
+            stop.set()
+            yield None
+            return
+
+
+def _iter_extracted(reader, pdf, indices, workers, page_timeout, extractor):
+    # Yields the text of each page in `indices`, in order; None marks a page
+    # that timed out.
+
+    # 1. Few pages: extract inline, handing the remaining pages to the pool
+    # once one page overruns its budget
+    if workers <= 1 or len(indices) < MIN_PAGES_FOR_POOL:
+        done = 0
+        for result in _extract_inline(reader, indices, page_timeout, extractor):
+            done += 1
+            if result is None:
+                metrics.inc("extract_page_timeouts_total")
+                yield None
+                if done < len(indices):
+                    yield from _iter_pooled(pdf, indices[done:], max(1, workers), page_timeout, extractor)
+                return
+            yield from _collect([result])
+        return
+
+    # 2. Many pages: fan page batches out to a process pool
+    yield from _iter_pooled(pdf, indices, workers, page_timeout, extractor)
+
+
+def _iter_pooled(pdf, indices, workers, page_timeout, extractor):
+    # A worker stuck on a page cannot be interrupted, and retrying on the
+    # same pool would queue pages behind it. After a timeout the pool is
+    # terminated and the pages still to come go to a new one, with the
+    # pages of the stuck batch split up so only the offending page is lost.
+    batches = _page_batches(indices, workers)
+    while batches:
+        pool = pool_context().Pool(workers, initializer=_init_worker, initargs=(pdf,))
+        try:
+            pending = [pool.apply_async(_extract_pages, (batch, extractor)) for batch in batches]
+            for n, (batch, result) in enumerate(zip(batches, pending)):
+                try:
+                    yield from _collect(result.get(timeout=page_timeout * len(batch)))
+                except multiprocessing.TimeoutError:
+                    if len(batch) == 1:
+                        metrics.inc("extract_page_timeouts_total")
+                        yield None
+                        batches = batches[n + 1:]
+                    else:
+                        batches = [[i] for i in batch] + batches[n + 1:]
+                    break
+            else:
+                batches = []
+        finally:
+            # terminate() also stops workers still stuck on a malformed page
+            pool.terminate()
+            pool.join()
+
+
+def iter_page_texts(pdf, workers=None, page_timeout=DEFAULT_PAGE_TIMEOUT, page_cache=None,
+                    extractor=page_text, cache_namespace=""):
+    """
+    Yields the text of every page of `pdf` (bytes or file path) in page order.
+    Pages that fail or exceed `page_timeout` seconds yield an empty string.
+
+    With a `page_cache` (study_cache.PageTextCache), pages whose content hash
+    was seen before are served from the cache and only new or modified pages
+    are parsed.
+
+    `extractor(page)` returns the string yielded for a PyPDF2 page; it must
+    be a module-level function so it can be sent to worker processes. Each
+    extractor other than page_text needs its own `cache_namespace` so their
+    page cache entries do not mix.
+    """
+    reader = open_reader(pdf)
+    page_count = len(reader.pages)
+    workers = workers or default_workers()
+
+    keys = [None] * page_count
+    cached = {}
+    if page_cache is not None:
+        memo = {}
+        keys = [page_key(page, memo) for page in reader.pages]
+        if cache_namespace:
+            keys = [f"{cache_namespace}:{key}" if key else None for key in keys]
+        cached = page_cache.get_many([key for key in keys if key])
+
+    missing = [i for i in range(page_count) if keys[i] not in cached]
+    if page_cache is not None:
+        metrics.inc("page_cache_pages_total", page_count - len(missing), result="hit")
+        metrics.inc("page_cache_pages_total", len(missing), result="miss")
+
+    extracted = _iter_extracted(reader, pdf, missing, workers, page_timeout, extractor)
+    fresh = {}
+    for i in range(page_count):
+        if keys[i] in cached:
+            yield cached[keys[i]]
+            continue
+        text = next(extracted)
+        if text is not None and keys[i]:
+            fresh[keys[i]] = text
+        yield text or ""
+
+    if page_cache is not None and fresh:
+        page_cache.set_many(fresh)
+
+
+def extract_text(pdf, workers=None, page_timeout=DEFAULT_PAGE_TIMEOUT, page_cache=None):
+    """
+    Extracts the full text of a PDF, with pages separated by PAGE_SEPARATOR.
+    """
+    return PAGE_SEPARATOR.join(iter_page_texts(pdf, workers, page_timeout, page_cache))
@@ -0,0 +1,132 @@
+"""
+Deterministic stand-in for the Gemini API.
+
+FakeGeminiTransport plugs into GeminiClient in place of GeminiTransport. It
+answers every prompt with a well-formed study kit derived from the prompt's
+text or its cached document context (limited to the sections in the
+requested schema), with configurable latency and an injectable rate of 429
+errors, so the pipeline can be exercised without network access or API spend.
+"""
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+
+from doc_context import DocumentContext
+from gemini_client import TransportError, record_usage
+
+# --- CONSTANTS ---
+STREAM_FRAGMENT_CHARS = 40
+TEXT_MARKER = "TEXT TO ANALYZE:"
+FORMAT_MARKER = "OUTPUT FORMAT"
+# Cached context tokens cost a fraction of the time of inline prompt tokens
+CACHED_LATENCY_FACTOR = 0.25
+
+
+def _prompt_text(prompt):
+    start = prompt.find(TEXT_MARKER)
+    end = prompt.find(FORMAT_MARKER)
+    if start == -1:
+        return prompt
+    return prompt[start + len(TEXT_MARKER):end if end != -1 else None]
+
+
+def fake_kit(prompt, items=4, document=None):
+    """
+    Builds a study kit from the sentences of the prompt's document text, or
+    of `document` when the text comes from a cached context.
+    The same prompt always yields the same kit.
+    """
+    text = document if document is not None else _prompt_text(prompt)
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", text) if len(s.strip()) > 20]
+    sentences = sentences[:items] or ["The document does not contain enough text."]
+
+    return {
+        "summary_points": sentences,
+        "flashcards": [
+            {"question": f"What does the text state about '{s[:40]}'?", "answer": s}
+            for s in sentences
+        ],
+        "quiz": [
+            {
+                "question": f"Which statement appears in the text? ({i + 1})",
+                "options": [f"A) {s[:60]}", "B) None of these", "C) All of these", "D) Not stated"],
+                "correct_answer": "A",
+            }
+            for i, s in enumerate(sentences)
+        ],
+    }
+
+
+class FakeGeminiTransport:
+    """
+    In-process transport returning fake_kit() responses.
+    `latency` is the base delay per call in seconds, `latency_per_kchar` adds
+    time proportional to prompt size and `error_rate` is the probability of a
+    429 response. `seed` makes the error sequence reproducible. Document
+    contexts are kept in memory.
+    """
+
+    def __init__(self, latency=0.0, latency_per_kchar=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.latency_per_kchar = latency_per_kchar
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.contexts = {}
+        self._context_ids = itertools.count(1)
+
+    async def create_context(self, text, ttl):
+        name = f"cachedContents/fake-{next(self._context_ids)}"
+        context = DocumentContext(name, time.time() + ttl, tokens=len(text) // 4)
+        self.contexts[name] = (context, text)
+        record_usage(context.tokens, 0)
+        return context
+
+    def _document(self, context):
+        if context is None:
+            return None
+        stored = self.contexts.get(context.name)
+        if stored is None or stored[0].expires_at < time.time():
+            raise TransportError(404, "Cached content not found (fake)")
+        return stored[1]
+
+    async def generate(self, prompt, context=None, **config):
+        self.calls += 1
+        document = self._document(context)
+        await asyncio.sleep(self._call_latency(prompt, document))
+        self._maybe_fail()
+        return self._response(prompt, config, document)
+
+    async def stream(self, prompt, context=None, **config):
+        # The call latency is spread evenly over the streamed fragments
+        self.calls += 1
+        document = self._document(context)
+        self._maybe_fail()
+        text = self._response(prompt, config, document)
+        fragments = [text[i:i + STREAM_FRAGMENT_CHARS] for i in range(0, len(text), STREAM_FRAGMENT_CHARS)]
+        delay = self._call_latency(prompt, document) / len(fragments)
+        for fragment in fragments:
+            await asyncio.sleep(delay)
+            yield fragment
+
+    def _call_latency(self, prompt, document=None):
+        chars = len(prompt) + CACHED_LATENCY_FACTOR * len(document or "")
+        return self.latency + self.latency_per_kchar * chars / 1000
+
+    def _maybe_fail(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise TransportError(429, "Resource has been exhausted (fake)")
+
+    def _response(self, prompt, config, document=None):
+        kit = fake_kit(prompt, document=document)
+        # Like the real model, answer only the sections the schema asks for
+        schema = config.get("response_schema")
+        if schema:
+            kit = {section: items for section, items in kit.items() if section in schema["properties"]}
+        text = "```json\n" + json.dumps(kit) + "\n```"
+        # Rough 4-characters-per-token estimate in place of real usage data
+        record_usage(len(prompt) // 4, len(text) // 4, len(document or "") // 4)
+        return text
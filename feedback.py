@@ -0,0 +1,204 @@
+"""
+Buffered feedback writer for Google Sheets.
+
+Submissions are written to a local SQLite spool and return immediately. A
+background flusher sends spooled rows to the sheet with one `append_rows`
+call per batch, either when `batch_size` rows are waiting or every
+`flush_interval` seconds. Rows are only deleted from the spool once the
+backend has accepted them, so Sheets outages and quota errors delay feedback
+instead of losing it. Several processes may share one spool file: each batch
+is claimed with a short lease before it is sent.
+"""
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# --- CONSTANTS ---
+DEFAULT_SPOOL_PATH = os.path.join(".cache", "feedback_spool.sqlite3")
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_FLUSH_INTERVAL = 5.0  # seconds
+CLAIM_LEASE = 60.0  # seconds before a claimed batch may be retried elsewhere
+DEFAULT_SHEET_NAME = "LearnFromPDF_Feedback"
+
+logger = logging.getLogger(__name__)
+
+
+class GspreadBackend:
+    """
+    Appends rows to the first worksheet of a Google Sheet.
+    The opened worksheet handle is cached and reopened only after an error.
+    """
+
+    def __init__(self, client, sheet_name=DEFAULT_SHEET_NAME):
+        self.client = client
+        self.sheet_name = sheet_name
+        self._worksheet = None
+
+    def _open_worksheet(self):
+        import gspread
+
+        try:
+            sh = self.client.open(self.sheet_name)
+        except gspread.SpreadsheetNotFound:
+            # Create if it doesn't exist (first run)
+            sh = self.client.create(self.sheet_name)
+            sh.share(self.client.auth.service_account_email, perm_type='user', role='owner')
+        return sh.get_worksheet(0)
+
+    def append_rows(self, rows):
+        if self._worksheet is None:
+            self._worksheet = self._open_worksheet()
+        try:
+            self._worksheet.append_rows(rows)
+        except Exception:
+            self._worksheet = None
+            raise
+
+
+class InMemorySheetsBackend:
+    """
+    Local stand-in for Google Sheets. `fail_next` makes the next N calls
+    raise, to simulate outages and quota errors.
+    """
+
+    def __init__(self, fail_next=0):
+        self.rows = []
+        self.calls = 0
+        self.fail_next = fail_next
+        self._lock = threading.Lock()
+
+    def append_rows(self, rows):
+        with self._lock:
+            self.calls += 1
+            if self.fail_next:
+                self.fail_next -= 1
+                raise RuntimeError("Quota exceeded (fake)")
+            self.rows.extend(rows)
+
+
+class FeedbackSink:
+    """
+    Durable spool plus background flusher in front of a Sheets backend.
+    """
+
+    def __init__(
+        self,
+        backend,
+        spool_path=DEFAULT_SPOOL_PATH,
+        batch_size=DEFAULT_BATCH_SIZE,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+        start=True,
+    ):
+        self.backend = backend
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._flush_lock = threading.Lock()
+
+        spool_dir = os.path.dirname(spool_path)
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " row TEXT NOT NULL,"
+                " claimed_at REAL)"
+            )
+
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._run, name="feedback-flusher", daemon=True)
+            self._thread.start()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.spool_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, row):
+        """
+        Spools one row and returns immediately.
+        """
+        with self._connect() as conn:
+            conn.execute("INSERT INTO spool (row) VALUES (?)", (json.dumps(row),))
+            if self.pending(conn) >= self.batch_size:
+                self._wake.set()
+
+    def pending(self, conn=None):
+        """
+        Number of rows waiting to be sent.
+        """
+        if conn is None:
+            with self._connect() as conn:
+                return conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def _claim_batch(self, conn):
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            batch = conn.execute(
+                "SELECT id, row FROM spool WHERE claimed_at IS NULL OR claimed_at < ?"
+                " ORDER BY id LIMIT ?",
+                (now - CLAIM_LEASE, self.batch_size),
+            ).fetchall()
+            conn.executemany("UPDATE spool SET claimed_at = ? WHERE id = ?", [(now, row_id) for row_id, _ in batch])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return batch
+
+    def flush(self):
+        """
+        Sends spooled rows in batches until the spool is empty or the backend
+        fails. Returns the number of rows sent.
+        """
+        sent = 0
+        with self._flush_lock, self._connect() as conn:
+            while True:
+                batch = self._claim_batch(conn)
+                if not batch:
+                    return sent
+                ids = [(row_id,) for row_id, _ in batch]
+                try:
+                    with metrics.span("feedback_flush"):
+                        self.backend.append_rows([json.loads(row) for _, row in batch])
+                except Exception as e:
+                    logger.warning("Feedback flush failed, %d rows kept in spool: %s", len(batch), e)
+                    conn.executemany("UPDATE spool SET claimed_at = NULL WHERE id = ?", ids)
+                    return sent
+                conn.executemany("DELETE FROM spool WHERE id = ?", ids)
+                sent += len(batch)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Feedback flusher error")
+
+    def close(self):
+        """
+        Stops the flusher after a final flush attempt.
+        """
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
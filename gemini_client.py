@@ -0,0 +1,266 @@
+"""
+Shared asynchronous model client.
+
+One GeminiClient is created per process. It owns a background event loop, so
+callers on any Streamlit script thread share the same connection, the same
+process-wide concurrency limit and the same retry policy. The network side is
+a pluggable transport (generate() and a streaming stream()): GeminiTransport
+talks to the real API, while the fake in fake_gemini.py stands in for it in
+tests and benchmarks. Transports may also hold document text as a reusable
+context (see doc_context.py) that later calls refer to.
+"""
+import asyncio
+import datetime
+import random
+import threading
+import time
+
+import metrics
+from doc_context import DocumentContext
+from prompt_budget import estimate_tokens
+
+# --- CONSTANTS ---
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0  # seconds
+DEFAULT_MAX_DELAY = 30.0  # seconds
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TransportError(Exception):
+    """
+    Error raised by transports, carrying the HTTP status of the failed call.
+    """
+
+    def __init__(self, status, message=""):
+        super().__init__(f"{status} {message}".strip())
+        self.code = status
+
+
+def record_usage(prompt_tokens, output_tokens, cached_tokens=0):
+    """
+    Counts input, output and cached-context tokens reported for one model call.
+    """
+    metrics.inc("model_tokens_total", prompt_tokens or 0, kind="input")
+    metrics.inc("model_tokens_total", output_tokens or 0, kind="output")
+    if cached_tokens:
+        metrics.inc("model_tokens_total", cached_tokens, kind="cached")
+
+
+def _record_response_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        cached = getattr(usage, "cached_content_token_count", 0) or 0
+        # prompt_token_count includes the cached tokens
+        record_usage(usage.prompt_token_count - cached, usage.candidates_token_count, cached)
+
+
+def is_retryable(error):
+    """
+    True for rate-limit (429) and server-side (5xx) errors.
+    google.api_core exceptions expose the HTTP status as `code`, like
+    TransportError does.
+    """
+    code = getattr(error, "code", None)
+    try:
+        return int(code) in RETRYABLE_STATUSES
+    except (TypeError, ValueError):
+        return False
+
+
+class GeminiTransport:
+    """
+    Transport backed by the google-generativeai SDK's async API.
+    """
+
+    def __init__(self, api_key, model_name):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self._context_models = {}
+
+    async def create_context(self, text, ttl):
+        """
+        Uploads `text` as Gemini cached content and returns its DocumentContext.
+        """
+        from google.generativeai import caching
+
+        def create():
+            return caching.CachedContent.create(
+                model=self.model_name,
+                contents=[text],
+                ttl=datetime.timedelta(seconds=ttl),
+            )
+
+        cached = await asyncio.get_running_loop().run_in_executor(None, create)
+        usage = getattr(cached, "usage_metadata", None)
+        return DocumentContext(
+            cached.name,
+            expires_at=time.time() + ttl,
+            tokens=getattr(usage, "total_token_count", 0) or 0,
+        )
+
+    async def _model_for(self, context):
+        if context is None:
+            return self.model
+        model = self._context_models.get(context.name)
+        if model is None:
+            import google.generativeai as genai
+
+            # Resolving the cached content is a blocking metadata lookup
+            model = await asyncio.get_running_loop().run_in_executor(
+                None, genai.GenerativeModel.from_cached_content, context.name
+            )
+            self._context_models[context.name] = model
+        return model
+
+    async def generate(self, prompt, context=None, **config):
+        model = await self._model_for(context)
+        response = await model.generate_content_async(
+            prompt, generation_config=config or None
+        )
+        _record_response_usage(response)
+        return response.text
+
+    async def stream(self, prompt, context=None, **config):
+        model = await self._model_for(context)
+        response = await model.generate_content_async(
+            prompt, generation_config=config or None, stream=True
+        )
+        async for chunk in response:
+            yield chunk.text
+        _record_response_usage(response)
+
+
+class GeminiClient:
+    """
+    Process-wide async client with bounded concurrency and jittered
+    exponential backoff on 429/5xx errors. With an `admission`
+    controller (admission.AdmissionController), calls also wait for their
+    turn within the API key's request and token quotas.
+    """
+
+    def __init__(
+        self,
+        transport,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        max_retries=DEFAULT_MAX_RETRIES,
+        base_delay=DEFAULT_BASE_DELAY,
+        max_delay=DEFAULT_MAX_DELAY,
+        admission=None,
+    ):
+        self.transport = transport
+        self.admission = admission
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        # All coroutines run on this loop, so the semaphore and the SDK's
+        # async channel are never shared across event loops.
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="gemini-client", daemon=True)
+        self._thread.start()
+        self._semaphore = self.run(self._make_semaphore(max_concurrency))
+
+    async def _make_semaphore(self, value):
+        return asyncio.Semaphore(value)
+
+    async def _admit(self, prompt, context):
+        if self.admission is not None:
+            tokens = estimate_tokens(prompt) + (context.tokens if context is not None else 0)
+            await self.admission.acquire(tokens)
+
+    def _on_error(self, error):
+        metrics.inc("model_errors_total", status=getattr(error, "code", "none"))
+        if self.admission is not None and getattr(error, "code", None) == 429:
+            self.admission.throttle()
+
+    def backoff_delay(self, attempt):
+        """
+        Full-jitter exponential backoff for the given retry attempt.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def acreate_context(self, text, ttl):
+        """
+        Stores `text` at the provider as a reusable document context.
+        Returns None if the transport does not support contexts.
+        """
+        create = getattr(self.transport, "create_context", None)
+        if create is None:
+            return None
+        async with self._semaphore:
+            with metrics.span("model_create_context"):
+                return await create(text, ttl)
+
+    async def agenerate(self, prompt, context=None, **config):
+        """
+        Sends one prompt and returns the response text, retrying
+        rate-limit and server errors. `context` is an optional
+        DocumentContext the prompt refers to.
+        """
+        attempt = 0
+        while True:
+            try:
+                await self._admit(prompt, context)
+                async with self._semaphore:
+                    with metrics.span("model_call", mode="blocking"):
+                        return await self.transport.generate(prompt, context=context, **config)
+            except Exception as e:
+                self._on_error(e)
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+            metrics.inc("model_retries_total")
+            await asyncio.sleep(self.backoff_delay(attempt))
+            attempt += 1
+
+    async def astream(self, prompt, context=None, **config):
+        """
+        Streams the response text fragment by fragment. Failures are retried
+        like agenerate() as long as nothing has been yielded yet.
+        """
+        attempt = 0
+        while True:
+            emitted = False
+            try:
+                await self._admit(prompt, context)
+                async with self._semaphore:
+                    with metrics.span("model_call", mode="stream"):
+                        start = time.perf_counter()
+                        async for fragment in self.transport.stream(prompt, context=context, **config):
+                            if not emitted:
+                                metrics.observe("model_ttft_seconds", time.perf_counter() - start)
+                                emitted = True
+                            yield fragment
+                return
+            except Exception as e:
+                self._on_error(e)
+                if emitted or attempt >= self.max_retries or not is_retryable(e):
+                    raise
+            metrics.inc("model_retries_total")
+            await asyncio.sleep(self.backoff_delay(attempt))
+            attempt += 1
+
+    def run(self, coro):
+        """
+        Runs a coroutine on the client's loop and blocks until it finishes.
+        Safe to call from any thread other than the loop's own.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def generate(self, prompt, **config):
+        """
+        Blocking convenience wrapper around agenerate().
+        """
+        return self.run(self.agenerate(prompt, **config))
+
+    def close(self):
+        """
+        Stops the background loop.
+        """
+        if self.admission is not None:
+            self.run(self.admission.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
@@ -0,0 +1,600 @@
+"""
+Map-reduce generation of study kits.
+
+Long documents are split on page and section boundaries into chunks that fill
+a single prompt's token budget. Each chunk is sent to the model concurrently
+through the shared GeminiClient (bounded by `max_concurrency` per document on
+top of the client's process-wide limit), and the partial kits are merged and
+de-duplicated in a reduce step, so every page of the document is covered.
+Each section of a chunk is requested separately and concurrently, so total
+latency follows the slowest section rather than the sum of all three, and
+more flashcards or quiz questions can be requested later on their own.
+Output is requested as schema-constrained JSON; if a section of a chunk's
+answer cannot be salvaged, only that section is requested again. With
+document contexts, a chunk's text is uploaded once and each request only
+refers to it.
+
+With an embedder (see vector_index), documents over a token budget are
+reduced to their most representative passages before chunking, and merged
+flashcards and quiz questions that reword earlier ones are dropped.
+
+Chunk boundaries are content-defined, so an edit to one page only changes
+the chunk that contains it. With a chunk cache, the kits of unchanged chunks
+are reused and only the changed chunks are sent to the model.
+"""
+import asyncio
+import hashlib
+import re
+import zlib
+
+import metrics
+from extraction import PAGE_SEPARATOR
+from parsing import SECTIONS, IncrementalKitParser, json_generation_config, parse_study_kit, validate_item
+from prompt_budget import estimate_tokens
+from study_cache import make_cache_key
+
+# --- CONSTANTS ---
+MODEL_NAME = "gemini-2.5-flash"
+# Bump whenever the generation prompt changes so cached kits are invalidated
+PROMPT_VERSION = 3
+# Whole-prompt budget (instructions + document text) per model call
+MAX_PROMPT_TOKENS = 32000
+# Hard cuts inside a block assume this many characters per token at worst
+MIN_CHARS_PER_TOKEN = 2
+DEFAULT_MAX_CONCURRENCY = 8
+# Most recent items listed in "more items" prompts as ones to avoid, and the
+# share of the prompt budget kept free for them
+MAX_EXCLUDED_ITEMS = 50
+EXCLUDE_RESERVE_TOKENS = 1024
+# Stands in for the chunk text when it is held in a document context
+CONTEXT_TEXT = "(the document text provided in the cached context)"
+# A page whose hash is divisible by this ends a chunk once the chunk holds at
+# least MIN_CHUNK_FRACTION of its token budget
+CHUNK_ANCHOR_MODULUS = 8
+MIN_CHUNK_FRACTION = 0.25
+# Pages that open a top-level section in layout-extracted text (see layout)
+# start a new chunk once the current one holds MIN_CHUNK_FRACTION of its budget
+SECTION_START = re.compile(r"^\s*#{1,2} \S")
+# Unit of retrieval when a document is cut down to its token budget
+RETRIEVAL_PASSAGE_TOKENS = 1500
+# Sections de-duplicated by meaning on top of exact matching
+SEMANTIC_DEDUPE_SECTIONS = ("flashcards", "quiz")
+
+PROMPT_TEMPLATE = """
+        You are an expert educational AI. Analyze the text and produce structured study content.
+        {part_note}
+        TEXT TO ANALYZE:
+        {text}
+
+        OUTPUT FORMAT (JSON ONLY):
+        {{
+{output_format}
+        }}
+        """
+
+
+SECTION_FORMATS = {
+    "summary_points": """            "summary_points": ["Point 1", "Point 2", "Point 3", "Point 4"]""",
+    "flashcards": """            "flashcards": [
+                {"question": "Question?", "answer": "Answer"}
+            ]""",
+    "quiz": """            "quiz": [
+                {"question": "Question?", "options": ["A", "B", "C", "D"], "correct_answer": "A"}
+            ]""",
+}
+
+
+class PartialKitError(Exception):
+    """
+    Raised when some chunks of a document failed while others produced a
+    kit. `kit` is the merged kit of the successful chunks and `failed` the
+    indices of the failed chunks. Successful chunks are in the chunk cache,
+    so generating the document again only sends the failed ones.
+    """
+
+    def __init__(self, kit, failed, total):
+        super().__init__(
+            f"{len(failed)} of {total} parts of the document could not be processed, "
+            "so this study kit is incomplete. Generating it again retries only those parts."
+        )
+        self.kit = kit
+        self.failed = failed
+        self.total = total
+
+
+def build_prompt(text, part=1, total_parts=1, sections=SECTIONS, exclude=None):
+    """
+    Builds the generation prompt for one chunk of the document, asking for
+    the given sections only. `exclude` lists questions or points the answer
+    must not repeat. With `text=None` the prompt refers to the chunk held in
+    a document context instead of including it.
+    """
+    part_note = ""
+    if total_parts > 1:
+        part_note = (
+            f"\n        The text is part {part} of {total_parts} of a longer document. "
+            "Only cover the material in this part.\n"
+        )
+    if exclude:
+        part_note += (
+            "\n        Only create new items. Do not repeat or rephrase any of these:\n"
+            + "".join(f"        - {entry}\n" for entry in exclude)
+        )
+    with metrics.span("build_prompt"):
+        output_format = ",\n".join(SECTION_FORMATS[section] for section in sections)
+        return PROMPT_TEMPLATE.format(
+            part_note=part_note,
+            text=CONTEXT_TEXT if text is None else text,
+            output_format=output_format,
+        )
+
+
+def chunk_token_budget(max_prompt_tokens=MAX_PROMPT_TOKENS):
+    """
+    Tokens left for document text once the prompt instructions and the
+    reserve for follow-up exclusion lists are counted. Every request for a
+    document uses the same budget, so they all see the same chunks.
+    """
+    overhead = estimate_tokens(build_prompt("", 1, 2)) + EXCLUDE_RESERVE_TOKENS
+    return max(1, max_prompt_tokens - overhead)
+
+
+def _split_oversized(block, max_tokens):
+    # Prefer paragraph breaks, then line breaks, then sentence ends, then a
+    # hard cut
+    for separator in (r"\n\n", r"\n", r"(?<=[.!?])\s+"):
+        parts = re.split(separator, block)
+        if len(parts) > 1:
+            pieces = []
+            for part in parts:
+                if estimate_tokens(part) > max_tokens:
+                    pieces.extend(_split_oversized(part, max_tokens))
+                else:
+                    pieces.append(part)
+            return pieces
+    size = max_tokens * MIN_CHARS_PER_TOKEN
+    return [block[i:i + size] for i in range(0, len(block), size)]
+
+
+def _is_anchor(block):
+    return zlib.crc32(block.encode("utf-8")) % CHUNK_ANCHOR_MODULUS == 0
+
+
+def split_into_chunks(text, max_tokens=None):
+    """
+    Splits extracted text into chunks of at most `max_tokens` estimated
+    tokens (by default, what is left of MAX_PROMPT_TOKENS after the prompt
+    instructions). Chunks are packed from whole pages; pages that are too
+    large on their own are split on paragraph, line or sentence boundaries.
+
+    Besides the size limit, a chunk also ends before a page that opens a
+    section (a level 1 or 2 "#" heading from layout extraction) and after
+    an "anchor" page (chosen by the page's content hash), so boundaries
+    depend on the pages around them rather than on everything before them:
+    inserting or editing a page leaves the other chunks unchanged.
+    """
+    max_tokens = max_tokens or chunk_token_budget()
+    min_tokens = int(max_tokens * MIN_CHUNK_FRACTION)
+    blocks = []
+    for page in text.split(PAGE_SEPARATOR):
+        tokens = estimate_tokens(page)
+        if tokens > max_tokens:
+            blocks.extend((piece, estimate_tokens(piece)) for piece in _split_oversized(page, max_tokens))
+        elif page.strip():
+            blocks.append((page, tokens))
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for block, tokens in blocks:
+        # +1 for the newline joining blocks
+        if current and (current_tokens + tokens + 1 > max_tokens
+                        or current_tokens >= min_tokens and SECTION_START.match(block)):
+            chunks.append("\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(block)
+        current_tokens += tokens + 1
+        if current_tokens >= min_tokens and _is_anchor(block):
+            chunks.append("\n".join(current))
+            current = []
+            current_tokens = 0
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+async def arequest_sections(client, text, sections, part=1, total_parts=1, context=None, exclude=None):
+    """
+    Requests the given sections for one chunk and returns
+    `(kit, failed_sections)`. With a DocumentContext holding the chunk, the
+    text is not sent again.
+    """
+    response_text = await client.agenerate(
+        build_prompt(None if context else text, part, total_parts, sections, exclude),
+        context=context,
+        **json_generation_config(sections),
+    )
+    return parse_study_kit(response_text, sections)
+
+
+def section_groups(split_sections=True):
+    """
+    Sections requested together: one request per section, so sections are
+    generated concurrently, or a single request for all of them.
+    """
+    return [[section] for section in SECTIONS] if split_sections else [list(SECTIONS)]
+
+
+def _first_error(results):
+    # A chunk missing a section is incomplete, so any failed request fails it
+    errors = [r for r in results if isinstance(r, BaseException)]
+    return errors[0] if errors else None
+
+
+async def agenerate_chunk(client, text, part=1, total_parts=1, split_sections=True, limit=None, contexts=None):
+    """
+    Generates the partial kit of a single chunk, with one concurrent request
+    per section group (see section_groups). Sections missing from an answer
+    are requested once more on their own; a section request that still
+    fails fails the chunk. `limit` is an optional semaphore bounding the
+    requests; with `contexts` (doc_context.DocumentContexts) the chunk is
+    uploaded once and shared by all of them.
+    """
+    limit = limit or asyncio.Semaphore(len(SECTIONS))
+    context = await contexts.aget(text) if contexts is not None else None
+
+    async def request(sections):
+        async with limit:
+            kit, failed = await arequest_sections(client, text, sections, part, total_parts, context)
+            if failed:
+                metrics.inc("section_rerequests_total", len(failed))
+                retry_kit, _ = await arequest_sections(client, text, failed, part, total_parts, context)
+                kit.update(retry_kit)
+            return kit
+
+    results = await asyncio.gather(
+        *(request(sections) for sections in section_groups(split_sections)),
+        return_exceptions=True,
+    )
+    error = _first_error(results)
+    if error is not None:
+        raise error
+
+    kit = {section: [] for section in SECTIONS}
+    for result in results:
+        kit.update(result)
+    if not any(kit.values()):
+        raise ValueError("The model response could not be parsed.")
+    return kit
+
+
+def chunk_cache_key(chunk):
+    """
+    Cache key for the kit of one chunk. It depends on the chunk text, model
+    and prompt version only, not on the chunk's position in the document.
+    """
+    return make_cache_key(hashlib.sha256(chunk.encode("utf-8")).hexdigest(), MODEL_NAME, PROMPT_VERSION)
+
+
+def _dedupe_key(value):
+    return " ".join(re.findall(r"\w+", str(value).lower()))
+
+
+def _item_text(section, item):
+    # What an item says: a flashcard's question and answer, or a quiz
+    # question with its correct option
+    if section == "flashcards":
+        return f"{item['question']} {item['answer']}"
+    correct = next((opt for opt in item["options"] if opt.startswith(item["correct_answer"])), "")
+    return f"{item['question']} {correct}"
+
+
+class KitMerger:
+    """
+    Accumulates items into a single kit, dropping summary points, flashcards
+    and quiz questions that repeat earlier ones. With an `embedder`,
+    flashcards and quiz questions that only reword earlier ones are dropped
+    too.
+    """
+
+    def __init__(self, embedder=None):
+        self.kit = {section: [] for section in SECTIONS}
+        self.seen = {section: set() for section in SECTIONS}
+        self.duplicates = None
+        if embedder is not None:
+            # NumPy loads with the first kit, not at app startup
+            from vector_index import NearDuplicateFilter
+
+            self.duplicates = NearDuplicateFilter(embedder)
+
+    def add(self, section, item):
+        """
+        Adds one item and returns True if it was new.
+        """
+        if not validate_item(section, item):
+            return False
+        key = _dedupe_key(item.get("question") if isinstance(item, dict) else item)
+        if not key or key in self.seen[section]:
+            return False
+        if (
+            self.duplicates is not None
+            and section in SEMANTIC_DEDUPE_SECTIONS
+            and not self.duplicates.admit(section, _item_text(section, item))
+        ):
+            metrics.inc("near_duplicates_total", section=section)
+            return False
+        self.seen[section].add(key)
+        self.kit[section].append(item)
+        return True
+
+
+def merge_kits(kits, embedder=None):
+    """
+    Reduce step: concatenates partial kits in document order and
+    de-duplicates them with KitMerger.
+    """
+    merger = KitMerger(embedder)
+    for kit in kits:
+        for section in SECTIONS:
+            for item in kit.get(section) or []:
+                merger.add(section, item)
+    return merger.kit
+
+
+def select_representative_text(text, token_budget, embedder, index_store=None):
+    """
+    Cuts `text` down to about `token_budget` tokens by keeping the passages
+    that best represent the whole document (see
+    vector_index.select_representative), in document order. Text within
+    the budget is returned unchanged.
+    """
+    if estimate_tokens(text) <= token_budget:
+        return text
+    from vector_index import build_index, select_representative
+
+    passages = split_into_chunks(text, RETRIEVAL_PASSAGE_TOKENS)
+    with metrics.span("select_passages"):
+        index = build_index(passages, embedder, index_store)
+        chosen = select_representative(index, [estimate_tokens(p) for p in passages], token_budget)
+    metrics.inc("retrieval_passages_total", len(chosen), result="selected")
+    metrics.inc("retrieval_passages_total", len(passages) - len(chosen), result="dropped")
+    return PAGE_SEPARATOR.join(passages[i] for i in chosen)
+
+
+def _get_cached_chunk(chunk_cache, chunk):
+    if chunk_cache is None:
+        return None
+    kit = chunk_cache.get(chunk_cache_key(chunk))
+    metrics.inc("chunk_cache_requests_total", result="hit" if kit else "miss")
+    return kit
+
+
+class _ChunkProgress:
+    # Reports (done, total) after every finished chunk, failed or not
+    def __init__(self, total, on_progress):
+        self.done = 0
+        self.total = total
+        self.on_progress = on_progress
+        self.report()
+
+    def report(self):
+        if self.on_progress:
+            self.on_progress(self.done, self.total)
+
+    def advance(self):
+        self.done += 1
+        self.report()
+
+
+async def agenerate_study_kit(
+    text,
+    client,
+    max_prompt_tokens=MAX_PROMPT_TOKENS,
+    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+    on_progress=None,
+    chunk_cache=None,
+    split_sections=True,
+    contexts=None,
+    embedder=None,
+):
+    """
+    Generates a study kit covering all of `text`.
+    Chunks (and, with `split_sections`, the sections of each chunk) are
+    generated concurrently, at most `max_concurrency` requests at a time. If
+    every chunk fails the first chunk error is raised, if only some fail a
+    PartialKitError carries the kit of the others. `on_progress(done, total)`
+    is called as chunks finish. Chunks found in `chunk_cache` (a
+    study_cache.StudyKitCache) are not sent to the model.
+    """
+    chunks = split_into_chunks(text, chunk_token_budget(max_prompt_tokens))
+    if not chunks:
+        return None
+
+    total = len(chunks)
+    limit = asyncio.Semaphore(max(1, max_concurrency))
+    progress = _ChunkProgress(total, on_progress)
+
+    async def run_chunk(i, chunk):
+        cached = _get_cached_chunk(chunk_cache, chunk)
+        if cached is not None:
+            progress.advance()
+            return cached
+        try:
+            kit = await agenerate_chunk(client, chunk, i + 1, total, split_sections, limit, contexts)
+        finally:
+            progress.advance()
+        if chunk_cache is not None and all(kit.values()):
+            chunk_cache.set(chunk_cache_key(chunk), kit)
+        return kit
+
+    results = await asyncio.gather(
+        *(run_chunk(i, chunk) for i, chunk in enumerate(chunks)),
+        return_exceptions=True,
+    )
+
+    failed = [i for i, r in enumerate(results) if isinstance(r, BaseException)]
+    if len(failed) == total:
+        raise results[0]
+    kit = merge_kits([r for r in results if not isinstance(r, BaseException)], embedder)
+    if failed:
+        raise PartialKitError(kit, failed, total)
+    return kit
+
+
+def generate_study_kit(
+    text,
+    client,
+    max_prompt_tokens=MAX_PROMPT_TOKENS,
+    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+    chunk_cache=None,
+    split_sections=True,
+    contexts=None,
+    embedder=None,
+):
+    """
+    Blocking wrapper running agenerate_study_kit() on the client's loop.
+    """
+    return client.run(agenerate_study_kit(
+        text, client, max_prompt_tokens, max_concurrency,
+        chunk_cache=chunk_cache, split_sections=split_sections, contexts=contexts, embedder=embedder,
+    ))
+
+
+async def astream_study_kit(
+    text,
+    client,
+    on_item,
+    max_prompt_tokens=MAX_PROMPT_TOKENS,
+    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+    on_progress=None,
+    chunk_cache=None,
+    split_sections=True,
+    contexts=None,
+    embedder=None,
+):
+    """
+    Streaming variant of agenerate_study_kit().
+    Every response is parsed incrementally and each new, de-duplicated item
+    is passed to `on_item(section, item)` as soon as it is complete, so a
+    section shows up as soon as its own request delivers it. Items of chunks
+    found in `chunk_cache` are passed on immediately. Returns the merged kit;
+    failed chunks raise like in agenerate_study_kit().
+    """
+    chunks = split_into_chunks(text, chunk_token_budget(max_prompt_tokens))
+    if not chunks:
+        return None
+
+    total = len(chunks)
+    limit = asyncio.Semaphore(max(1, max_concurrency))
+    merger = KitMerger(embedder)
+    progress = _ChunkProgress(total, on_progress)
+
+    def emit(section, item):
+        if merger.add(section, item):
+            on_item(section, item)
+
+    async def stream_sections(i, chunk, sections, kit, context):
+        async with limit:
+            parser = IncrementalKitParser()
+            prompt = build_prompt(None if context else chunk, i + 1, total, sections)
+            async for fragment in client.astream(prompt, context=context, **json_generation_config(sections)):
+                for section, item in parser.feed(fragment):
+                    if section not in sections:
+                        continue
+                    if validate_item(section, item):
+                        kit[section].append(item)
+                    emit(section, item)
+
+            # Re-request only the sections that produced nothing usable
+            failed = [section for section in sections if not kit[section]]
+            if failed:
+                metrics.inc("section_rerequests_total", len(failed))
+                retry_kit, _ = await arequest_sections(client, chunk, failed, i + 1, total, context)
+                for section in failed:
+                    kit[section] = retry_kit[section]
+                    for item in retry_kit[section]:
+                        emit(section, item)
+
+    async def run_chunk(i, chunk):
+        cached = _get_cached_chunk(chunk_cache, chunk)
+        if cached is not None:
+            for section in SECTIONS:
+                for item in cached.get(section) or []:
+                    emit(section, item)
+            progress.advance()
+            return
+
+        kit = {section: [] for section in SECTIONS}
+        try:
+            context = await contexts.aget(chunk) if contexts is not None else None
+            results = await asyncio.gather(
+                *(stream_sections(i, chunk, sections, kit, context) for sections in section_groups(split_sections)),
+                return_exceptions=True,
+            )
+        finally:
+            progress.advance()
+        error = _first_error(results)
+        if error is not None:
+            raise error
+
+        # Incomplete kits are not cached so the next run asks again
+        if chunk_cache is not None and all(kit.values()):
+            chunk_cache.set(chunk_cache_key(chunk), kit)
+
+    results = await asyncio.gather(
+        *(run_chunk(i, chunk) for i, chunk in enumerate(chunks)),
+        return_exceptions=True,
+    )
+
+    failed = [i for i, r in enumerate(results) if isinstance(r, BaseException)]
+    if not failed:
+        return merger.kit
+    if len(failed) == total and not any(merger.kit.values()):
+        raise results[failed[0]]
+    raise PartialKitError(merger.kit, failed, total)
+
+
+def _item_label(item):
+    return item.get("question") if isinstance(item, dict) else item
+
+
+def _exclusion_list(existing):
+    # Most recent items first to go when the list outgrows its reserve
+    exclude = [str(_item_label(item)) for item in existing[-MAX_EXCLUDED_ITEMS:]]
+    while exclude and estimate_tokens("\n".join(exclude)) > EXCLUDE_RESERVE_TOKENS:
+        exclude.pop(0)
+    return exclude
+
+
+async def agenerate_more(
+    text,
+    client,
+    section,
+    existing,
+    round_index=0,
+    max_prompt_tokens=MAX_PROMPT_TOKENS,
+    contexts=None,
+    embedder=None,
+):
+    """
+    Requests additional items for one section without regenerating the rest
+    of the kit. Each round draws on another chunk of `text` (picked by
+    `round_index`), the prompt lists the `existing` items to avoid, and only
+    items that do not repeat them are returned. The chunk's document
+    context from the first generation is reused when it is still alive.
+    """
+    merger = KitMerger(embedder)
+    for item in existing:
+        merger.add(section, item)
+
+    chunks = split_into_chunks(text, chunk_token_budget(max_prompt_tokens))
+    if not chunks:
+        return []
+
+    part = round_index % len(chunks)
+    context = await contexts.aget(chunks[part]) if contexts is not None else None
+    kit, _ = await arequest_sections(
+        client, chunks[part], [section], part + 1, len(chunks), context, exclude=_exclusion_list(existing),
+    )
+    return [item for item in kit[section] if merger.add(section, item)]
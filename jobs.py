@@ -0,0 +1,210 @@
+"""
+Background job subsystem for study kit generation.
+
+Jobs run on a thread pool owned by the process, so Streamlit reruns, widget
+interactions and disconnects never interrupt them. A job's ID is derived from
+its PDF's content hash, the model and prompt version and the options, which
+de-duplicates identical requests while they are in flight. Finished jobs are
+written to a JSON file per job in a size-bounded LRU store, so the UI can
+pick results up again after a page reload (the job ID lives in the URL) or
+from another worker process. The job store is not a result cache: finished
+kits are served from the study kit cache, and stored jobs are evicted once
+the store outgrows its budget.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from generation import MODEL_NAME, PROMPT_VERSION, PartialKitError
+from study_cache import DiskLRUStore, make_cache_key
+
+# --- CONSTANTS ---
+DEFAULT_STORE_DIR = os.path.join(".cache", "jobs")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # 64 MB
+DEFAULT_WORKERS = 4
+
+QUEUED = "queued"
+EXTRACTING = "extracting"
+GENERATING = "generating"
+MERGING = "merging"
+DONE = "done"
+# Finished with a kit that misses the chunks that failed
+PARTIAL = "partial"
+FAILED = "failed"
+FINISHED_STATES = (DONE, PARTIAL, FAILED)
+
+
+def make_job_id(pdf_digest, options):
+    """
+    Deterministic job ID for a PDF (by content hash), the current model and
+    prompt version, and its generation options.
+    """
+    digest = hashlib.sha256()
+    digest.update(make_cache_key(pdf_digest, MODEL_NAME, PROMPT_VERSION).encode("utf-8"))
+    digest.update(json.dumps(options or {}, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class Job:
+    """
+    State of one generation job for the PDF whose content hash is
+    `document`. `items` collects (section, item) pairs as they stream in, so
+    the UI can show partial results.
+    """
+
+    def __init__(self, job_id, document=None, state=QUEUED, done=0, total=0, result=None, error=None,
+                 updated_at=None):
+        self.id = job_id
+        self.document = document
+        self.state = state
+        self.done = done
+        self.total = total
+        self.result = result
+        self.error = error
+        self.updated_at = updated_at or time.time()
+        self.items = []
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def report(self, state, done=None, total=None):
+        """
+        Progress callback handed to the pipeline.
+        """
+        self.state = state
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        self.updated_at = time.time()
+
+    def add_item(self, section, item):
+        self.items.append((section, item))
+
+    def describe(self):
+        """
+        Human readable progress label.
+        """
+        if self.state == GENERATING and self.total:
+            return f"Generating chunk {min(self.done + 1, self.total)}/{self.total}"
+        return self.state.capitalize()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "document": self.document,
+            "state": self.state,
+            "done": self.done,
+            "total": self.total,
+            "result": self.result,
+            "error": self.error,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["id"],
+            document=data.get("document"),
+            state=data["state"],
+            done=data.get("done", 0),
+            total=data.get("total", 0),
+            result=data.get("result"),
+            error=data.get("error"),
+            updated_at=data.get("updated_at"),
+        )
+
+
+class JobStore(DiskLRUStore):
+    """
+    LRU store of finished jobs, stored as JSON.
+    """
+
+    suffix = ".json"
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(store_dir, max_bytes)
+
+    def get(self, job_id):
+        data = self.get_bytes(job_id)
+        if data is None:
+            return None
+        try:
+            return Job.from_dict(json.loads(data))
+        except (json.JSONDecodeError, KeyError):
+            return None
+
+    def set(self, job):
+        self.set_bytes(job.id, json.dumps(job.to_dict(), ensure_ascii=False).encode("utf-8"))
+
+
+class JobManager:
+    """
+    Accepts (PDF source, options) jobs and runs them on a worker pool.
+    """
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, workers=DEFAULT_WORKERS, max_bytes=DEFAULT_MAX_BYTES):
+        self.store = JobStore(store_dir, max_bytes)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="study-job")
+        self._lock = threading.Lock()
+        self._active = {}
+
+    def submit(self, source, options, runner):
+        """
+        Queues a job for an uploads.PdfSource and returns its ID.
+
+        `runner(source, options, job)` does the work and returns the kit;
+        it reports progress through `job.report` and `job.add_item`.
+        An identical job still in flight is shared; otherwise a new job
+        runs, replacing the stored one with the same ID.
+        """
+        job_id = make_job_id(source.digest, options)
+        with self._lock:
+            if job_id in self._active:
+                return job_id
+            job = Job(job_id, source.digest)
+            self._active[job_id] = job
+
+        self._pool.submit(self._run, job, source, options, runner)
+        return job_id
+
+    def _run(self, job, source, options, runner):
+        try:
+            with metrics.span("job"):
+                result = runner(source, options, job)
+            if result:
+                job.result = result
+                job.report(DONE)
+            else:
+                job.error = "The model returned no study material."
+                job.report(FAILED)
+        except PartialKitError as e:
+            job.result = e.kit
+            job.error = str(e)
+            job.report(PARTIAL)
+        except Exception as e:
+            job.error = str(e)
+            job.report(FAILED)
+        metrics.inc("jobs_total", state=job.state)
+
+        try:
+            self.store.set(job)
+        finally:
+            with self._lock:
+                self._active.pop(job.id, None)
+
+    def get(self, job_id):
+        """
+        Returns the job with `job_id`, whether it is running in this process
+        or finished and stored on disk, or None if it is unknown.
+        """
+        with self._lock:
+            job = self._active.get(job_id)
+        if job is not None:
+            return job
+        return self.store.get(job_id)
@@ -0,0 +1,175 @@
+"""
+Persistent store of generated study kits.
+
+Every kit a user generates is saved to a local SQLite database as
+zlib-compressed JSON, together with the PDF's content hash and a few
+metadata columns (file name, item counts, timestamps). Lookups by owner
+(the browser session carried in the URL) are indexed and read metadata
+only, so listing someone's kits does not touch the blobs and reopening one
+decompresses a single row; a kit only opens for its owner. This keeps
+thousands of kits per node cheap and turns "open a past kit" into a local
+read instead of a new round of model calls.
+
+Unlike the study kit cache, entries belong to an owner and also keep items
+added later with "More flashcards"/"More questions".
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+import metrics
+from parsing import SECTIONS
+
+# --- CONSTANTS ---
+DEFAULT_KIT_STORE_PATH = os.path.join(".cache", "kits.sqlite3")
+DEFAULT_MAX_KITS = 20000
+COMPRESSION_LEVEL = 6
+DEFAULT_LIST_LIMIT = 20
+
+
+def make_kit_id(owner, document):
+    """
+    Stable ID of an owner's kit for a document, so regenerating the same
+    PDF updates the existing entry.
+    """
+    return hashlib.sha256(f"{owner}\0{document}".encode("utf-8")).hexdigest()[:32]
+
+
+def _pack(data):
+    return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                         COMPRESSION_LEVEL)
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+class KitRecord:
+    """
+    Metadata of a stored kit; `data` holds the kit itself when it was loaded.
+    """
+
+    def __init__(self, kit_id, owner, document, name, counts, size, created_at, updated_at, data=None):
+        self.id = kit_id
+        self.owner = owner
+        self.document = document
+        self.name = name
+        self.counts = counts
+        self.size = size
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.data = data
+
+    def describe(self):
+        return ", ".join(f"{self.counts[section]} {label}" for section, label in
+                         zip(SECTIONS, ("concepts", "flashcards", "questions")))
+
+
+_COLUMNS = "kit_id, owner, document, name, summary_count, flashcard_count, quiz_count, size, created_at, updated_at"
+
+
+def _record(row, data=None):
+    kit_id, owner, document, name, summary, flashcards, quiz, size, created_at, updated_at = row
+    counts = dict(zip(SECTIONS, (summary, flashcards, quiz)))
+    return KitRecord(kit_id, owner, document, name, counts, size, created_at, updated_at, data)
+
+
+class KitStore:
+    """
+    SQLite store of study kits, shared by every session and process on a
+    node. Holds at most `max_kits` kits; the least recently updated go first.
+    """
+
+    def __init__(self, path=DEFAULT_KIT_STORE_PATH, max_kits=DEFAULT_MAX_KITS):
+        self.path = path
+        self.max_kits = max_kits
+
+        store_dir = os.path.dirname(path)
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kits ("
+                " kit_id TEXT PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " document TEXT NOT NULL,"
+                " name TEXT,"
+                " summary_count INTEGER NOT NULL,"
+                " flashcard_count INTEGER NOT NULL,"
+                " quiz_count INTEGER NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " data BLOB NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS kits_owner ON kits (owner, updated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS kits_updated_at ON kits (updated_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def save(self, owner, document, data, name=None):
+        """
+        Stores `owner`'s kit for the PDF with content hash `document`,
+        replacing an earlier one, and returns its kit ID.
+        """
+        kit_id = make_kit_id(owner, document)
+        blob = _pack(data)
+        counts = [len(data.get(section) or []) for section in SECTIONS]
+        now = time.time()
+        with metrics.span("kit_store_save"), self._connect() as conn:
+            conn.execute(
+                "INSERT INTO kits (kit_id, owner, document, name, summary_count, flashcard_count, quiz_count,"
+                " size, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (kit_id) DO UPDATE SET name = COALESCE(excluded.name, name),"
+                " summary_count = excluded.summary_count, flashcard_count = excluded.flashcard_count,"
+                " quiz_count = excluded.quiz_count, size = excluded.size, updated_at = excluded.updated_at,"
+                " data = excluded.data",
+                (kit_id, owner, document, name, *counts, len(blob), now, now, blob),
+            )
+            self.evict(conn)
+        return kit_id
+
+    def get(self, kit_id, owner):
+        """
+        Returns the KitRecord with its kit for `kit_id`, or None if there is
+        no such kit or it belongs to someone other than `owner`.
+        """
+        with metrics.span("kit_store_load"), self._connect() as conn:
+            row = conn.execute(f"SELECT {_COLUMNS}, data FROM kits WHERE kit_id = ? AND owner = ?",
+                               (kit_id, owner)).fetchone()
+        if row is None:
+            return None
+        return _record(row[:-1], _unpack(row[-1]))
+
+    def list_for_owner(self, owner, limit=DEFAULT_LIST_LIMIT):
+        """
+        Metadata of `owner`'s most recently updated kits, without the kits.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM kits WHERE owner = ? ORDER BY updated_at DESC LIMIT ?",
+                (owner, limit),
+            ).fetchall()
+        return [_record(row) for row in rows]
+
+    def evict(self, conn):
+        """
+        Removes the least recently updated kits beyond max_kits.
+        """
+        excess = conn.execute("SELECT COUNT(*) FROM kits").fetchone()[0] - self.max_kits
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM kits WHERE kit_id IN (SELECT kit_id FROM kits ORDER BY updated_at LIMIT ?)",
+                (excess,),
+            )
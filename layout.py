@@ -0,0 +1,321 @@
+"""
+Layout-aware extraction.
+
+Reads every line of a page together with its font size and vertical
+position, in the same PyPDF2 pass as plain extraction (through its text
+visitor), and builds a compact document model from them. Each page is a
+__slots__ record whose per-line attributes live in arrays: the lines, their
+sizes and positions, and a role per line. Roles mark running headers and
+footers (lines near the top or bottom edge that repeat across pages, and
+page numbers) and headings, whose level follows from their font size
+relative to the body text.
+
+DocumentLayout.to_text() renders the body for the rest of the pipeline:
+boilerplate is dropped before it costs prompt tokens, headings become
+Markdown-style "#" lines that chunking splits on, and pages stay separated
+by PAGE_SEPARATOR, so compress_document() has no headers or footers left to
+strip. Pages without layout information (e.g. OCR'd scans) are plain lines
+of body text whose first and last lines may be headers and footers.
+"""
+import json
+import math
+from array import array
+from collections import Counter
+
+from extraction import DEFAULT_PAGE_TIMEOUT, PAGE_SEPARATOR, iter_page_texts
+from prompt_budget import EDGE_LINES, find_boilerplate
+
+# --- CONSTANTS ---
+# Page cache entries of line records are kept apart from plain page text
+CACHE_NAMESPACE = "layout"
+# Line roles; a heading of level n has role ROLE_HEADING + n - 1
+ROLE_BODY = 0
+ROLE_HEADER = 1
+ROLE_FOOTER = 2
+ROLE_HEADING = 3
+MAX_HEADING_LEVELS = 3
+HEADING_ROLES = tuple(range(ROLE_HEADING, ROLE_HEADING + MAX_HEADING_LEVELS))
+# Share of the page height at the top and bottom where headers/footers sit
+EDGE_BAND = 0.1
+# A line is a heading when its font is this much larger than the body font
+HEADING_SIZE_RATIO = 1.15
+MAX_HEADING_CHARS = 120
+# A size that carries more than this share of the text is body text of some
+# pages (e.g. large-print slides), not a heading size
+MAX_HEADING_SHARE = 0.2
+# Font sizes are compared in steps of this many points
+SIZE_STEP = 0.5
+NO_POSITION = -1.0
+
+
+def _multiply(m, n):
+    # Product of two PDF transformation matrices [a b c d e f]
+    return (
+        m[0] * n[0] + m[1] * n[2],
+        m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2],
+        m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4],
+        m[4] * n[1] + m[5] * n[3] + n[5],
+    )
+
+
+def extract_page_layout(page):
+    """
+    Extractor for extraction.iter_page_texts(): the page's lines with the
+    font size and position (0 at the bottom edge, 1 at the top) of each,
+    encoded as a compact JSON string.
+    """
+    box = page.mediabox
+    bottom = float(box.bottom)
+    height = float(box.height) or 1.0
+    lines = [""]
+    sizes = [0.0]
+    positions = [NO_POSITION]
+
+    def visit(text, cm, tm, font, font_size):
+        if not text:
+            return
+        matrix = _multiply(tm, cm)
+        size = font_size * math.hypot(matrix[2], matrix[3])
+        position = min(1.0, max(0.0, (matrix[5] - bottom) / height))
+        for i, part in enumerate(text.split("\n")):
+            if i:
+                lines.append("")
+                sizes.append(0.0)
+                positions.append(NO_POSITION)
+            lines[-1] += part
+            if part.strip():
+                # A line is as large as its largest run and sits where it starts
+                sizes[-1] = max(sizes[-1], size)
+                if positions[-1] == NO_POSITION:
+                    positions[-1] = position
+
+    page.extract_text(visitor_text=visit)
+    while lines and not lines[-1].strip():
+        lines.pop()
+    count = len(lines)
+    if not count:
+        return ""
+    return json.dumps(
+        [lines, [round(s, 1) for s in sizes[:count]], [round(p, 3) for p in positions[:count]]],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+class Heading:
+    """
+    A heading in the document outline; `parent` is the index of the
+    enclosing heading in the outline, or -1.
+    """
+
+    __slots__ = ("page", "level", "text", "parent")
+
+    def __init__(self, page, level, text, parent):
+        self.page = page
+        self.level = level
+        self.text = text
+        self.parent = parent
+
+
+class PageLayout:
+    """
+    The lines of one page (numbered from 1) with the font size, position
+    and role of each line.
+    """
+
+    __slots__ = ("number", "lines", "sizes", "positions", "roles")
+
+    def __init__(self, number, lines=(), sizes=None, positions=None):
+        self.number = number
+        self.lines = tuple(lines)
+        self.sizes = array("f", sizes if sizes is not None else [0.0] * len(self.lines))
+        self.positions = array("f", positions if positions is not None else [NO_POSITION] * len(self.lines))
+        self.roles = bytearray(len(self.lines))
+
+    @classmethod
+    def decode(cls, number, data):
+        """
+        Page from the output of extract_page_layout(); an empty string is an
+        empty page.
+        """
+        if not data:
+            return cls(number)
+        lines, sizes, positions = json.loads(data)
+        return cls(number, lines, sizes, positions)
+
+    @classmethod
+    def from_text(cls, number, text):
+        """
+        Page of plain text without layout information.
+        """
+        return cls(number, text.split("\n") if text else ())
+
+    def text(self):
+        """
+        All lines of the page, like plain extraction.
+        """
+        return "\n".join(self.lines)
+
+    def level(self, i):
+        """
+        Heading level of line `i`, or 0 if it is not a heading.
+        """
+        role = self.roles[i]
+        return role - ROLE_HEADING + 1 if role >= ROLE_HEADING else 0
+
+    def _lines_with(self, role):
+        return "\n".join(line for line, r in zip(self.lines, self.roles) if r == role)
+
+    @property
+    def header(self):
+        return self._lines_with(ROLE_HEADER)
+
+    @property
+    def footer(self):
+        return self._lines_with(ROLE_FOOTER)
+
+    @property
+    def headings(self):
+        """
+        (level, text) of each heading on the page, top to bottom.
+        """
+        return [(self.level(i), self.lines[i].strip()) for i in range(len(self.lines)) if self.level(i)]
+
+    def render(self):
+        """
+        The page without its header and footer, headings marked with "#".
+        """
+        kept = []
+        for i, line in enumerate(self.lines):
+            role = self.roles[i]
+            if role in (ROLE_HEADER, ROLE_FOOTER):
+                continue
+            if role >= ROLE_HEADING:
+                line = "#" * self.level(i) + " " + line.strip()
+            kept.append(line)
+        return "\n".join(kept)
+
+
+class DocumentLayout:
+    """
+    Pages of a document with their lines' roles assigned.
+    """
+
+    __slots__ = ("pages", "body_size")
+
+    def __init__(self, pages, body_size):
+        self.pages = pages
+        self.body_size = body_size
+
+    def outline(self):
+        """
+        The document's headings in order, each linked to its parent.
+        """
+        outline = []
+        open_headings = []
+        for page in self.pages:
+            for level, text in page.headings:
+                while open_headings and outline[open_headings[-1]].level >= level:
+                    open_headings.pop()
+                outline.append(Heading(page.number, level, text, open_headings[-1] if open_headings else -1))
+                open_headings.append(len(outline) - 1)
+        return outline
+
+    def count(self, *roles):
+        return sum(page.roles.count(role) for page in self.pages for role in roles)
+
+    def to_text(self):
+        return PAGE_SEPARATOR.join(page.render() for page in self.pages)
+
+
+def _edge_lines(page, body_size):
+    # (index, role) of the lines inside the top and bottom bands. Lines set
+    # in heading sizes are slide titles rather than running headers. Pages
+    # without positions (OCR'd text) use their first and last lines.
+    filled = [i for i, line in enumerate(page.lines) if line.strip()]
+    if all(page.positions[i] == NO_POSITION for i in filled):
+        top = filled[:EDGE_LINES]
+        yield from ((i, ROLE_HEADER) for i in top)
+        yield from ((i, ROLE_FOOTER) for i in filled[-EDGE_LINES:] if i not in top)
+        return
+    for i, position in enumerate(page.positions):
+        if not page.lines[i].strip() or position == NO_POSITION:
+            continue
+        if body_size and page.sizes[i] >= body_size * HEADING_SIZE_RATIO:
+            continue
+        if position >= 1 - EDGE_BAND:
+            yield i, ROLE_HEADER
+        elif position <= EDGE_BAND:
+            yield i, ROLE_FOOTER
+
+
+def _mark_boilerplate(pages, body_size):
+    edges = [dict(_edge_lines(page, body_size)) for page in pages]
+    found = find_boilerplate([page.lines for page in pages], edges)
+    for page, roles, marked in zip(pages, edges, found):
+        for i in marked:
+            page.roles[i] = roles[i]
+
+
+def _size_class(size):
+    return round(size / SIZE_STEP) * SIZE_STEP
+
+
+def _body_size(pages):
+    # The size that carries the most text
+    chars = Counter()
+    for page in pages:
+        for line, size in zip(page.lines, page.sizes):
+            if size:
+                chars[_size_class(size)] += len(line.strip())
+    return chars.most_common(1)[0][0] if chars else 0.0
+
+
+def _mark_headings(pages, body_size):
+    if not body_size:
+        return
+    candidates = []
+    chars = Counter()
+    total = 0
+    for page in pages:
+        for i, (line, size, role) in enumerate(zip(page.lines, page.sizes, page.roles)):
+            if role != ROLE_BODY or not size:
+                continue
+            text = line.strip()
+            total += len(text)
+            size = _size_class(size)
+            chars[size] += len(text)
+            if size >= body_size * HEADING_SIZE_RATIO and text and len(text) <= MAX_HEADING_CHARS \
+                    and any(c.isalpha() for c in text):
+                candidates.append((page, i, size))
+
+    sizes = sorted({size for _, _, size in candidates if chars[size] <= MAX_HEADING_SHARE * total}, reverse=True)
+    levels = {size: min(rank + 1, MAX_HEADING_LEVELS) for rank, size in enumerate(sizes)}
+    for page, i, size in candidates:
+        if size in levels:
+            page.roles[i] = ROLE_HEADING + levels[size] - 1
+
+
+def analyze_layout(pages):
+    """
+    Assigns line roles on `pages` (PageLayout records in document order):
+    repeated headers/footers and page numbers first, then headings by font
+    size. Returns the DocumentLayout.
+    """
+    body_size = _body_size(pages)
+    _mark_boilerplate(pages, body_size)
+    _mark_headings(pages, body_size)
+    return DocumentLayout(pages, body_size)
+
+
+def iter_page_layouts(pdf, workers=None, page_timeout=DEFAULT_PAGE_TIMEOUT, page_cache=None):
+    """
+    Yields a PageLayout (without roles) for every page of `pdf` in page
+    order, extracted like extraction.iter_page_texts().
+    """
+    records = iter_page_texts(pdf, workers, page_timeout, page_cache,
+                              extractor=extract_page_layout, cache_namespace=CACHE_NAMESPACE)
+    for number, data in enumerate(records, start=1):
+        yield PageLayout.decode(number, data)
@@ -0,0 +1,180 @@
+"""
+Lightweight latency instrumentation for the upload-to-render pipeline.
+
+Code on the hot path wraps its work in `span(name, **labels)` or records
+values with `observe()` / `inc()`. Everything lands in one process-wide
+registry that can be rendered in the Prometheus text format (optionally
+served on its own port), written to a structured JSON log, or summarised in
+the app's debug panel.
+"""
+import contextlib
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+# --- CONSTANTS ---
+PREFIX = "autostudy_"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RECENT_VALUES = 1000
+RECENT_SPANS = 200
+# The Prometheus endpoint is local-only unless bound elsewhere on purpose
+DEFAULT_HTTP_HOST = "127.0.0.1"
+
+logger = logging.getLogger("autostudy.metrics")
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram that also keeps recent raw values for
+    quantile estimates.
+    """
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_VALUES)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        values = sorted(self.recent)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of histograms and counters keyed by name and labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.spans = deque(maxlen=RECENT_SPANS)
+        self.log_spans = False
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_span(self, name, seconds, labels):
+        record = {"span": name, "seconds": round(seconds, 6), "ts": time.time(), **labels}
+        self.observe(f"{name}_seconds", seconds, **labels)
+        with self._lock:
+            self.spans.append(record)
+        if self.log_spans:
+            logger.info(json.dumps(record))
+
+    def summary(self):
+        """
+        Rows of (metric, labels, count, mean, p50, p95) for display.
+        """
+        with self._lock:
+            items = list(self.histograms.items())
+        rows = []
+        for (name, labels), h in sorted(items):
+            rows.append({
+                "metric": name,
+                "labels": ", ".join(f"{k}={v}" for k, v in labels),
+                "count": h.count,
+                "mean": h.sum / h.count if h.count else 0.0,
+                "p50": h.quantile(0.5),
+                "p95": h.quantile(0.95),
+            })
+        return rows
+
+    def render_prometheus(self):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        for (name, labels), h in histograms:
+            metric = PREFIX + name
+            for bound, count in zip(BUCKETS, h.counts):
+                lines.append(f"{metric}_bucket{_labels(labels, le=bound)} {count}")
+            lines.append(f"{metric}_bucket{_labels(labels, le='+Inf')} {h.count}")
+            lines.append(f"{metric}_sum{_labels(labels)} {h.sum}")
+            lines.append(f"{metric}_count{_labels(labels)} {h.count}")
+        for (name, labels), value in counters:
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+REGISTRY = MetricsRegistry()
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    """
+    Times the enclosed block and records it as `<name>_seconds`.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.record_span(name, time.perf_counter() - start, labels)
+
+
+def observe(name, value, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+def inc(name, value=1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+
+def start_http_server(port, host=DEFAULT_HTTP_HOST):
+    """
+    Serves the registry for Prometheus scraping on a background thread.
+    Only local scrapers can reach it unless another `host` (e.g. "0.0.0.0"
+    for every interface) is given.
+    """
+    # Only processes that export metrics pay for the http.server import
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = REGISTRY.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
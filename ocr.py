@@ -0,0 +1,225 @@
+"""
+OCR fallback for scanned pages.
+
+Pages whose native text layer is (almost) empty but which carry images are
+treated as scans: their embedded page images are run through Tesseract on a
+process pool and the recognized text replaces the empty page, keeping page
+order. OCR is by far the most expensive step, so results are cached by a
+hash of the page images and each document has a page budget.
+
+pytesseract, Pillow and the tesseract binary are optional; without them
+scanned pages simply stay empty.
+"""
+import hashlib
+import importlib.util
+import io
+import logging
+import multiprocessing
+import shutil
+import time
+
+import metrics
+from extraction import default_workers, open_reader, pool_context
+
+# --- CONSTANTS ---
+DEFAULT_PAGE_BUDGET = 50  # pages OCR'd per document, cache hits excluded
+DEFAULT_OCR_TIMEOUT = 60.0  # seconds per page
+DEFAULT_LANGUAGE = "eng"
+# Pages with less native text than this are OCR candidates
+MIN_TEXT_CHARS = 20
+
+logger = logging.getLogger(__name__)
+
+# Per-worker state, set up once by the pool initializer
+_worker_reader = None
+_worker_language = DEFAULT_LANGUAGE
+_worker_timeout = DEFAULT_OCR_TIMEOUT
+
+
+def ocr_available():
+    """
+    True if pytesseract, Pillow and the tesseract binary are all installed.
+    """
+    return (
+        importlib.util.find_spec("pytesseract") is not None
+        and importlib.util.find_spec("PIL") is not None
+        and shutil.which("tesseract") is not None
+    )
+
+
+def _image_xobjects(page):
+    resources = page.get("/Resources")
+    if resources is None:
+        return []
+    xobjects = resources.get_object().get("/XObject")
+    if xobjects is None:
+        return []
+    xobjects = xobjects.get_object()
+    images = []
+    for name in sorted(xobjects):
+        xobject = xobjects[name].get_object()
+        if xobject.get("/Subtype") == "/Image":
+            images.append(xobject)
+    return images
+
+
+def page_image_key(page, language=DEFAULT_LANGUAGE):
+    """
+    Cache key for the OCR text of a page: a hash of its image data and the
+    OCR language. Returns None for pages without images.
+    """
+    try:
+        images = _image_xobjects(page)
+        if not images:
+            return None
+        digest = hashlib.sha256(language.encode("utf-8"))
+        for image in images:
+            digest.update(image.get_data())
+        return digest.hexdigest()
+    except Exception:
+        return None
+
+
+def _recognize_page(page, language, page_timeout=DEFAULT_OCR_TIMEOUT):
+    # Returns (text, seconds), with None as the text if Tesseract ran past
+    # `page_timeout` (it is killed then). Runs inline or in a worker process.
+    import pytesseract
+    from PIL import Image
+
+    start = time.perf_counter()
+    texts = []
+    try:
+        for image_file in page.images:
+            remaining = page_timeout - (time.perf_counter() - start)
+            if remaining <= 0:
+                return None, time.perf_counter() - start
+            with Image.open(io.BytesIO(image_file.data)) as image:
+                text = pytesseract.image_to_string(image, lang=language, timeout=remaining).strip()
+            if text:
+                texts.append(text)
+    except RuntimeError as e:
+        # pytesseract's way of reporting that it killed a Tesseract run
+        if "timeout" in str(e).lower():
+            return None, time.perf_counter() - start
+        logger.debug("OCR failed for a page", exc_info=True)
+    except Exception:
+        # Unsupported image encodings stay empty rather than failing the document
+        logger.debug("OCR failed for a page", exc_info=True)
+    return "\n".join(texts), time.perf_counter() - start
+
+
+def _init_worker(pdf, language, page_timeout):
+    global _worker_reader, _worker_language, _worker_timeout
+    _worker_reader = open_reader(pdf)
+    _worker_language = language
+    _worker_timeout = page_timeout
+
+
+def _recognize(index):
+    return _recognize_page(_worker_reader.pages[index], _worker_language, _worker_timeout)
+
+
+def _iter_recognized(pdf, reader, indices, workers, page_timeout, language):
+    # Yields (index, text) for each page in `indices`; None marks a timeout
+
+    # 1. A single page: recognize inline; Tesseract enforces the timeout
+    if workers <= 1 or len(indices) == 1:
+        for i in indices:
+            text, seconds = _recognize_page(reader.pages[i], language, page_timeout)
+            if text is None:
+                metrics.inc("ocr_page_timeouts_total")
+            else:
+                metrics.observe("ocr_page_seconds", seconds)
+            yield i, text
+        return
+
+    # 2. Several pages: one task per page on a process pool
+    pool = pool_context().Pool(min(workers, len(indices)), initializer=_init_worker, initargs=(pdf, language, page_timeout))
+    try:
+        pending = [(i, pool.apply_async(_recognize, (i,))) for i in indices]
+        for i, result in pending:
+            try:
+                text, seconds = result.get(timeout=page_timeout)
+            except multiprocessing.TimeoutError:
+                text = None
+            if text is None:
+                metrics.inc("ocr_page_timeouts_total")
+                yield i, None
+                continue
+            metrics.observe("ocr_page_seconds", seconds)
+            yield i, text
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _merge(pages, index, ocr_text):
+    # Keep whatever native text a page had unless OCR found more
+    if len(ocr_text.strip()) > len(pages[index].strip()):
+        pages[index] = ocr_text
+
+
+def ocr_missing_pages(
+    pdf,
+    pages,
+    workers=None,
+    page_budget=DEFAULT_PAGE_BUDGET,
+    page_timeout=DEFAULT_OCR_TIMEOUT,
+    language=DEFAULT_LANGUAGE,
+    cache=None,
+):
+    """
+    Fills in scanned pages of `pdf` (bytes or file path).
+
+    `pages` is the list of natively extracted page texts. Returns a new list
+    in which text-less pages with images carry their OCR text. At most
+    `page_budget` pages are recognized; cached pages (`cache` is a
+    study_cache.PageTextCache) do not count against the budget.
+    """
+    candidates = [i for i, text in enumerate(pages) if len(text.strip()) < MIN_TEXT_CHARS]
+    if not candidates or page_budget <= 0:
+        return pages
+
+    reader = open_reader(pdf)
+    keys = {}
+    for i in candidates:
+        key = page_image_key(reader.pages[i], language)
+        if key:
+            keys[i] = key
+    if not keys:
+        return pages
+
+    pages = list(pages)
+    cached = cache.get_many(keys.values()) if cache is not None else {}
+    missing = []
+    for i, key in keys.items():
+        if key in cached:
+            _merge(pages, i, cached[key])
+        else:
+            missing.append(i)
+    metrics.inc("ocr_pages_total", len(keys) - len(missing), result="cached")
+    if not missing:
+        return pages
+
+    if not ocr_available():
+        logger.warning("%d scanned pages skipped: OCR is not installed (pytesseract, Pillow, tesseract)", len(missing))
+        metrics.inc("ocr_pages_total", len(missing), result="unavailable")
+        return pages
+
+    if len(missing) > page_budget:
+        metrics.inc("ocr_pages_total", len(missing) - page_budget, result="over_budget")
+        missing = missing[:page_budget]
+
+    fresh = {}
+    workers = workers or default_workers()
+    with metrics.span("ocr"):
+        for i, text in _iter_recognized(pdf, reader, missing, workers, page_timeout, language):
+            if text is None:
+                continue
+            metrics.inc("ocr_pages_total", result="recognized")
+            fresh[keys[i]] = text
+            _merge(pages, i, text)
+
+    if cache is not None and fresh:
+        cache.set_many(fresh)
+    return pages
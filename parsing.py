@@ -0,0 +1,220 @@
+"""
+Parsing of model output into study kits.
+
+The model is asked for schema-constrained JSON (see json_generation_config()),
+but answers are still validated item by item against that schema. parse_study_kit() repairs
+common defects (code fences, surrounding prose, trailing commas) and, when the
+JSON is still broken, salvages every complete item it can find. It reports
+which sections came out empty so only those need to be requested again.
+
+IncrementalKitParser consumes a streamed answer fragment by fragment and
+reports every summary point, flashcard and quiz question as soon as its
+closing token has arrived, so the UI can render it before the rest of the
+response exists.
+"""
+import json
+import re
+
+import metrics
+
+# --- CONSTANTS ---
+SECTIONS = ("summary_points", "flashcards", "quiz")
+
+_STRING = {"type": "string"}
+SECTION_SCHEMAS = {
+    "summary_points": {"type": "array", "items": _STRING},
+    "flashcards": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {"question": _STRING, "answer": _STRING},
+            "required": ["question", "answer"],
+        },
+    },
+    "quiz": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "question": _STRING,
+                "options": {"type": "array", "items": _STRING},
+                "correct_answer": _STRING,
+            },
+            "required": ["question", "options", "correct_answer"],
+        },
+    },
+}
+TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+
+def json_generation_config(sections=SECTIONS):
+    """
+    Generation config requesting JSON output constrained to the schema of
+    the given sections.
+    """
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": {
+            "type": "object",
+            "properties": {section: SECTION_SCHEMAS[section] for section in sections},
+            "required": list(sections),
+        },
+    }
+
+
+def _is_str(value):
+    return isinstance(value, str) and value.strip() != ""
+
+
+def validate_item(section, item):
+    """
+    True if `item` matches the schema of `section`.
+    """
+    if section == "summary_points":
+        return _is_str(item)
+    if not isinstance(item, dict) or not _is_str(item.get("question")):
+        return False
+    if section == "flashcards":
+        return _is_str(item.get("answer"))
+    options = item.get("options")
+    return (
+        isinstance(options, list)
+        and len(options) >= 2
+        and all(_is_str(option) for option in options)
+        and _is_str(item.get("correct_answer"))
+    )
+
+
+def _repair(response_text):
+    # Drop code fences and any prose around the outermost object, then
+    # remove trailing commas.
+    clean_text = response_text.replace("```json", "").replace("```", "")
+    start = clean_text.find("{")
+    end = clean_text.rfind("}")
+    if start != -1 and end > start:
+        clean_text = clean_text[start:end + 1]
+    return TRAILING_COMMA.sub(r"\1", clean_text)
+
+
+def parse_response(response_text):
+    """
+    Parses the model's JSON answer after repairing common defects.
+    Raises json.JSONDecodeError if it is still not valid JSON.
+    """
+    return json.loads(_repair(response_text))
+
+
+def parse_study_kit(response_text, sections=SECTIONS):
+    """
+    Parses and validates a kit, salvaging what it can from broken output.
+    Returns `(kit, failed_sections)` where failed sections have no valid
+    items and should be requested again.
+    """
+    with metrics.span("parse_response"):
+        return _parse_study_kit(response_text, sections)
+
+
+def _parse_study_kit(response_text, sections):
+    try:
+        data = parse_response(response_text)
+        if not isinstance(data, dict):
+            data = {}
+        pairs = [
+            (section, item)
+            for section in sections
+            if isinstance(data.get(section), list)
+            for item in data[section]
+        ]
+    except json.JSONDecodeError:
+        # Truncated or otherwise invalid JSON: keep every complete item
+        metrics.inc("parse_repairs_total")
+        pairs = IncrementalKitParser().feed(TRAILING_COMMA.sub(r"\1", response_text))
+
+    kit = {section: [] for section in sections}
+    for section, item in pairs:
+        if section in kit and validate_item(section, item):
+            kit[section].append(item)
+    failed = [section for section in sections if not kit[section]]
+    return kit, failed
+
+
+class IncrementalKitParser:
+    """
+    Streaming scanner over the kit JSON.
+
+    It tracks nesting depth and string state character by character. Items
+    are the direct children of the top-level section arrays (depth 2); each is
+    decoded with json.loads once it is closed. Text before the first `{`
+    (such as a code fence) is ignored.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_key = None
+        self.section = None
+        self.item_start = None
+
+    def feed(self, fragment):
+        """
+        Adds a fragment of the response and returns the list of
+        (section, item) pairs completed by it.
+        """
+        self.buffer += fragment
+        completed = []
+        buf = self.buffer
+
+        for pos in range(self.pos, len(buf)):
+            ch = buf[pos]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    self._close_string(pos, completed)
+                continue
+
+            if ch == '"':
+                if self.depth >= 1:
+                    self.in_string = True
+                    self.string_start = pos
+            elif ch in "{[":
+                if self.depth == 2 and self.section and ch == "{":
+                    self.item_start = pos
+                if self.depth == 1 and ch == "[":
+                    self.section = self.last_key if self.last_key in SECTIONS else None
+                self.depth += 1
+            elif ch in "}]" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 2 and self.item_start is not None and ch == "}":
+                    self._emit(buf[self.item_start:pos + 1], completed)
+                    self.item_start = None
+                elif self.depth == 1:
+                    self.section = None
+
+        self.pos = len(buf)
+        return completed
+
+    def _close_string(self, pos, completed):
+        raw = self.buffer[self.string_start:pos + 1]
+        if self.depth == 1:
+            try:
+                self.last_key = json.loads(raw)
+            except json.JSONDecodeError:
+                self.last_key = None
+        elif self.depth == 2 and self.section and self.item_start is None:
+            self._emit(raw, completed)
+
+    def _emit(self, raw, completed):
+        try:
+            completed.append((self.section, json.loads(raw)))
+        except json.JSONDecodeError:
+            # Malformed item: skip it and keep streaming the rest
+            pass
@@ -0,0 +1,288 @@
+"""
+Upload-to-kit pipeline, independent of the Streamlit UI.
+
+build_study_kit() takes an uploaded PDF (an uploads.PdfSource) through the
+cache lookup, text extraction and chunked generation, reporting its progress
+through a callback. With the `layout` option, extraction reads each page's
+layout to drop running headers and footers and mark headings, which chunks
+are then split on. Extracted text goes to an on-disk TextStore keyed by the
+PDF's content hash and extraction mode rather than being kept in session
+memory. Scanned pages without a text layer go through the OCR fallback.
+Optional page and chunk caches make re-uploads of edited documents
+incremental: only new pages are parsed and only changed chunks are
+generated, and document contexts let follow-up requests refer to text
+already sent. With an embedder, documents over their token budget are cut
+down to their most representative passages and reworded duplicate items are
+dropped. It is what background jobs run, and it never touches
+st.session_state.
+"""
+import metrics
+from admission import run_scoped
+from extraction import DEFAULT_PAGE_TIMEOUT, PAGE_SEPARATOR, iter_page_texts
+from generation import (
+    DEFAULT_MAX_CONCURRENCY,
+    MAX_PROMPT_TOKENS,
+    MODEL_NAME,
+    PROMPT_VERSION,
+    agenerate_more,
+    astream_study_kit,
+    select_representative_text,
+)
+from layout import HEADING_ROLES, ROLE_FOOTER, ROLE_HEADER, PageLayout, analyze_layout, iter_page_layouts
+from ocr import DEFAULT_LANGUAGE, DEFAULT_PAGE_BUDGET, ocr_missing_pages
+from prompt_budget import compress_document, estimate_tokens
+from study_cache import make_cache_key
+
+# --- CONSTANTS ---
+EMPTY_DOCUMENT_MESSAGE = "Could not extract text from the PDF. It might be empty or scanned."
+# Options that change the generated kit, with the values used when unset
+KIT_OPTION_DEFAULTS = {
+    "layout": False,
+    "max_prompt_tokens": MAX_PROMPT_TOKENS,
+    "split_sections": True,
+    "document_token_budget": None,
+}
+
+
+class EmptyDocumentError(Exception):
+    """
+    Raised when no text could be extracted from a PDF.
+    """
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+def kit_cache_key(digest, options=None):
+    """
+    StudyKitCache key of the kit generated for the PDF with content hash
+    `digest`: it also depends on the model, the prompt version and the
+    options that change the kit (KIT_OPTION_DEFAULTS).
+    """
+    options = options or {}
+    settings = {name: options.get(name, default) for name, default in KIT_OPTION_DEFAULTS.items()}
+    return make_cache_key(digest, MODEL_NAME, PROMPT_VERSION, settings)
+
+
+def text_store_key(digest, options=None):
+    """
+    TextStore key of the text extracted from the PDF with content hash
+    `digest`; layout and plain extraction produce different text.
+    """
+    return digest + "-layout" if (options or {}).get("layout") else digest
+
+
+def extract_text_from_pdf(pdf, options=None, page_cache=None, ocr_cache=None):
+    """
+    Extracts the text of a PDF (bytes or file path) using the extraction
+    settings in `options` (`workers`, `page_timeout`, `ocr_budget`,
+    `ocr_language`, `layout`). Text-less pages are OCR'd, up to `ocr_budget`
+    pages. With `layout`, the text is rendered from the document's layout
+    (see layout.DocumentLayout.to_text()).
+    """
+    options = options or {}
+    if options.get("layout"):
+        return extract_layout_from_pdf(pdf, options, page_cache, ocr_cache).to_text()
+    with metrics.span("extract_text"):
+        pages = list(iter_page_texts(
+            pdf,
+            workers=options.get("workers"),
+            page_timeout=options.get("page_timeout", DEFAULT_PAGE_TIMEOUT),
+            page_cache=page_cache,
+        ))
+    pages = ocr_missing_pages(
+        pdf,
+        pages,
+        workers=options.get("workers"),
+        page_budget=options.get("ocr_budget", DEFAULT_PAGE_BUDGET),
+        language=options.get("ocr_language", DEFAULT_LANGUAGE),
+        cache=ocr_cache,
+    )
+    return PAGE_SEPARATOR.join(pages)
+
+
+def extract_layout_from_pdf(pdf, options=None, page_cache=None, ocr_cache=None):
+    """
+    Extracts the layout.DocumentLayout of a PDF, with the same settings and
+    OCR fallback as extract_text_from_pdf(). OCR'd pages are plain body text.
+    """
+    options = options or {}
+    with metrics.span("extract_text", mode="layout"):
+        pages = list(iter_page_layouts(
+            pdf,
+            workers=options.get("workers"),
+            page_timeout=options.get("page_timeout", DEFAULT_PAGE_TIMEOUT),
+            page_cache=page_cache,
+        ))
+    texts = [page.text() for page in pages]
+    recognized = ocr_missing_pages(
+        pdf,
+        texts,
+        workers=options.get("workers"),
+        page_budget=options.get("ocr_budget", DEFAULT_PAGE_BUDGET),
+        language=options.get("ocr_language", DEFAULT_LANGUAGE),
+        cache=ocr_cache,
+    )
+    pages = [page if text == before else PageLayout.from_text(page.number, text)
+             for page, before, text in zip(pages, texts, recognized)]
+    with metrics.span("analyze_layout"):
+        layout = analyze_layout(pages)
+    metrics.inc("layout_lines_total", layout.count(ROLE_HEADER, ROLE_FOOTER), role="boilerplate")
+    metrics.inc("layout_lines_total", layout.count(*HEADING_ROLES), role="heading")
+    return layout
+
+
+def prepare_text(text_content, options=None, embedder=None, index_store=None):
+    """
+    The text that chunks are cut from: boilerplate stripped (layout text
+    has its headers and footers removed already) and, with an `embedder`,
+    text over the `document_token_budget` option reduced to its most
+    representative passages (their vectors are kept in `index_store`).
+    Follow-up requests prepare the text the same way, so their chunks match
+    the first generation's and its document contexts are reused.
+    """
+    options = options or {}
+    with metrics.span("compress_text"):
+        text_content = compress_document(text_content, strip_boilerplate=not options.get("layout"))
+    token_budget = options.get("document_token_budget")
+    if embedder is not None and token_budget:
+        text_content = select_representative_text(text_content, token_budget, embedder, index_store)
+    return text_content
+
+
+def generate_study_material(
+    text_content,
+    client,
+    options=None,
+    on_item=None,
+    on_progress=None,
+    chunk_cache=None,
+    contexts=None,
+    session=None,
+    embedder=None,
+    index_store=None,
+):
+    """
+    Generates the study kit for extracted text, streaming each completed
+    item to `on_item(section, item)`. The text is prepared first (see
+    prepare_text()), and chunks are sized to the `max_prompt_tokens`
+    option. With an `embedder`, near-duplicate items are dropped. Model
+    calls are admitted on behalf of `session`, with shorter documents going
+    first.
+    """
+    options = options or {}
+    text_content = prepare_text(text_content, options, embedder, index_store)
+    with metrics.span("generate_study_material"):
+        return client.run(run_scoped(astream_study_kit(
+            text_content,
+            client,
+            on_item or _noop,
+            max_prompt_tokens=options.get("max_prompt_tokens", MAX_PROMPT_TOKENS),
+            max_concurrency=options.get("max_concurrency", DEFAULT_MAX_CONCURRENCY),
+            on_progress=on_progress,
+            chunk_cache=chunk_cache,
+            split_sections=options.get("split_sections", True),
+            contexts=contexts,
+            embedder=embedder,
+        ), session, priority=estimate_tokens(text_content)))
+
+
+def generate_more(
+    text_content,
+    client,
+    section,
+    existing,
+    round_index=0,
+    options=None,
+    contexts=None,
+    session=None,
+    embedder=None,
+    index_store=None,
+):
+    """
+    Generates more items for one section of an existing kit and returns the
+    new ones; see generation.agenerate_more(). The text is prepared like for
+    the first generation. Being a single short call, it is admitted ahead of
+    whole-document generation.
+    """
+    options = options or {}
+    text_content = prepare_text(text_content, options, embedder, index_store)
+    with metrics.span("generate_more"):
+        return client.run(run_scoped(agenerate_more(
+            text_content,
+            client,
+            section,
+            existing,
+            round_index,
+            max_prompt_tokens=options.get("max_prompt_tokens", MAX_PROMPT_TOKENS),
+            contexts=contexts,
+            embedder=embedder,
+        ), session))
+
+
+def build_study_kit(
+    source,
+    client,
+    cache=None,
+    options=None,
+    report=None,
+    on_item=None,
+    text_store=None,
+    page_cache=None,
+    chunk_cache=None,
+    ocr_cache=None,
+    contexts=None,
+    session=None,
+    embedder=None,
+    index_store=None,
+):
+    """
+    Runs the whole pipeline for one PdfSource and returns the study kit.
+
+    `report(state, done=None, total=None)` receives the stages
+    "extracting", "generating" (with chunk counts) and "merging".
+    Raises EmptyDocumentError if the PDF has no extractable text, and
+    generation.PartialKitError if only some chunks produced a kit; only
+    complete kits, with every section filled, are cached.
+    """
+    report = report or _noop
+
+    # 1. Previously generated kit for the same PDF
+    cache_key = kit_cache_key(source.digest, options)
+    if cache is not None:
+        data = cache.get(cache_key)
+        metrics.inc("study_cache_requests_total", result="hit" if data else "miss")
+        if data:
+            return data
+
+    # 2. Extract Text
+    text_key = text_store_key(source.digest, options)
+    text = text_store.get(text_key) if text_store is not None else None
+    if text is None:
+        report("extracting")
+        text = extract_text_from_pdf(source.pdf, options, page_cache, ocr_cache)
+        if text_store is not None:
+            text_store.set(text_key, text)
+    if not text or not text.strip():
+        raise EmptyDocumentError(EMPTY_DOCUMENT_MESSAGE)
+
+    # 3. Generate Study Material
+    data = generate_study_material(
+        text,
+        client,
+        options,
+        on_item=on_item,
+        on_progress=lambda done, total: report("generating", done, total),
+        chunk_cache=chunk_cache,
+        contexts=contexts,
+        session=session,
+        embedder=embedder,
+        index_store=index_store,
+    )
+
+    report("merging")
+    # Like chunk kits, kits with an empty section are not cached
+    if data and all(data.values()) and cache is not None:
+        cache.set(cache_key, data)
+    return data
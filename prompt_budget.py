@@ -0,0 +1,109 @@
+"""
+Token budgeting and extractive pre-compression of document text.
+
+estimate_tokens() is a local, dependency-free approximation of the model's
+tokenizer (word pieces of about four ASCII characters, one token per
+punctuation mark), tuned to over- rather than under-count so prompts stay
+inside their budget. compress_document() drops text that costs tokens but
+carries no study material: headers and footers repeated across pages, page
+numbers and a trailing references section.
+"""
+import re
+from collections import Counter
+
+from extraction import PAGE_SEPARATOR
+
+# --- CONSTANTS ---
+CHARS_PER_TOKEN = 4
+# Non-ASCII scripts tokenize much less densely than English
+NON_ASCII_CHARS_PER_TOKEN = 2
+# Lines this close to the top or bottom of a page may be headers/footers
+EDGE_LINES = 2
+# A line is boilerplate when it repeats on at least this share of pages
+REPEAT_FRACTION = 0.5
+MIN_REPEAT_PAGES = 3
+# A references heading only counts in the second half of the document
+REFERENCES_MIN_POSITION = 0.5
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+DIGITS = re.compile(r"\d+")
+PAGE_NUMBER = re.compile(
+    r"^\s*(?:page\s+)?[-–—]?\s*\d{1,4}\s*[-–—]?\s*(?:(?:/|of)\s*\d{1,4})?\s*$",
+    re.IGNORECASE,
+)
+# A heading line, which may open a page (right after the page separator) and
+# carry the "#" marks of layout-extracted headings
+REFERENCES_HEADING = re.compile(
+    r"(?:^|(?<=\f))[ \t]*(?:#{1,6}[ \t]*)?(?:\d+\.?[ \t]*)?"
+    r"(?:references|bibliography|works cited|literature cited|sources)[ \t]*:?[ \t]*(?:$|(?=\f))",
+    re.IGNORECASE | re.MULTILINE,
+)
+EXTRA_BLANK_LINES = re.compile(r"\n\s*\n(?:\s*\n)+")
+
+
+def estimate_tokens(text):
+    """
+    Approximate number of model tokens in `text`.
+    """
+    tokens = 0
+    for piece in TOKEN_PATTERN.findall(text):
+        per_token = CHARS_PER_TOKEN if piece.isascii() else NON_ASCII_CHARS_PER_TOKEN
+        tokens += -(-len(piece) // per_token)
+    return tokens
+
+
+def _normalize(line):
+    # Running headers differ only in their page number
+    return DIGITS.sub("#", " ".join(line.lower().split()))
+
+
+def _edge_indices(lines):
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return set(filled[:EDGE_LINES] + filled[-EDGE_LINES:])
+
+
+def find_boilerplate(pages, edges):
+    """
+    Finds the running headers and footers of a document. `pages` holds the
+    lines of each page and `edges` the indices of the lines near each page's
+    top or bottom edge. Returns the set of indices per page of the edge
+    lines that are page numbers or repeat on enough pages. A page made only
+    of such lines keeps them, as it is content (e.g. one-line slides).
+    """
+    edges = [list(indices) for indices in edges]
+    counts = Counter()
+    for lines, indices in zip(pages, edges):
+        counts.update({_normalize(lines[i]) for i in indices})
+    threshold = max(MIN_REPEAT_PAGES, REPEAT_FRACTION * len(pages))
+    repeated = {line for line, count in counts.items() if count >= threshold}
+
+    found = []
+    for lines, indices in zip(pages, edges):
+        marked = {i for i in indices if PAGE_NUMBER.match(lines[i]) or _normalize(lines[i]) in repeated}
+        found.append(marked if len(marked) < sum(1 for line in lines if line.strip()) else set())
+    return found
+
+
+def _drop_references(text):
+    headings = list(REFERENCES_HEADING.finditer(text))
+    if not headings:
+        return text
+    start = headings[-1].start()
+    if start < len(text) * REFERENCES_MIN_POSITION:
+        return text
+    return text[:start].rstrip()
+
+
+def compress_document(text, strip_boilerplate=True):
+    """
+    Returns `text` without repeated headers/footers, page numbers and a
+    trailing references section. Page separators are kept. Text whose
+    headers and footers are already gone (e.g. layout-extracted text) is
+    passed with `strip_boilerplate=False`.
+    """
+    pages = [page.split("\n") for page in text.split(PAGE_SEPARATOR)]
+    if strip_boilerplate:
+        found = find_boilerplate(pages, [_edge_indices(lines) for lines in pages])
+        pages = [[line for i, line in enumerate(lines) if i not in marked] for lines, marked in zip(pages, found)]
+    text = PAGE_SEPARATOR.join(EXTRA_BLANK_LINES.sub("\n\n", "\n".join(lines)) for lines in pages)
+    return _drop_references(text)
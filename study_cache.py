@@ -0,0 +1,248 @@
+"""
+Persistent, content-addressed on-disk stores.
+
+Entries are stored as one file per key inside a directory, so a store is
+shared by every Streamlit session and worker process on the node. Writes go
+through a temp file + os.replace, which makes them atomic for concurrent
+readers. Recency is tracked with the file modification time and the
+directory is trimmed back under its size budget in LRU order.
+
+StudyKitCache holds generated kits (JSON), either for whole documents or
+for single chunks; TextStore holds extracted document text, so sessions only
+need to keep a content hash. PageTextCache holds the text of individual
+pages, keyed by page content hash (or, for OCR output, by page image hash);
+it sees many tiny entries, so it lives in one SQLite file instead of a file
+per key.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+# --- CONSTANTS ---
+DEFAULT_CACHE_DIR = os.path.join(".cache", "study_kits")
+DEFAULT_TEXT_DIR = os.path.join(".cache", "texts")
+DEFAULT_CHUNK_DIR = os.path.join(".cache", "chunk_kits")
+DEFAULT_PAGE_CACHE_PATH = os.path.join(".cache", "pages.sqlite3")
+DEFAULT_OCR_CACHE_PATH = os.path.join(".cache", "ocr.sqlite3")
+SQLITE_MAX_VARIABLES = 500
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256 MB
+
+
+def make_cache_key(pdf_digest, model_name, prompt_version, settings=None):
+    """
+    Builds a cache key from the uploaded PDF's content hash plus the model
+    and prompt version that produced the kit, and optionally a dict of
+    `settings` that shaped it. Changing any of them invalidates old entries.
+    """
+    digest = hashlib.sha256()
+    for part in (pdf_digest, model_name, str(prompt_version)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    if settings:
+        digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class DiskLRUStore:
+    """
+    Size-bounded LRU store of byte blobs living on local disk.
+    """
+
+    suffix = ".bin"
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def get_bytes(self, key):
+        """
+        Returns the stored blob for `key`, or None on a miss.
+        A hit refreshes the entry's position in the LRU order.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            # Entry was evicted by another process in the meantime
+            pass
+        return data
+
+    def set_bytes(self, key, data):
+        """
+        Stores a blob atomically and trims the store back under its size budget.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until the store fits in max_bytes.
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class StudyKitCache(DiskLRUStore):
+    """
+    LRU cache of generated study kits, stored as JSON.
+    """
+
+    suffix = ".json"
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+
+    def get(self, key):
+        """
+        Returns the cached kit for `key`, or None on a miss.
+        """
+        data = self.get_bytes(key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError:
+            return None
+
+    def set(self, key, data):
+        self.set_bytes(key, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+class TextStore(DiskLRUStore):
+    """
+    LRU store of extracted document text, keyed by the PDF's content hash.
+    """
+
+    suffix = ".txt"
+
+    def __init__(self, cache_dir=DEFAULT_TEXT_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+
+    def get(self, key):
+        data = self.get_bytes(key)
+        return None if data is None else data.decode("utf-8")
+
+    def set(self, key, text):
+        self.set_bytes(key, text.encode("utf-8"))
+
+
+class PageTextCache:
+    """
+    Size-bounded LRU cache of extracted page text, keyed by page content hash
+    (see extraction.page_key) or page image hash (see ocr.page_image_key).
+    """
+
+    def __init__(self, path=DEFAULT_PAGE_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " key TEXT PRIMARY KEY,"
+                " text TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_used_at ON pages (used_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, keys):
+        """
+        Returns a {key: text} dict for the keys that are cached.
+        Hits refresh the entries' position in the LRU order.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._connect() as conn:
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                batch = keys[start:start + SQLITE_MAX_VARIABLES]
+                marks = ",".join("?" * len(batch))
+                found.update(conn.execute(f"SELECT key, text FROM pages WHERE key IN ({marks})", batch))
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE pages SET used_at = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def set_many(self, items):
+        """
+        Stores {key: text} entries and trims the cache back under its size budget.
+        """
+        now = time.time()
+        rows = [(key, text, len(text.encode("utf-8")), now) for key, text in items.items()]
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO pages (key, text, size, used_at) VALUES (?, ?, ?, ?)", rows)
+            self.evict(conn)
+
+    def evict(self, conn):
+        """
+        Removes least recently used pages until the cache fits in max_bytes.
+        """
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM pages ORDER BY used_at"):
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= size
+        conn.executemany("DELETE FROM pages WHERE key = ?", doomed)
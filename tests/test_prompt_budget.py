@@ -0,0 +1,26 @@
+from extraction import PAGE_SEPARATOR
+from prompt_budget import compress_document
+
+BODY = "\n".join(f"Line {i} of the lecture body text." for i in range(8))
+
+
+def test_references_heading_at_top_of_page_is_dropped():
+    text = PAGE_SEPARATOR.join([BODY, BODY, "References\n[1] A. Author. A paper. 2020."])
+    compressed = compress_document(text)
+    assert "A paper" not in compressed
+    assert compressed.endswith("Line 7 of the lecture body text.")
+
+
+def test_references_heading_mid_page_is_dropped():
+    text = PAGE_SEPARATOR.join([BODY, BODY + "\nBibliography:\n[1] A. Author. A paper. 2020."])
+    assert "A paper" not in compress_document(text)
+
+
+def test_early_references_heading_is_kept():
+    text = PAGE_SEPARATOR.join(["References\n" + BODY, BODY, BODY])
+    assert compress_document(text).startswith("References")
+
+
+def test_layout_references_heading_is_dropped():
+    text = PAGE_SEPARATOR.join([BODY, BODY, "# 7. References\n[1] A. Author. A paper. 2020."])
+    assert "A paper" not in compress_document(text, strip_boilerplate=False)
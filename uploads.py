@@ -0,0 +1,107 @@
+"""
+Memory-bounded handling of uploaded PDFs.
+
+spool_upload() copies an upload in fixed-size blocks while hashing it. Uploads
+within the per-session memory cap stay in memory; larger ones are spooled to a
+content-addressed file on disk, which the extraction engine and its worker
+processes read through a memory map instead of private copies of the bytes.
+"""
+import hashlib
+import os
+import tempfile
+
+# --- CONSTANTS ---
+DEFAULT_SPOOL_DIR = os.path.join(".cache", "uploads")
+DEFAULT_MEMORY_CAP = 16 * 1024 * 1024  # 16 MB
+BLOCK_SIZE = 1024 * 1024
+
+
+class PdfSource:
+    """
+    Handle to an uploaded PDF: its SHA-256 `digest`, its `size` and either the
+    bytes themselves (`data`) or the `path` of the spooled file.
+    """
+
+    def __init__(self, digest, size, data=None, path=None):
+        self.digest = digest
+        self.size = size
+        self.data = data
+        self.path = path
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(hashlib.sha256(data).hexdigest(), len(data), data=data)
+
+    @classmethod
+    def from_path(cls, path):
+        """
+        Hashes a PDF on disk in blocks; extraction then memory-maps it. The
+        file belongs to the caller, so do not discard() the result.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                size += len(block)
+        return cls(digest.hexdigest(), size, path=path)
+
+    @property
+    def pdf(self):
+        """
+        What the extraction engine reads: the bytes, or the spooled file path.
+        """
+        return self.data if self.data is not None else self.path
+
+    def discard(self):
+        """
+        Removes the spooled file, if any.
+        """
+        if self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def spool_upload(uploaded_file, spool_dir=DEFAULT_SPOOL_DIR, memory_cap=DEFAULT_MEMORY_CAP):
+    """
+    Returns a PdfSource for a file-like upload, spooling it to disk when it
+    is larger than `memory_cap` bytes.
+    """
+    uploaded_file.seek(0)
+    digest = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=memory_cap)
+    size = 0
+    try:
+        while True:
+            block = uploaded_file.read(BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            spool.write(block)
+            size += len(block)
+        uploaded_file.seek(0)
+
+        if size <= memory_cap:
+            spool.seek(0)
+            return PdfSource(digest.hexdigest(), size, data=spool.read())
+
+        # Over the cap: move the spooled bytes into the content-addressed file
+        os.makedirs(spool_dir, exist_ok=True)
+        path = os.path.join(spool_dir, digest.hexdigest() + ".pdf")
+        fd, tmp_path = tempfile.mkstemp(dir=spool_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            spool.seek(0)
+            while True:
+                block = spool.read(BLOCK_SIZE)
+                if not block:
+                    break
+                f.write(block)
+        os.replace(tmp_path, path)
+        return PdfSource(digest.hexdigest(), size, path=path)
+    finally:
+        spool.close()
@@ -0,0 +1,283 @@
+"""
+Local vector index over document passages and generated items.
+
+Texts are embedded into L2-normalized float32 vectors kept in one NumPy
+matrix, so comparing a text with everything indexed is a single
+matrix-vector product. Embedders are pluggable: any object with a `name`,
+a `duplicate_threshold` and `embed(texts)` returning an (n, dim) array.
+HashingEmbedder is the deterministic local default and needs nothing beyond
+NumPy; SentenceTransformerEmbedder runs a small CPU model when
+sentence-transformers is installed.
+
+The index drives two things:
+- select_representative() picks the passages that best cover a document
+  within a token budget (maximal marginal relevance around the document's
+  centroid), so documents too long to send whole spend their budget on
+  their core topics rather than on their first pages.
+- NearDuplicateFilter drops generated flashcards and quiz questions that
+  repeat earlier ones in different words, which exact matching misses.
+
+Passage vectors persist as compressed float16 .npz blobs in a
+VectorIndexStore, so a document is embedded once.
+"""
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import re
+import zlib
+
+import numpy as np
+
+from study_cache import DEFAULT_MAX_BYTES, DiskLRUStore
+
+# --- CONSTANTS ---
+DEFAULT_INDEX_DIR = os.path.join(".cache", "vectors")
+HASHING_DIM = 1024
+DEFAULT_ST_MODEL = "all-MiniLM-L6-v2"
+# Weight of centrality against novelty when picking representative passages
+MMR_LAMBDA = 0.7
+INITIAL_CAPACITY = 64
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how in is it its of on or that the their this "
+    "to was were what when where which who why with".split()
+)
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(vectors):
+    """
+    Scales each row to unit length; all-zero rows stay zero.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class HashingEmbedder:
+    """
+    Feature-hashed bag of words and word bigrams (stop words removed,
+    sublinear counts). Deterministic across processes and machines.
+    """
+
+    # Hashed word overlap is cruder than a model, so only near-verbatim
+    # rewordings count as duplicates
+    duplicate_threshold = 0.8
+
+    def __init__(self, dim=HASHING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text):
+        words = [w for w in TOKEN_PATTERN.findall(text.lower()) if w not in STOPWORDS]
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                # The top bit picks the sign so collisions cancel out on average
+                vectors[row, h % self.dim] += -1.0 if h >> 31 else 1.0
+        return normalize(np.sign(vectors) * np.log1p(np.abs(vectors)))
+
+
+class SentenceTransformerEmbedder:
+    """
+    Sentence embeddings from a local sentence-transformers model on the CPU.
+    """
+
+    duplicate_threshold = 0.9
+
+    def __init__(self, model_name=DEFAULT_ST_MODEL):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = f"st-{model_name}"
+
+    def embed(self, texts):
+        return normalize(self.model.encode(list(texts), batch_size=32, convert_to_numpy=True))
+
+
+def make_embedder(spec="hashing"):
+    """
+    Embedder for a setting value: "hashing", "sentence-transformers" (or
+    "sentence-transformers:<model>") or "off" (returns None). Falls back to
+    hashing when sentence-transformers is not installed.
+    """
+    spec = (spec or "off").strip()
+    if spec.lower() in ("off", "none", "false", ""):
+        return None
+    kind, _, model_name = spec.partition(":")
+    if kind == "sentence-transformers":
+        if importlib.util.find_spec("sentence_transformers") is not None:
+            return SentenceTransformerEmbedder(model_name or DEFAULT_ST_MODEL)
+        logger.warning("sentence-transformers is not installed, using hashed embeddings")
+    elif kind != "hashing":
+        logger.warning("Unknown embedder %r, using hashed embeddings", spec)
+    return HashingEmbedder()
+
+
+class VectorIndex:
+    """
+    Growable matrix of unit vectors with cosine similarity search.
+    """
+
+    def __init__(self, dim, vectors=None):
+        self.dim = dim
+        self._data = np.zeros((INITIAL_CAPACITY, dim), dtype=np.float32)
+        self._size = 0
+        if vectors is not None:
+            self.add(vectors)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def vectors(self):
+        return self._data[:self._size]
+
+    def add(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        needed = self._size + len(vectors)
+        if needed > len(self._data):
+            # Amortized O(1) appends for one-at-a-time streaming
+            grown = np.zeros((max(needed, 2 * len(self._data)), self.dim), dtype=np.float32)
+            grown[:self._size] = self.vectors
+            self._data = grown
+        self._data[self._size:needed] = vectors
+        self._size = needed
+
+    def similarities(self, vector):
+        """
+        Cosine similarity of `vector` to every indexed vector.
+        """
+        return self.vectors @ np.asarray(vector, dtype=np.float32)
+
+    def search(self, vector, k=5):
+        """
+        Returns (indices, scores) of the `k` most similar vectors, best first.
+        """
+        scores = self.similarities(vector)
+        k = min(k, len(scores))
+        if k == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, vectors=self.vectors.astype(np.float16))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data)) as archive:
+            vectors = normalize(archive["vectors"])
+        return cls(vectors.shape[1], vectors)
+
+
+class VectorIndexStore(DiskLRUStore):
+    """
+    LRU store of passage indexes, keyed by text and embedder.
+    """
+
+    suffix = ".npz"
+
+    def __init__(self, cache_dir=DEFAULT_INDEX_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+
+    def get(self, key):
+        data = self.get_bytes(key)
+        if data is None:
+            return None
+        try:
+            return VectorIndex.from_bytes(data)
+        except Exception:
+            return None
+
+    def set(self, key, index):
+        self.set_bytes(key, index.to_bytes())
+
+
+def index_key(passages, embedder):
+    digest = hashlib.sha256(embedder.name.encode("utf-8"))
+    for passage in passages:
+        digest.update(b"\0")
+        digest.update(passage.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_index(passages, embedder, store=None):
+    """
+    Index of `passages`, loaded from `store` when they were embedded before.
+    """
+    key = index_key(passages, embedder) if store is not None else None
+    index = store.get(key) if store is not None else None
+    if index is not None and len(index) == len(passages):
+        return index
+    vectors = embedder.embed(passages)
+    index = VectorIndex(vectors.shape[1], vectors)
+    if store is not None:
+        store.set(key, index)
+    return index
+
+
+def select_representative(index, costs, budget, mmr_lambda=MMR_LAMBDA):
+    """
+    Picks passages whose total cost (e.g. tokens) fits `budget`, favouring
+    passages close to the document centroid that are unlike those already
+    picked. Returns their indices in document order.
+    """
+    vectors = index.vectors
+    costs = np.asarray(costs)
+    if not len(vectors):
+        return []
+    centroid = vectors.mean(axis=0)
+    relevance = vectors @ (centroid / max(np.linalg.norm(centroid), 1e-12))
+
+    chosen = []
+    remaining = budget
+    closest = np.zeros(len(vectors), dtype=np.float32)
+    available = costs <= remaining
+    while available.any():
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * closest
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        chosen.append(best)
+        remaining -= costs[best]
+        closest = np.maximum(closest, vectors @ vectors[best])
+        available[best] = False
+        available &= costs <= remaining
+    return sorted(chosen)
+
+
+class NearDuplicateFilter:
+    """
+    Per-section memory of item embeddings that rejects items too similar to
+    one already accepted.
+    """
+
+    def __init__(self, embedder, threshold=None):
+        self.embedder = embedder
+        self.threshold = threshold if threshold is not None else embedder.duplicate_threshold
+        self._indexes = {}
+
+    def admit(self, section, text):
+        """
+        Returns True and remembers `text` if it is not a near duplicate of
+        an earlier item in `section`.
+        """
+        vector = self.embedder.embed([text])[0]
+        index = self._indexes.get(section)
+        if index is None:
+            index = self._indexes[section] = VectorIndex(len(vector))
+        elif len(index) and float(index.similarities(vector).max()) >= self.threshold:
+            return False
+        index.add(vector)
+        return True